@@ -0,0 +1,266 @@
+"""
+Backend Router - Sends each request to the fastest healthy inference backend
+Tracks rolling latency and errors per backend, fails over on errors, and can
+hedge a slow request with a second backend (the loser is cancelled)
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Backends to route across, in preference order for ties: medgemma, gemini, local
+ROUTER_BACKENDS = [b.strip() for b in os.getenv("ROUTER_BACKENDS", "medgemma,gemini").split(",") if b.strip()]
+# Rolling window of recent calls per backend and kind of call
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+# A backend whose recent error rate exceeds this is skipped until the cooldown passes
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "30"))
+# Hedging: when the first backend is slower than this percentile of its own
+# recent latency, send the same request to the next backend too
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "true").lower() == "true"
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", "0.95"))
+ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("ROUTER_HEDGE_MIN_SAMPLES", "10"))
+
+
+class BackendStats:
+    """Rolling latency (successful calls) and outcomes (all calls) for one backend."""
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        # kind of call -> recent latencies in seconds
+        self.latencies = {}
+        self.outcomes = deque(maxlen=window)
+        self.window = window
+        self.last_error_at = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, kind: str, seconds: float, ok: bool):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+        else:
+            self.errors += 1
+            self.last_error_at = time.monotonic()
+
+    def percentile(self, kind: str, q: float) -> Optional[float]:
+        samples = sorted(self.latencies.get(kind, ()))
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def samples(self, kind: str) -> int:
+        return len(self.latencies.get(kind, ()))
+
+    @property
+    def error_rate(self) -> float:
+        return 1 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def healthy(self) -> bool:
+        # After the cooldown an unhealthy backend gets traffic again as a probe
+        return (self.error_rate <= ROUTER_MAX_ERROR_RATE
+                or time.monotonic() - self.last_error_at > ROUTER_COOLDOWN_SECONDS)
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 3),
+            "healthy": self.healthy,
+            "latency": {
+                kind: {
+                    "p50_ms": round(self.percentile(kind, 0.5) * 1000),
+                    "p95_ms": round(self.percentile(kind, 0.95) * 1000),
+                    "samples": self.samples(kind),
+                }
+                for kind in self.latencies if self.latencies[kind]
+            },
+        }
+
+
+class BackendRouter:
+    """
+    Routes extraction and explanation calls across several clients.
+    Exposes the same async interface as the individual clients.
+    """
+
+    def __init__(self, backends: dict):
+        """
+        Args:
+            backends: name -> client (MedGemmaAPIClient, GeminiClient or InferenceWorker),
+                in preference order for backends without latency data yet
+        """
+        if not backends:
+            raise ValueError("BackendRouter needs at least one backend")
+        self.backends = backends
+        self.model_id = "+".join(client.model_id for client in backends.values())
+        self.backend_stats = {name: BackendStats() for name in backends}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    async def start(self):
+        for client in self.backends.values():
+            await client.start()
+
+    async def aclose(self):
+        for client in self.backends.values():
+            await client.aclose()
+
+    def ranked(self, kind: str) -> list[str]:
+        """Healthy backends first, then by median latency; backends without data are tried first."""
+        order = list(self.backends)
+
+        def key(name: str):
+            stats = self.backend_stats[name]
+            p50 = stats.percentile(kind, 0.5)
+            return (not stats.healthy, p50 is not None, p50 or 0.0, order.index(name))
+
+        return sorted(order, key=key)
+
+    async def _timed(self, name: str, kind: str, method: str, args: tuple):
+        start = time.perf_counter()
+        try:
+            result = await getattr(self.backends[name], method)(*args)
+        except asyncio.CancelledError:
+            # A cancelled hedge says nothing about the backend
+            raise
+        except Exception:
+            self.backend_stats[name].record(kind, time.perf_counter() - start, ok=False)
+            raise
+        self.backend_stats[name].record(kind, time.perf_counter() - start, ok=True)
+        return result
+
+    def _hedge_delay(self, name: str, kind: str) -> Optional[float]:
+        stats = self.backend_stats[name]
+        if not ROUTER_HEDGE or stats.samples(kind) < ROUTER_HEDGE_MIN_SAMPLES:
+            return None
+        return stats.percentile(kind, ROUTER_HEDGE_PERCENTILE)
+
+    async def _call(self, kind: str, method: str, *args):
+        """
+        Run one call on the best backend. Hedge to the next one if it runs past
+        its latency percentile; fail over down the ranking on errors.
+        """
+        candidates = self.ranked(kind)
+        last_error = None
+
+        while candidates:
+            primary = candidates.pop(0)
+            tasks = {asyncio.create_task(self._timed(primary, kind, method, args)): primary}
+            try:
+                delay = self._hedge_delay(primary, kind)
+                if delay is not None and candidates:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    if not done:
+                        hedge = candidates.pop(0)
+                        tasks[asyncio.create_task(self._timed(hedge, kind, method, args))] = hedge
+                        self.hedges += 1
+
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if tasks[task] != primary:
+                                self.hedge_wins += 1
+                            return task.result()
+                        last_error = task.exception()
+            finally:
+                # Cancel the loser (or everything, if the caller was cancelled)
+                for task in tasks:
+                    task.cancel()
+
+            if candidates:
+                self.failovers += 1
+
+        raise last_error
+
+    async def extract_lab_values(self, image) -> list[dict]:
+        """Extract lab values from a page image on the fastest healthy backend."""
+        return await self._call("extract", "extract_lab_values", image)
+
+    async def extract_lab_values_from_text(self, report_text: str) -> list[dict]:
+        """Extract lab values from OCR text on the fastest healthy backend."""
+        return await self._call("extract_text", "extract_lab_values_from_text", report_text)
+
+    async def explain_lab_value(self, test_name: str, value: float, unit: str,
+                                reference_range: str, status: str) -> str:
+        """Generate an explanation on the fastest healthy backend."""
+        return await self._call("explain", "explain_lab_value", test_name, value, unit, reference_range, status)
+
+    async def stream_explanation(self, test_name: str, value: float, unit: str,
+                                 reference_range: str, status: str):
+        """
+        Stream an explanation from the fastest healthy backend (not hedged: chunks
+        are already on their way to the client). Fails over only before the first chunk.
+        """
+        last_error = None
+        for name in self.ranked("explain"):
+            start, started = time.perf_counter(), False
+            try:
+                async for chunk in self.backends[name].stream_explanation(
+                        test_name, value, unit, reference_range, status):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self.backend_stats[name].record("explain", time.perf_counter() - start, ok=False)
+                if started:
+                    raise
+                last_error = e
+                self.failovers += 1
+                continue
+            self.backend_stats[name].record("explain", time.perf_counter() - start, ok=True)
+            return
+        raise last_error
+
+    def stats(self) -> dict:
+        """Per-backend latency/health plus hedging and failover counters."""
+        backends = {}
+        for name, client in self.backends.items():
+            backends[name] = self.backend_stats[name].summary()
+            pool = getattr(client, "pool", None)
+            if pool is not None:
+                backends[name]["pool"] = pool.stats()
+        return {
+            "backends": backends,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+        }
+
+
+def _create_backend(name: str):
+    if name == "medgemma":
+        from medgemma_api import MedGemmaAPIClient
+        return MedGemmaAPIClient()
+    if name == "gemini":
+        from medgemma_api import GeminiClient
+        return GeminiClient()
+    if name == "local":
+        from inference_worker import get_worker
+        return get_worker()
+    raise ValueError(f"Unknown backend: {name}")
+
+
+# Singleton instance
+_router = None
+
+def get_router() -> BackendRouter:
+    """Get or create the router over every ROUTER_BACKENDS entry that can be configured."""
+    global _router
+    if _router is None:
+        backends = {}
+        for name in ROUTER_BACKENDS:
+            try:
+                backends[name] = _create_backend(name)
+            except Exception as e:
+                print(f"Router: skipping backend {name}: {e}")
+        _router = BackendRouter(backends)
+    return _router
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare image and OCR extraction modes on latency and accuracy.
+Usage: python benchmarks/extraction_modes.py [--truth truth.json] <report> [<report> ...]
+
+truth.json maps report filenames to lists of {"test_name", "value"};
+without it, the OCR results are scored against the image results.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Measure the model, not the cache
+os.environ["EXTRACTION_CACHE"] = "false"
+os.environ["TEXT_LAYER"] = "false"
+
+import main
+from explanation_store import normalize_test_name
+
+
+def _rows(result: dict) -> set:
+    return {
+        (normalize_test_name(row["test_name"]), round(row["value"], 4) if row["value"] is not None else row["value_text"])
+        for row in result["lab_values"]
+    }
+
+
+def _score(found: set, expected: set) -> dict:
+    matched = len(found & expected)
+    return {
+        "precision": round(matched / len(found), 3) if found else 0.0,
+        "recall": round(matched / len(expected), 3) if expected else 0.0,
+    }
+
+
+async def run(paths: list[str], truth: dict):
+    client = main.get_client()
+    await client.start()
+
+    print(f"Backend: {client.__class__.__name__}")
+    print(f"{'report':30} {'mode':6} {'pages':>5} {'values':>6} {'seconds':>8} {'precision':>9} {'recall':>6}")
+    try:
+        for path in paths:
+            file_bytes = Path(path).read_bytes()
+            filename = Path(path).name
+            results = {}
+            for mode in ("image", "ocr"):
+                start = time.perf_counter()
+                result = await main._analyze_bytes(file_bytes, filename, as_dict=True, extraction=mode)
+                results[mode] = (result, time.perf_counter() - start)
+
+            if filename in truth:
+                expected = {(normalize_test_name(r["test_name"]), round(float(r["value"]), 4)) for r in truth[filename]}
+            else:
+                expected = _rows(results["image"][0])
+
+            for mode, (result, seconds) in results.items():
+                score = _score(_rows(result), expected)
+                print(f"{filename[:30]:30} {mode:6} {result['page_count']:>5} {len(result['lab_values']):>6} "
+                      f"{seconds:>8.2f} {score['precision']:>9} {score['recall']:>6}")
+    finally:
+        await client.aclose()
+
+    print(f"\nOCR pages: {main.ocr_stats['pages_ocr']}, fell back to image: {main.ocr_stats['pages_fallback']}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    truth = {}
+    if args[:1] == ["--truth"]:
+        truth = json.loads(Path(args[1]).read_text())
+        args = args[2:]
+
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+
+    asyncio.run(run(args, truth))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Load generator: replays a recorded request trace at scaled rates and finds saturation.
+Usage: python benchmarks/loadgen.py [--trace trace.jsonl | --synthetic 30] [--scales 0.5,1,2,4,8]
+                                    [--slo-ms 15000] [--set PAGE_CONCURRENCY=8 ...]
+                                    [--url http://127.0.0.1:8000] [--out curve.csv]
+
+Record a trace by running the backend with TRACE_PATH=trace.jsonl. Each entry
+is replayed open-loop at its arrival time divided by the scale, with a synthetic
+report of the recorded format and page count (or explain parameters), so the
+mix, burstiness and document sizes match production without any patient data.
+
+By default the app runs in process against benchmarks/mock_server.py (use
+--set to try worker/concurrency settings); --url targets a running server instead.
+For each scale, prints offered vs achieved throughput and latency percentiles,
+and reports the highest offered rate that stayed within the SLO.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+from run import percentile, free_port, start_mock_server, configure_app, synthetic_report, unique
+
+REPLAYED_ENDPOINTS = ("/analyze", "/analyze/stream", "/explain")
+
+EXPLAIN_TESTS = [
+    ("Hemoglobin", "g/dL", "13.0 - 17.0", "low"),
+    ("Fasting Blood Sugar", "mg/dL", "70 - 100", "high"),
+    ("TSH", "mIU/L", "0.4 - 4.0", "normal"),
+    ("LDL Cholesterol", "mg/dL", "< 100", "high"),
+    ("Vitamin D", "ng/mL", "30 - 100", "low"),
+]
+
+
+def load_trace(path: Path) -> list[dict]:
+    """Replayable entries from a recorded trace, with arrival times starting at 0."""
+    entries, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("endpoint") in REPLAYED_ENDPOINTS:
+                entries.append(entry)
+            else:
+                skipped += 1
+    if skipped:
+        print(f"Skipping {skipped} entries for endpoints that are not replayed (e.g. /jobs)", file=sys.stderr)
+    entries.sort(key=lambda e: e["t"])
+    start = entries[0]["t"] if entries else 0.0
+    return [{**entry, "t": entry["t"] - start} for entry in entries]
+
+
+def synthetic_trace(seconds: float, seed: int = 0) -> list[dict]:
+    """
+    Production-like mix when no trace is recorded yet: bursts of multi-page PDF
+    uploads every ~10 s, each followed by a few /explain calls, over a steady
+    background of /explain traffic.
+    """
+    rng = random.Random(seed)
+    entries = []
+    t = 0.0
+    while t < seconds:
+        t += rng.expovariate(1.0)
+        entries.append({"t": t, "endpoint": "/explain"})
+    t = rng.uniform(0, 5)
+    while t < seconds:
+        for _ in range(rng.randint(2, 5)):
+            upload = t + rng.uniform(0, 1.5)
+            entries.append({"t": upload, "endpoint": "/analyze", "format": "pdf", "pages": rng.choice([1, 1, 2, 3, 4, 6])})
+            for _ in range(rng.randint(0, 3)):
+                entries.append({"t": upload + rng.uniform(5, 20), "endpoint": "/explain"})
+        t += rng.expovariate(1 / 10)
+    return sorted((e for e in entries if e["t"] < seconds), key=lambda e: e["t"])
+
+
+def page_image(rows: int = 20) -> bytes:
+    """Single-page PNG report (used when PDFs can't be rendered here)."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(rows):
+        draw.text((80, 200 + row * 60), f"Analyte {row + 1:<18} {10 + row * 0.7:>8.1f}     mg/dL", fill="black")
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Payloads:
+    """Synthetic request bodies matching trace entries (one report per format and page count)."""
+
+    def __init__(self):
+        self.can_render_pdf = shutil.which("pdftoppm") is not None
+        self.reports = {}
+        if not self.can_render_pdf:
+            print("pdftoppm not found: PDF uploads are replayed as single-page PNGs", file=sys.stderr)
+
+    def report(self, entry: dict) -> tuple[str, bytes, str]:
+        pages = max(int(entry.get("pages") or 1), 1)
+        if entry.get("format", "pdf") == "pdf" and self.can_render_pdf:
+            key = ("pdf", pages)
+            if key not in self.reports:
+                self.reports[key] = synthetic_report(pages)
+            return f"trace_{pages}p.pdf", self.reports[key], "application/pdf"
+        if "png" not in self.reports:
+            self.reports["png"] = page_image()
+        return "trace.png", self.reports["png"], "image/png"
+
+    def request(self, entry: dict, i: int) -> dict:
+        """httpx.post keyword arguments for one entry (made unique so nothing is coalesced)."""
+        if entry["endpoint"] == "/explain":
+            test_name, unit, reference_range, status = EXPLAIN_TESTS[i % len(EXPLAIN_TESTS)]
+            return {"json": {"test_name": test_name, "value": round(1 + i * 0.01, 2), "unit": unit,
+                             "reference_range": reference_range, "status": status}}
+        filename, data, content_type = self.report(entry)
+        return {"files": {"file": (filename, unique(filename, data, i), content_type)}}
+
+
+async def replay(client, trace: list[dict], payloads: Payloads, scale: float, offset: int) -> dict:
+    """Send every entry at t / scale (open loop: arrivals don't wait for responses)."""
+    results = []
+    # Build bodies up front so report rendering isn't timed or on the arrival schedule
+    requests = [payloads.request(entry, offset + i) for i, entry in enumerate(trace)]
+
+    async def send(entry: dict, i: int):
+        start = time.perf_counter()
+        try:
+            response = await client.post(entry["endpoint"], **requests[i])
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        results.append((entry["endpoint"], time.perf_counter() - start, ok, time.perf_counter()))
+
+    start = time.perf_counter()
+    tasks = []
+    for i, entry in enumerate(trace):
+        delay = start + entry["t"] / scale - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(entry, i)))
+    await asyncio.gather(*tasks)
+    elapsed = max(end for _, _, _, end in results) - start
+
+    duration = max(trace[-1]["t"] / scale, 1e-3)
+    latencies = [seconds for _, seconds, ok, _ in results if ok]
+    errors = sum(1 for _, _, ok, _ in results if not ok)
+    row = {
+        "scale": scale,
+        "requests": len(trace),
+        "offered_rps": round(len(trace) / duration, 2),
+        "achieved_rps": round((len(trace) - errors) / elapsed, 2),
+        "error_rate": round(errors / len(trace), 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000),
+    }
+    for endpoint in REPLAYED_ENDPOINTS:
+        samples = [seconds for e, seconds, ok, _ in results if ok and e == endpoint]
+        if samples:
+            row[f"{endpoint.strip('/').replace('/', '_')}_p95_ms"] = round(percentile(samples, 0.95) * 1000)
+    return row
+
+
+def saturated(row: dict, args) -> bool:
+    return (row["p95_ms"] > args.slo_ms
+            or row["error_rate"] > args.max_error_rate
+            or row["achieved_rps"] < row["offered_rps"] * 0.9)
+
+
+async def run_curve(args, trace: list[dict]) -> list[dict]:
+    import httpx
+
+    payloads = Payloads()
+    rows = []
+
+    async def sweep(client):
+        for n, scale in enumerate(args.scales):
+            row = await replay(client, trace, payloads, scale, offset=n * len(trace))
+            row["saturated"] = saturated(row, args)
+            rows.append(row)
+            print(f"scale {scale:>5}: offered {row['offered_rps']:>6} rps, achieved {row['achieved_rps']:>6} rps, "
+                  f"p50 {row['p50_ms']:>6} ms, p95 {row['p95_ms']:>6} ms, errors {row['error_rate']:.1%}"
+                  f"{'  SATURATED' if row['saturated'] else ''}")
+            if row["saturated"] and not args.keep_going:
+                break
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            await sweep(client)
+    else:
+        import main
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadgen", timeout=args.timeout) as client:
+                await sweep(client)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--trace", type=Path, help="trace recorded with TRACE_PATH")
+    source.add_argument("--synthetic", type=float, default=30, help="seconds of synthetic traffic (default)")
+    parser.add_argument("--limit", type=float, help="replay only the first N seconds of the trace")
+    parser.add_argument("--scales", type=lambda s: [float(x) for x in s.split(",")], default=[0.5, 1, 2, 4, 8],
+                        help="rate multipliers to sweep")
+    parser.add_argument("--slo-ms", type=float, default=15000, help="p95 latency target")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--keep-going", action="store_true", help="continue past the saturation point")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="app setting for the in-process run, e.g. MAX_INFLIGHT_PAGES=32")
+    parser.add_argument("--backend", choices=("medgemma", "gemini"), default="medgemma")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", type=Path, help="write the curve as CSV")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.synthetic)
+    if args.limit:
+        trace = [entry for entry in trace if entry["t"] <= args.limit]
+    if not trace:
+        sys.exit("Trace is empty")
+    mix = {endpoint: sum(1 for e in trace if e["endpoint"] == endpoint) for endpoint in REPLAYED_ENDPOINTS}
+    print(f"Trace: {len(trace)} requests over {trace[-1]['t']:.0f}s, mix {mix}")
+
+    mock, state_dir = None, None
+    if not args.url:
+        port = free_port()
+        mock = start_mock_server(port, args)
+        state_dir = tempfile.mkdtemp(prefix="loadgen-")
+        configure_app(port, args.backend, state_dir)
+        for setting in args.set:
+            key, _, value = setting.partition("=")
+            os.environ[key] = value
+    try:
+        rows = asyncio.run(run_curve(args, trace))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    within_slo = [row for row in rows if not row["saturated"]]
+    if within_slo:
+        best = max(within_slo, key=lambda row: row["offered_rps"])
+        print(f"\nSaturation: sustained {best['offered_rps']} rps (scale {best['scale']}) "
+              f"with p95 {best['p95_ms']} ms <= {args.slo_ms:.0f} ms")
+    else:
+        print("\nSaturated at every scale; try lower --scales")
+
+    if args.out:
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        with open(args.out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Curve written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the inference APIs (HF router and Gemini request formats).
+Usage: python benchmarks/mock_server.py [--port 8900] [--latency-ms 300] [--jitter-ms 50]
+                                        [--token-ms 5] [--rows 20] [--error-rate 0]
+
+Point the backend at it with HF_API_BASE / GEMINI_API_BASE=http://127.0.0.1:<port>.
+Extraction returns a canned JSON array of --rows lab values followed by trailing
+commentary (which early-stopping clients never read); explanations return canned text.
+"""
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TESTS = [
+    ("Hemoglobin", "g/dL", "13.0 - 17.0", 14.2),
+    ("Total Leukocyte Count", "10^3/uL", "4.0 - 11.0", 7.8),
+    ("Platelet Count", "10^3/uL", "150 - 410", 250),
+    ("Fasting Blood Sugar", "mg/dL", "70 - 100", 108),
+    ("HbA1c", "%", "4.0 - 5.6", 5.9),
+    ("TSH", "mIU/L", "0.4 - 4.0", 2.1),
+    ("LDL Cholesterol", "mg/dL", "< 100", 132),
+    ("HDL Cholesterol", "mg/dL", "40 - 60", 38),
+    ("Creatinine", "mg/dL", "0.7 - 1.3", 0.9),
+    ("Vitamin D", "ng/mL", "30 - 100", 18),
+]
+
+EXPLANATION = (
+    "**What it measures**: This test checks a common marker in your blood. "
+    "**Your result**: Your value is close to the normal range. "
+    "**Why it matters**: Small changes are often due to diet or hydration. "
+    "**Quick tip**: Discuss this result with your doctor at your next visit."
+)
+
+
+def canned_rows(count: int) -> str:
+    rows = []
+    for i in range(count):
+        name, unit, reference_range, value = TESTS[i % len(TESTS)]
+        suffix = f" {i // len(TESTS) + 1}" if i >= len(TESTS) else ""
+        rows.append({"test_name": name + suffix, "value": str(value), "unit": unit, "reference_range": reference_range})
+    return json.dumps(rows, indent=2) + "\n\nNote: values were extracted from the report as printed."
+
+
+def tokens(text: str, size: int = 4) -> list[str]:
+    """Split text into token-sized chunks for streaming."""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def create_app(latency_ms: float = 300, jitter_ms: float = 50, token_ms: float = 5,
+               rows: int = 20, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Inference API stand-in")
+    extraction_text = canned_rows(rows)
+    counters = {"requests": 0, "errors": 0, "streams": 0}
+
+    async def delay():
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+    def fail() -> bool:
+        if error_rate and random.random() < error_rate:
+            counters["errors"] += 1
+            return True
+        return False
+
+    def sse(chunks, event):
+        async def body():
+            for chunk in chunks:
+                yield f"data: {json.dumps(event(chunk))}\n\n"
+                if token_ms:
+                    await asyncio.sleep(token_ms / 1000)
+        counters["streams"] += 1
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return counters
+
+    @app.post("/models/{model_path:path}")
+    async def inference(model_path: str, request: Request):
+        counters["requests"] += 1
+        payload = await request.json()
+        await delay()
+        if fail():
+            return JSONResponse({"error": "Service unavailable"}, status_code=503, headers={"Retry-After": "1"})
+
+        # Gemini: models/<id>:generateContent or :streamGenerateContent
+        if ":" in model_path:
+            text = payload["contents"][0]["parts"][0]["text"]
+            output = EXPLANATION if "Test Information" in text else extraction_text
+            if model_path.endswith(":streamGenerateContent"):
+                return sse(tokens(output, 16), lambda chunk: {"candidates": [{"content": {"parts": [{"text": chunk}]}}]})
+            return {"candidates": [{"content": {"parts": [{"text": output}]}}]}
+
+        # HF router: text prompt, or {"image", "text"} for extraction
+        inputs = payload["inputs"]
+        prompt = inputs["text"] if isinstance(inputs, dict) else inputs
+        output = EXPLANATION if "Test Information" in prompt else extraction_text
+        if payload.get("stream"):
+            return sse(tokens(output), lambda chunk: {"token": {"text": chunk, "special": False}})
+        return {"generated_text": output}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.jitter_ms, args.token_ms, args.rows, args.error_rate)
+    print(f"Mock inference server on http://127.0.0.1:{args.port}", file=sys.stderr)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Compare local model precision modes on CPU: load time, memory, speed and agreement.
+Usage: python benchmarks/precision_modes.py [--modes fp32,bf16,int8,int4] [--runtime eager|compile] [<report> ...]
+
+Each mode runs in its own process (so peak RSS is per mode) over the given
+reports, or everything in sample_reports/. Agreement is the share of
+(test, value) pairs that match the fp32 run.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+SAMPLE_REPORTS = BACKEND_DIR.parent / "sample_reports"
+DEFAULT_MODES = ["fp32", "bf16", "int8", "int4"]
+
+
+def measure(paths: list[str]) -> dict:
+    """Load the model in the LOCAL_PRECISION of this process and extract every page."""
+    from medgemma_client import MedGemmaClient
+    from report_parser import load_report, preprocess_image
+    from lab_ranges import parse_value
+    from explanation_store import normalize_test_name
+
+    client = MedGemmaClient()
+    client.load_model()
+
+    rows, seconds = {}, 0.0
+    for path in paths:
+        pages = [preprocess_image(page) for page in load_report(Path(path).read_bytes(), Path(path).name)]
+        start = time.perf_counter()
+        extracted = client.extract_lab_values_batch(pages) if pages else []
+        seconds += time.perf_counter() - start
+        rows[Path(path).name] = sorted({
+            (normalize_test_name(str(row.get("test_name", ""))), parse_value(row.get("value")).number)
+            for page in extracted for row in page
+        }, key=str)
+
+    tokens = client.generation_stats["generated_tokens"]
+    return {
+        "precision": client.precision,
+        "load_seconds": round(client.load_seconds, 1),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+        "extract_seconds": round(seconds, 1),
+        "tokens_per_second": round(tokens / seconds, 2) if seconds else 0,
+        "rows": rows,
+    }
+
+
+def agreement(rows: dict, baseline: dict) -> float:
+    found = {(name, tuple(row)) for name, report_rows in rows.items() for row in report_rows}
+    expected = {(name, tuple(row)) for name, report_rows in baseline.items() for row in report_rows}
+    union = found | expected
+    return round(len(found & expected) / len(union), 3) if union else 1.0
+
+
+def run_mode(mode: str, runtime: str, paths: list[str]) -> dict:
+    env = {**os.environ, "LOCAL_PRECISION": mode, "LOCAL_RUNTIME": runtime}
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", *paths],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return {"precision": mode, "error": result.stderr.strip().splitlines()[-1:]}
+    # The model prints progress; the result is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args: list[str]):
+    modes, runtime = DEFAULT_MODES, "eager"
+    while args[:1] in (["--modes"], ["--runtime"]):
+        if args[0] == "--modes":
+            modes = args[1].split(",")
+        else:
+            runtime = args[1]
+        args = args[2:]
+    paths = args or [str(p) for p in sorted(SAMPLE_REPORTS.iterdir()) if p.suffix.lower() in (".pdf", ".png", ".jpg", ".jpeg")]
+
+    # fp32 is the reference for agreement
+    if "fp32" not in modes:
+        modes = ["fp32", *modes]
+
+    results = {mode: run_mode(mode, runtime, paths) for mode in modes}
+    baseline = results["fp32"].get("rows", {})
+
+    print(f"Runtime: {runtime}, reports: {len(paths)}")
+    print(f"{'mode':6} {'load s':>7} {'peak MB':>8} {'extract s':>10} {'tok/s':>7} {'agreement':>9}")
+    for mode, result in results.items():
+        if "error" in result:
+            print(f"{mode:6} failed: {' '.join(result['error'])}")
+            continue
+        print(f"{mode:6} {result['load_seconds']:>7} {result['peak_rss_mb']:>8} {result['extract_seconds']:>10} "
+              f"{result['tokens_per_second']:>7} {agreement(result['rows'], baseline):>9}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        print(json.dumps(measure(sys.argv[2:])))
+    else:
+        main(sys.argv[1:])
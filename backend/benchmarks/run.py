@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Reproducible end-to-end benchmark of /analyze and /explain against the mock inference server.
+Usage: python benchmarks/run.py [--requests 20] [--concurrency 4] [--pages 3] [--latency-ms 300]
+                                [--backend medgemma|gemini] [--baseline benchmarks/baseline.json]
+                                [--save-baseline] [--tolerance 0.2] [--json results.json]
+
+Requests go through the real FastAPI app (in process) and the real API clients,
+which talk HTTP to benchmarks/mock_server.py (started as a subprocess). Reports
+are sample_reports/* plus synthetic multi-page PDFs (PDFs need poppler).
+Each upload is made unique so request coalescing doesn't hide the work.
+
+With --baseline, exits 1 if p95 latency, throughput or peak RSS regress by more
+than --tolerance against the stored baseline; --save-baseline writes it instead.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from io import BytesIO
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+SAMPLE_REPORTS = BACKEND_DIR.parent / "sample_reports"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(samples: list[float], q: float) -> float:
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(port: int, args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, str(BENCH_DIR / "mock_server.py"),
+        "--port", str(port),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--token-ms", str(args.token_ms),
+        "--rows", str(args.rows),
+        "--error-rate", str(args.error_rate),
+    ])
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock server did not start")
+
+
+def configure_app(port: int, backend: str, state_dir: str):
+    """Point the app at the mock server, with caches off and throwaway state. Call before importing main."""
+    os.environ.update({
+        "USE_LOCAL_MODEL": "false",
+        "BACKEND_ROUTER": "false",
+        "HF_API_BASE": f"http://127.0.0.1:{port}",
+        "GEMINI_API_BASE": f"http://127.0.0.1:{port}",
+        "EXTRACTION_CACHE": "false",
+        "EXPLANATION_STORE": "false",
+        "TEXT_LAYER": "false",
+        "TRACE_PATH": "",
+        "JOBS_DB_PATH": os.path.join(state_dir, "jobs.sqlite"),
+    })
+    if backend == "medgemma":
+        os.environ["HF_TOKEN"] = "benchmark"
+        os.environ.pop("GOOGLE_API_KEY", None)
+    else:
+        os.environ.pop("HF_TOKEN", None)
+        os.environ["GOOGLE_API_KEY"] = "benchmark"
+
+
+def synthetic_report(pages: int, rows: int = 20) -> bytes:
+    """Multi-page PDF of typed lab result tables."""
+    from PIL import Image, ImageDraw
+
+    images = []
+    for page in range(pages):
+        image = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(image)
+        draw.text((80, 80), f"SYNTHETIC DIAGNOSTICS - Page {page + 1} of {pages}", fill="black")
+        draw.text((80, 160), "Test                      Result     Unit       Reference Range", fill="black")
+        for row in range(rows):
+            y = 200 + row * 60
+            draw.text((80, y), f"Analyte {page * rows + row + 1:<18} {10 + row * 0.7:>8.1f}     mg/dL      {5 + row} - {15 + row}",
+                      fill="black")
+            draw.line((80, y + 40, 1160, y + 40), fill=(200, 200, 200))
+        images.append(image)
+
+    buffer = BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    return buffer.getvalue()
+
+
+def load_reports(pages: int) -> list[tuple[str, bytes]]:
+    """(filename, bytes) for every benchmark report usable in this environment."""
+    can_render_pdf = shutil.which("pdftoppm") is not None
+    reports = []
+    for path in sorted(SAMPLE_REPORTS.iterdir()) if SAMPLE_REPORTS.exists() else []:
+        suffix = path.suffix.lower()
+        if suffix in (".png", ".jpg", ".jpeg") or (suffix == ".pdf" and can_render_pdf):
+            reports.append((path.name, path.read_bytes()))
+    if can_render_pdf:
+        reports.append((f"synthetic_{pages}p.pdf", synthetic_report(pages)))
+    else:
+        print("pdftoppm not found: skipping PDF reports", file=sys.stderr)
+    return reports
+
+
+def unique(filename: str, data: bytes, i: int) -> bytes:
+    """Same document, different bytes (trailing data is ignored by PDF and PNG readers)."""
+    if filename.lower().endswith(".pdf"):
+        return data + f"\n%bench {i}\n".encode()
+    return data + f"bench {i}".encode()
+
+
+async def run_scenario(name: str, total: int, concurrency: int, send) -> dict:
+    """Run send(i) total times with the given concurrency; latency and throughput."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+async def benchmark(args) -> dict:
+    import httpx
+    import main
+
+    reports = load_reports(args.pages)
+    if not reports:
+        raise RuntimeError("No benchmark reports available")
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+
+            async def analyze(i: int):
+                filename, data = reports[i % len(reports)]
+                files = {"file": (filename, unique(filename, data, i))}
+                return await client.post("/analyze", files=files)
+
+            async def explain(i: int):
+                return await client.post("/explain", json={
+                    "test_name": "Hemoglobin",
+                    "value": round(10 + i * 0.1, 1),
+                    "unit": "g/dL",
+                    "reference_range": "13.0 - 17.0",
+                    "status": "low",
+                })
+
+            results["analyze"] = await run_scenario("analyze", args.requests, args.concurrency, analyze)
+            results["explain"] = await run_scenario("explain", args.requests, args.concurrency, explain)
+
+            stats = (await client.get("/stats")).json()
+
+    results["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    results["stages"] = {
+        "preprocess": stats.get("preprocess", {}),
+        "encoding": {k: v for k, v in stats.get("encoding", {}).items() if k != "recent"},
+        "pool": stats.get("pool", {}),
+    }
+    results["reports"] = [name for name, _ in reports]
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions beyond tolerance (latency/memory up, throughput down)."""
+    regressions = []
+    for scenario in ("analyze", "explain"):
+        now, before = results.get(scenario, {}), baseline.get(scenario, {})
+        for metric in ("p95_ms", "p99_ms"):
+            if before.get(metric) and now[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{scenario}.{metric}: {before[metric]} -> {now[metric]}")
+        if before.get("throughput_rps") and now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}.throughput_rps: {before['throughput_rps']} -> {now['throughput_rps']}")
+    if baseline.get("peak_rss_mb") and results["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {baseline['peak_rss_mb']} -> {results['peak_rss_mb']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=3, help="pages in the synthetic report")
+    parser.add_argument("--backend", choices=("medgemma", "gemini"), default="medgemma")
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=5)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", type=Path, help="also write results here")
+    args = parser.parse_args()
+
+    port = free_port()
+    mock = start_mock_server(port, args)
+    state_dir = tempfile.mkdtemp(prefix="bench-")
+
+    configure_app(port, args.backend, state_dir)
+
+    try:
+        results = asyncio.run(benchmark(args))
+    finally:
+        mock.terminate()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    results["config"] = {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "json")}
+
+    print(f"\nBackend: {args.backend} (mock, {args.latency_ms:.0f} ms), reports: {', '.join(results['reports'])}")
+    print(f"{'scenario':10} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7}")
+    for scenario in ("analyze", "explain"):
+        r = results[scenario]
+        print(f"{scenario:10} {r['requests']:>8} {r['errors']:>6} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r['throughput_rps']:>7}")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+    print("Stages:", json.dumps(results["stages"]))
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    if args.baseline and args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
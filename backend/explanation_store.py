@@ -0,0 +1,458 @@
+"""
+Explanation Store - Precomputed /explain answers for common lab tests
+Keys explanations by normalized test name, unit, reference range, status and
+value band, and serves them from a compact memory-mapped file
+
+Build offline:
+    python explanation_store.py build
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import asyncio
+import hashlib
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+from lab_ranges import parse_range, range_bounds
+
+load_dotenv()
+
+EXPLANATION_STORE = os.getenv("EXPLANATION_STORE", "true").lower() == "true"
+EXPLANATION_STORE_PATH = os.getenv(
+    "EXPLANATION_STORE_PATH", str(Path(__file__).parent / ".cache" / "explanations.bin")
+)
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+
+# File layout: header, sorted index of (key hash, offset, length), then UTF-8 records
+MAGIC = b"HVEXPL1\0"
+HEADER = struct.Struct("<8s32sI")
+INDEX_ENTRY = struct.Struct("<QII")
+
+# Stored text refers to the patient's value through this marker
+VALUE_MARK = "{{value}}"
+
+# Common spellings on Indian and international reports
+TEST_ALIASES = {
+    "hb": "hemoglobin",
+    "hgb": "hemoglobin",
+    "haemoglobin": "hemoglobin",
+    "hemoglobin hb": "hemoglobin",
+    "glycated hemoglobin": "hba1c",
+    "glycosylated hemoglobin": "hba1c",
+    "glycated haemoglobin": "hba1c",
+    "glycosylated haemoglobin": "hba1c",
+    "hemoglobin a1c": "hba1c",
+    "a1c": "hba1c",
+    "thyroid stimulating hormone": "tsh",
+    "tsh ultrasensitive": "tsh",
+    "ldl cholesterol": "ldl",
+    "ldl c": "ldl",
+    "ldl cholesterol direct": "ldl",
+    "hdl cholesterol": "hdl",
+    "hdl c": "hdl",
+    "total cholesterol": "cholesterol total",
+    "serum cholesterol": "cholesterol total",
+    "triglyceride": "triglycerides",
+    "fasting blood sugar": "glucose fasting",
+    "fasting blood glucose": "glucose fasting",
+    "fbs": "glucose fasting",
+    "fasting plasma glucose": "glucose fasting",
+    "serum creatinine": "creatinine",
+    "vitamin d 25 hydroxy": "vitamin d",
+    "25 oh vitamin d": "vitamin d",
+    "vitamin b12 cyanocobalamin": "vitamin b12",
+    "total leucocyte count": "wbc",
+    "total leukocyte count": "wbc",
+    "white blood cells": "wbc",
+    "tlc": "wbc",
+    "platelet count": "platelets",
+    "red blood cells": "rbc",
+    "rbc count": "rbc",
+    "sgpt": "alt",
+    "sgot": "ast",
+}
+
+# (test name, unit, reference range) precomputed by the offline build
+COMMON_TESTS = [
+    ("Hemoglobin", "g/dL", "13.0 - 17.0"),
+    ("HbA1c", "%", "4.0 - 5.6"),
+    ("TSH", "mIU/L", "0.4 - 4.0"),
+    ("LDL Cholesterol", "mg/dL", "< 100"),
+    ("HDL Cholesterol", "mg/dL", "40 - 60"),
+    ("Total Cholesterol", "mg/dL", "< 200"),
+    ("Triglycerides", "mg/dL", "< 150"),
+    ("Fasting Blood Sugar", "mg/dL", "70 - 100"),
+    ("Creatinine", "mg/dL", "0.7 - 1.3"),
+    ("Urea", "mg/dL", "15 - 40"),
+    ("Uric Acid", "mg/dL", "3.5 - 7.2"),
+    ("Vitamin D", "ng/mL", "30 - 100"),
+    ("Vitamin B12", "pg/mL", "200 - 900"),
+    ("WBC", "10^3/uL", "4.0 - 11.0"),
+    ("RBC", "10^6/uL", "4.5 - 5.5"),
+    ("Platelets", "10^3/uL", "150 - 410"),
+    ("Hematocrit", "%", "40 - 50"),
+    ("MCV", "fL", "83 - 101"),
+    ("ALT", "U/L", "7 - 56"),
+    ("AST", "U/L", "10 - 40"),
+    ("Bilirubin Total", "mg/dL", "0.3 - 1.2"),
+    ("T3", "ng/dL", "80 - 200"),
+    ("T4", "ug/dL", "5.1 - 14.1"),
+    ("Ferritin", "ng/mL", "30 - 400"),
+    ("Sodium", "mmol/L", "135 - 145"),
+    ("Potassium", "mmol/L", "3.5 - 5.1"),
+    ("Calcium", "mg/dL", "8.6 - 10.3"),
+]
+
+# Bands relative to the reference range, with the representative position used
+# when building (fraction of the range width from the lower bound)
+BANDS = {
+    "below_far": -0.75,
+    "below": -0.25,
+    "low_normal": 1 / 6,
+    "mid_normal": 0.5,
+    "high_normal": 5 / 6,
+    "above": 1.25,
+    "above_far": 1.75,
+}
+
+
+def load_prompt(name: str) -> str:
+    """Load a prompt template from file."""
+    with open(PROMPTS_DIR / f"{name}.txt", "r") as f:
+        return f.read()
+
+
+def normalize_test_name(test_name: str) -> str:
+    """Lowercase, strip punctuation and map common aliases."""
+    name = re.sub(r"[^a-z0-9]+", " ", test_name.lower()).strip()
+    return TEST_ALIASES.get(name, name)
+
+
+def normalize_unit(unit: str) -> str:
+    """Case/spacing-insensitive unit (mg/dL == MG/DL == mg / dl)."""
+    return re.sub(r"\s+", "", unit.lower()).replace("µ", "u").replace("μ", "u")
+
+
+def value_band(value: float, reference_range: str) -> Optional[str]:
+    """Coarse position of a value relative to its reference range."""
+    bounds = range_bounds(reference_range)
+    if bounds is None:
+        return None
+    low, high = bounds
+
+    if low is not None and high is not None and high > low:
+        position = (value - low) / (high - low)
+    elif high is not None and high > 0:
+        # Upper limit only: treat 0..limit as the range
+        position = value / high
+    elif low is not None and low > 0:
+        # Lower limit only: treat limit..2*limit as the range
+        position = (value - low) / low
+    else:
+        return None
+
+    if position < -0.5:
+        return "below_far"
+    if position < 0:
+        return "below"
+    if position < 1 / 3:
+        return "low_normal"
+    if position < 2 / 3:
+        return "mid_normal"
+    if position <= 1:
+        return "high_normal"
+    if position <= 1.5:
+        return "above"
+    return "above_far"
+
+
+def representative_value(reference_range: str, band: str) -> Optional[float]:
+    """Value in the middle of a band, used when precomputing explanations."""
+    bounds = range_bounds(reference_range)
+    if bounds is None:
+        return None
+    low, high = bounds
+    if low is not None and high is not None:
+        width = high - low
+    elif high is not None:
+        low, width = 0.0, high
+    else:
+        width = low
+    return round(low + BANDS[band] * width, 1)
+
+
+def normalize_range(reference_range: str) -> Optional[str]:
+    """
+    Printed range reduced to its bounds ("13.0 - 17.0" == "13-17"), one interval
+    per sex for sex-specific ranges. Explanations quote the range, so it is part of the key.
+    """
+    spec = parse_range(reference_range)
+    if spec is None:
+        return None
+    intervals = []
+    for interval in spec.intervals:
+        low = "" if interval.low is None else f"{interval.low:g}"
+        high = "" if interval.high is None else f"{interval.high:g}"
+        intervals.append(f"{interval.sex or ''}{low}~{high}")
+    return ",".join(intervals)
+
+
+def status_for_band(band: str) -> str:
+    if band.startswith("below"):
+        return "low"
+    if band.startswith("above"):
+        return "high"
+    return "normal"
+
+
+def templatize(text: str, value: float) -> Optional[str]:
+    """
+    Replace the patient's value in an explanation with VALUE_MARK. Only whole
+    numbers match ("15" or "15.0" for 15.0, never inside "14.50" or "3.5 - 15.0").
+    None unless the value appears exactly once, so the patient's value is never
+    kept and no other number (e.g. a range bound equal to the value) is rewritten.
+    Range bounds stay in the text: the store key includes the range.
+    """
+    forms = {f"{value}"}
+    if float(value).is_integer():
+        forms.add(str(int(value)))
+    pattern = r"(?<![\d.])(?:" + "|".join(re.escape(f) for f in sorted(forms, key=len, reverse=True)) + r")(?!\.?\d)"
+    matches = re.findall(pattern, text)
+    if len(matches) != 1:
+        return None
+    return re.sub(pattern, VALUE_MARK, text)
+
+
+def store_key(test_name: str, value: float, unit: str, reference_range: str, status: str) -> Optional[str]:
+    """Store key for an explain request; None when the value can't be banded."""
+    band = value_band(value, reference_range)
+    if band is None:
+        return None
+    return "|".join([
+        normalize_test_name(test_name), normalize_unit(unit), normalize_range(reference_range), status.lower(), band
+    ])
+
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def prompt_fingerprint() -> bytes:
+    """Stored explanations are only valid for the prompt they were generated with."""
+    return hashlib.sha256(load_prompt("explain").encode()).digest()
+
+
+def write_store(path: str, entries: dict, fingerprint: bytes):
+    """Write entries {key: text} as a sorted, memory-mappable file."""
+    records = sorted(((_key_hash(k), k, v) for k, v in entries.items()), key=lambda r: r[0])
+    index_size = HEADER.size + INDEX_ENTRY.size * len(records)
+
+    index, blob = [], bytearray()
+    for key_hash, key, text in records:
+        record = f"{key}\n{text}".encode()
+        index.append(INDEX_ENTRY.pack(key_hash, index_size + len(blob), len(record)))
+        blob += record
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, fingerprint, len(records)))
+        f.write(b"".join(index))
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+
+class ExplanationStore:
+    """
+    Read path: memory-mapped sorted file built offline.
+    Write path: misses served by the model are kept in memory and appended to
+    a journal next to the file; `compact` folds the journal into the file.
+    """
+
+    def __init__(self, path: str = EXPLANATION_STORE_PATH):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.fingerprint = prompt_fingerprint()
+        self.lock = threading.Lock()
+        self.map = None
+        self.hashes = []
+        self.count = 0
+        self.overlay = {}
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    def _open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER.size:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, fingerprint, count = HEADER.unpack_from(mapped, 0)
+            if magic == MAGIC and fingerprint == self.fingerprint:
+                self.map = mapped
+                self.count = count
+                self.hashes = [
+                    INDEX_ENTRY.unpack_from(mapped, HEADER.size + i * INDEX_ENTRY.size)[0]
+                    for i in range(count)
+                ]
+            else:
+                # Built for a different explain prompt
+                mapped.close()
+
+        if os.path.exists(self.journal_path):
+            fingerprint = self.fingerprint.hex()
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("prompt") == fingerprint:
+                        self.overlay[record["key"]] = record["text"]
+
+    def _lookup_file(self, key: str) -> Optional[str]:
+        if self.map is None:
+            return None
+        key_hash = _key_hash(key)
+        i = bisect_left(self.hashes, key_hash)
+        while i < self.count and self.hashes[i] == key_hash:
+            _, offset, length = INDEX_ENTRY.unpack_from(self.map, HEADER.size + i * INDEX_ENTRY.size)
+            stored_key, _, text = self.map[offset:offset + length].decode().partition("\n")
+            if stored_key == key:
+                return text
+            i += 1
+        return None
+
+    def get(self, test_name: str, value: float, unit: str, reference_range: str, status: str) -> Optional[str]:
+        """Stored explanation for this request, with the patient's value filled in."""
+        key = store_key(test_name, value, unit, reference_range, status)
+        text = None
+        if key is not None:
+            text = self.overlay.get(key)
+            if text is None:
+                text = self._lookup_file(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text.replace(VALUE_MARK, f"{value}")
+
+    def put(self, test_name: str, value: float, unit: str, reference_range: str, status: str, text: str):
+        """Remember a model-generated explanation for future requests in the same band."""
+        key = store_key(test_name, value, unit, reference_range, status)
+        if key is None or not text:
+            return
+        text = templatize(text, value)
+        if text is None:
+            # Value missing or ambiguous: the text can't be reused for other patients
+            return
+        with self.lock:
+            self.overlay[key] = text
+            Path(self.journal_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps({"prompt": self.fingerprint.hex(), "key": key, "text": text}) + "\n")
+
+    def entries(self) -> dict:
+        """All stored entries (file + journal)."""
+        result = {}
+        if self.map is not None:
+            for i in range(self.count):
+                _, offset, length = INDEX_ENTRY.unpack_from(self.map, HEADER.size + i * INDEX_ENTRY.size)
+                key, _, text = self.map[offset:offset + length].decode().partition("\n")
+                result[key] = text
+        result.update(self.overlay)
+        return result
+
+    def compact(self):
+        """Fold journal entries into the memory-mapped file."""
+        with self.lock:
+            entries = self.entries()
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            write_store(self.path, entries, self.fingerprint)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.overlay = {}
+            self._open()
+
+    def stats(self) -> dict:
+        return {
+            "entries_file": self.count,
+            "entries_journal": len(self.overlay),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Singleton instance
+_store = None
+
+def get_explanation_store() -> Optional[ExplanationStore]:
+    """Get the shared explanation store (None when EXPLANATION_STORE=false)."""
+    global _store
+    if _store is None and EXPLANATION_STORE:
+        _store = ExplanationStore()
+    return _store
+
+
+async def build(path: str = EXPLANATION_STORE_PATH, use_local: bool = False):
+    """Generate explanations for every common test, band and status and write the store."""
+    if use_local:
+        from inference_worker import get_worker
+        client = get_worker()
+    else:
+        from medgemma_api import get_client
+        client = get_client()
+    await client.start()
+
+    entries = {}
+    try:
+        for test_name, unit, reference_range in COMMON_TESTS:
+            for band in BANDS:
+                value = representative_value(reference_range, band)
+                if value is None or value < 0:
+                    continue
+                status = status_for_band(band)
+                key = store_key(test_name, value, unit, reference_range, status)
+                if key is None or key in entries:
+                    continue
+                print(f"  {key}")
+                text = await client.explain_lab_value(
+                    test_name=test_name,
+                    value=value,
+                    unit=unit,
+                    reference_range=reference_range,
+                    status=status
+                )
+                template = templatize(text, value)
+                if template is None:
+                    print("    skipped: value not found exactly once")
+                    continue
+                entries[key] = template
+    finally:
+        await client.aclose()
+
+    write_store(path, entries, prompt_fingerprint())
+    print(f"Wrote {len(entries)} explanations to {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "compact"):
+        print("Usage: python explanation_store.py build [--local]")
+        print("       python explanation_store.py compact")
+        sys.exit(1)
+
+    if sys.argv[1] == "build":
+        asyncio.run(build(use_local="--local" in sys.argv))
+    else:
+        ExplanationStore().compact()
+        print(f"Compacted journal into {EXPLANATION_STORE_PATH}")
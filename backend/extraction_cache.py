@@ -0,0 +1,311 @@
+"""
+Extraction Cache - Reuses page extraction results across uploads
+Two tiers: in-memory LRU (size/TTL bounded) in front of an on-disk SQLite store
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EXTRACTION_CACHE = os.getenv("EXTRACTION_CACHE", "true").lower() == "true"
+CACHE_PATH = os.getenv("CACHE_PATH", str(Path(__file__).parent / ".cache" / "extraction.sqlite"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+CACHE_DISK_TTL_SECONDS = float(os.getenv("CACHE_DISK_TTL_SECONDS", str(30 * 86400)))
+# Perceptual-hash matching for re-scans of the same page (different DPI/compression).
+# The hash only sees layout, so a match is served only if the numbers OCR'd from
+# both pages are identical (needs tesseract); off by default
+CACHE_NEAR_DUPLICATES = os.getenv("CACHE_NEAR_DUPLICATES", "false").lower() == "true"
+CACHE_PHASH_DISTANCE = int(os.getenv("CACHE_PHASH_DISTANCE", "10"))
+# Most near-duplicate candidates compared per lookup
+CACHE_NEAR_CANDIDATES = int(os.getenv("CACHE_NEAR_CANDIDATES", "32"))
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+
+# dHash grid: 16x16 gradient bits (256-bit hash)
+PHASH_SIZE = 16
+PHASH_BITS = PHASH_SIZE * PHASH_SIZE
+
+# Expired disk rows are purged every this many puts
+PURGE_EVERY = 100
+
+NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    Difference hash of a page: sign of horizontal gradients on a small grayscale thumbnail.
+    Stable across resolution and mild compression changes.
+    """
+    thumb = image.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.Resampling.BOX)
+    pixels = list(thumb.getdata())
+    bits = 0
+    for row in range(PHASH_SIZE):
+        offset = row * (PHASH_SIZE + 1)
+        for col in range(PHASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def phash_bands(phash: int, distance: int = CACHE_PHASH_DISTANCE) -> list[str]:
+    """
+    Split the hash into distance + 1 bands: two hashes within `distance` bits
+    share at least one band exactly, so bands index near-duplicate candidates.
+    """
+    count = distance + 1
+    width = -(-PHASH_BITS // count)
+    mask = (1 << width) - 1
+    return [f"{count}:{i}:{(phash >> (i * width)) & mask:x}" for i in range(count)]
+
+
+def content_signature(image: Image.Image) -> Optional[str]:
+    """Digest of every number OCR'd from the page (the values); None if OCR is unavailable."""
+    from report_parser import extract_text_regions
+
+    regions = extract_text_regions(image)
+    if "error" in regions:
+        return None
+    numbers = " ".join(NUMBER.findall(regions["raw_text"]))
+    return hashlib.sha256(numbers.encode()).hexdigest()
+
+
+class CacheKey:
+    """Identity of one page extraction: exact pixels, perceptual hash, and prompt/model context."""
+
+    def __init__(self, digest: str, phash: int, context: str, aspect: float, image: Optional[Image.Image] = None):
+        self.digest = digest
+        self.phash = phash
+        self.context = context
+        self.aspect = aspect
+        # Page image, kept only until the content signature is needed
+        self.image = image
+        self._content = None
+
+    def content(self) -> Optional[str]:
+        """OCR content signature (computed once, on first use)."""
+        if self._content is None and self.image is not None:
+            self._content = content_signature(self.image)
+            self.image = None
+        return self._content
+
+
+class ExtractionCache:
+    """Two-tier cache of extract_lab_values results."""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL_SECONDS,
+                 disk_ttl: float = CACHE_DISK_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        # digest -> (result_json, key, stored_at)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "hits_near_duplicate": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                digest TEXT PRIMARY KEY,
+                context TEXT NOT NULL,
+                phash TEXT NOT NULL,
+                aspect REAL NOT NULL,
+                result TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        """)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(extractions)")]
+        if "content" not in columns:
+            self.db.execute("ALTER TABLE extractions ADD COLUMN content TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS extractions_context ON extractions (context)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS extractions_stored_at ON extractions (stored_at)")
+        # Near-duplicate index: phash band -> page (see phash_bands)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS phash_bands (
+                band TEXT NOT NULL,
+                digest TEXT NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS phash_bands_band ON phash_bands (band)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS phash_bands_digest ON phash_bands (digest)")
+        self.db.commit()
+        self.puts = 0
+        self._purge(time.time())
+
+    def key_for(self, image: Image.Image, model_id: str, prompt_names: tuple = ("extract",)) -> CacheKey:
+        """
+        Build the cache key for a preprocessed page image under the extraction
+        prompts actually used (more than one when routing across backends).
+        """
+        context = hashlib.sha256()
+        for prompt_name in sorted(prompt_names):
+            context.update((PROMPTS_DIR / f"{prompt_name}.txt").read_bytes() + b"\0")
+        context.update(model_id.encode())
+        context = context.hexdigest()
+
+        h = hashlib.sha256()
+        h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        h.update(image.tobytes())
+        h.update(context.encode())
+
+        return CacheKey(
+            digest=h.hexdigest(),
+            phash=perceptual_hash(image),
+            context=context,
+            aspect=round(image.size[0] / image.size[1], 2),
+            image=image if CACHE_NEAR_DUPLICATES else None,
+        )
+
+    def get(self, key: CacheKey) -> Optional[list[dict]]:
+        """Look up a page: exact match in memory, then on disk, then confirmed near-duplicates."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key.digest)
+            if entry is not None and now - entry[2] <= self.ttl:
+                self.memory.move_to_end(key.digest)
+                self.counters["hits_memory"] += 1
+                return json.loads(entry[0])
+
+            row = self.db.execute(
+                "SELECT result FROM extractions WHERE digest = ? AND stored_at >= ?",
+                (key.digest, now - self.disk_ttl)
+            ).fetchone()
+            if row is not None:
+                self.counters["hits_disk"] += 1
+                self._remember(key, row[0], now)
+                return json.loads(row[0])
+
+            candidates = self._near_candidates(key, now) if CACHE_NEAR_DUPLICATES else []
+
+        # OCR runs outside the lock; only candidates whose numbers match exactly are served
+        if candidates and key.content() is not None:
+            with self.lock:
+                for digest in candidates:
+                    row = self.db.execute(
+                        "SELECT result FROM extractions WHERE digest = ? AND content = ?",
+                        (digest, key.content())
+                    ).fetchone()
+                    if row is not None:
+                        self.counters["hits_near_duplicate"] += 1
+                        self._remember(key, row[0], now)
+                        return json.loads(row[0])
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: CacheKey, result: list[dict]):
+        """Store a page's extraction result in both tiers."""
+        result_json = json.dumps(result)
+        # Pages without a content signature can't be confirmed, so aren't indexed as near-duplicates
+        content = key.content() if CACHE_NEAR_DUPLICATES else None
+        now = time.time()
+        with self.lock:
+            self._remember(key, result_json, now)
+            self.db.execute(
+                "INSERT OR REPLACE INTO extractions (digest, context, phash, aspect, result, stored_at, content) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key.digest, key.context, format(key.phash, "x"), key.aspect, result_json, now, content)
+            )
+            self.db.execute("DELETE FROM phash_bands WHERE digest = ?", (key.digest,))
+            if content is not None:
+                self.db.executemany(
+                    "INSERT INTO phash_bands VALUES (?, ?)",
+                    [(band, key.digest) for band in phash_bands(key.phash)]
+                )
+            self.puts += 1
+            if self.puts % PURGE_EVERY == 0:
+                self._purge(now)
+            self.db.commit()
+
+    def _near_candidates(self, key: CacheKey, now: float) -> list[str]:
+        """Digests of stored pages with the same prompt/model and aspect ratio within the hash distance, closest first."""
+        bands = phash_bands(key.phash)
+        rows = self.db.execute(
+            f"""
+            SELECT DISTINCT e.digest, e.phash, e.aspect FROM phash_bands b
+            JOIN extractions e ON e.digest = b.digest
+            WHERE b.band IN ({",".join("?" * len(bands))})
+              AND e.context = ? AND e.stored_at >= ? AND e.content IS NOT NULL
+            LIMIT ?
+            """,
+            (*bands, key.context, now - self.disk_ttl, CACHE_NEAR_CANDIDATES)
+        ).fetchall()
+        matches = []
+        for digest, phash, aspect in rows:
+            if abs(aspect - key.aspect) > 0.02:
+                continue
+            distance = (int(phash, 16) ^ key.phash).bit_count()
+            if distance <= CACHE_PHASH_DISTANCE:
+                matches.append((distance, digest))
+        return [digest for _, digest in sorted(matches)]
+
+    def _purge(self, now: float):
+        """Delete disk rows (and their index entries) past the disk TTL."""
+        cutoff = now - self.disk_ttl
+        self.db.execute(
+            "DELETE FROM phash_bands WHERE digest IN (SELECT digest FROM extractions WHERE stored_at < ?)",
+            (cutoff,)
+        )
+        self.db.execute("DELETE FROM extractions WHERE stored_at < ?", (cutoff,))
+        self.db.commit()
+
+    def _remember(self, key: CacheKey, result_json: str, now: float):
+        """Insert into the memory tier and evict LRU entries over the size limits."""
+        # Don't pin the page image in memory
+        key.image = None
+        old = self.memory.pop(key.digest, None)
+        if old is not None:
+            self.memory_bytes -= len(old[0])
+        self.memory[key.digest] = (result_json, key, now)
+        self.memory_bytes += len(result_json)
+        while self.memory and (len(self.memory) > self.max_entries or self.memory_bytes > self.max_bytes):
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted[0])
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier sizes."""
+        with self.lock:
+            disk_entries = self.db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            lookups = sum(v for k, v in self.counters.items() if k != "evictions")
+            hits = lookups - self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": disk_entries,
+            }
+
+
+# Singleton instance
+_cache = None
+
+def get_cache() -> Optional[ExtractionCache]:
+    """Get the shared extraction cache (None when EXTRACTION_CACHE=false)."""
+    global _cache
+    if _cache is None and EXTRACTION_CACHE:
+        _cache = ExtractionCache()
+    return _cache
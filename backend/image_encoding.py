@@ -0,0 +1,181 @@
+"""
+Image Encoding - Compact, fast payloads for the inference APIs
+Passes uploaded bytes through when possible, otherwise picks a fast codec
+"""
+
+import os
+import time
+import base64
+from collections import deque
+from io import BytesIO
+from PIL import Image, ImageChops
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# auto | jpeg | webp | gray-jpeg | palette | png
+IMAGE_CODEC = os.getenv("IMAGE_CODEC", "auto").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+PASSTHROUGH_MAX_BYTES = int(os.getenv("PASSTHROUGH_MAX_BYTES", str(4 * 1024 * 1024)))
+LOG_ENCODING = os.getenv("LOG_ENCODING", "false").lower() == "true"
+
+# Formats every backend accepts as-is
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+# "palette" codec: 16 fixed gray levels (index = gray >> 4) in a 4-bit PNG
+GRAY_LEVELS = [v >> 4 for v in range(256)]
+GRAY_PALETTE = [level * 17 for level in range(16) for _ in range(3)]
+
+
+class EncodedImage:
+    """Encoded page bytes plus what it cost to produce them."""
+
+    def __init__(self, data: bytes, mime_type: str, codec: str, encode_ms: float):
+        self.data = data
+        self.mime_type = mime_type
+        self.codec = codec
+        self.encode_ms = encode_ms
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.data)
+
+    def b64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+
+class EncodingStats:
+    """Running totals plus the most recent per-page encodings."""
+
+    def __init__(self, recent: int = 50):
+        self.pages = 0
+        self.bytes_total = 0
+        self.encode_ms_total = 0.0
+        self.by_codec = {}
+        self.recent = deque(maxlen=recent)
+
+    def record(self, encoded: EncodedImage, size: tuple):
+        self.pages += 1
+        self.bytes_total += encoded.size_bytes
+        self.encode_ms_total += encoded.encode_ms
+        self.by_codec[encoded.codec] = self.by_codec.get(encoded.codec, 0) + 1
+        self.recent.append({
+            "codec": encoded.codec,
+            "size": f"{size[0]}x{size[1]}",
+            "payload_bytes": encoded.size_bytes,
+            "encode_ms": round(encoded.encode_ms, 2),
+        })
+        if LOG_ENCODING:
+            print(f"Encoded page {size[0]}x{size[1]} as {encoded.codec}: "
+                  f"{encoded.size_bytes} bytes in {encoded.encode_ms:.1f} ms")
+
+    def summary(self) -> dict:
+        return {
+            "pages": self.pages,
+            "avg_payload_bytes": round(self.bytes_total / self.pages) if self.pages else 0,
+            "avg_encode_ms": round(self.encode_ms_total / self.pages, 2) if self.pages else 0,
+            "by_codec": self.by_codec,
+            "recent": list(self.recent),
+        }
+
+
+stats = EncodingStats()
+
+
+def mark_source(image: Image.Image, file_bytes: bytes, image_format: str):
+    """Remember the uploaded bytes so an unmodified page can be sent as-is."""
+    image.info["source_bytes"] = file_bytes
+    image.info["source_format"] = image_format
+    image.info["source_size"] = image.size
+    image.info["source_mode"] = image.mode
+
+
+def _passthrough(image: Image.Image):
+    """Original upload bytes if the page was not resized/converted since loading."""
+    data = image.info.get("source_bytes")
+    if (
+        data is None
+        or image.info.get("source_format") not in MIME_TYPES
+        or image.info.get("source_size") != image.size
+        or image.info.get("source_mode") != image.mode
+        or len(data) > PASSTHROUGH_MAX_BYTES
+    ):
+        return None
+    return data, MIME_TYPES[image.info["source_format"]]
+
+
+def _looks_grayscale(image: Image.Image) -> bool:
+    """True when a thumbnail shows no meaningful color."""
+    if image.mode in ("L", "1"):
+        return True
+    thumb = image.convert("RGB").resize((64, 64), Image.Resampling.BOX)
+    r, g, b = thumb.split()
+    spread = max(ImageChops.difference(r, g).getextrema()[1], ImageChops.difference(g, b).getextrema()[1])
+    return spread <= 16
+
+
+def _looks_like_text_scan(gray: Image.Image) -> bool:
+    """True when nearly every pixel is close to paper white or ink black."""
+    histogram = gray.resize((256, 256), Image.Resampling.BOX).histogram()
+    extremes = sum(histogram[:64]) + sum(histogram[192:])
+    return extremes / sum(histogram) > 0.95
+
+
+def _choose_codec(image: Image.Image) -> str:
+    if IMAGE_CODEC != "auto":
+        return IMAGE_CODEC
+    if not _looks_grayscale(image):
+        return "jpeg"
+    if _looks_like_text_scan(image.convert("L")):
+        return "palette"
+    return "gray-jpeg"
+
+
+def encode_image(image: Image.Image) -> EncodedImage:
+    """
+    Encode a page for an inference API request.
+
+    Args:
+        image: Preprocessed PIL Image
+
+    Returns:
+        EncodedImage with bytes, MIME type, codec name and encode time
+    """
+    start = time.perf_counter()
+
+    passthrough = _passthrough(image)
+    if passthrough is not None:
+        data, mime_type = passthrough
+        encoded = EncodedImage(data, mime_type, "passthrough", (time.perf_counter() - start) * 1000)
+        stats.record(encoded, image.size)
+        return encoded
+
+    codec = _choose_codec(image)
+    buffered = BytesIO()
+    if codec == "png":
+        image.save(buffered, format="PNG")
+        mime_type = "image/png"
+    elif codec == "palette":
+        # 16 gray levels keep anti-aliased text legible. A fixed lookup table instead
+        # of quantize(), which costs more than the PNG encode it shrinks
+        indexed = image.convert("L").point(GRAY_LEVELS).convert("P")
+        indexed.putpalette(GRAY_PALETTE)
+        indexed.save(buffered, format="PNG", compress_level=1, bits=4)
+        mime_type = "image/png"
+    elif codec == "webp":
+        image.convert("RGB").save(buffered, format="WEBP", quality=IMAGE_QUALITY, method=0)
+        mime_type = "image/webp"
+    elif codec == "gray-jpeg":
+        image.convert("L").save(buffered, format="JPEG", quality=IMAGE_QUALITY)
+        mime_type = "image/jpeg"
+    else:
+        image.convert("RGB").save(buffered, format="JPEG", quality=IMAGE_QUALITY)
+        mime_type = "image/jpeg"
+
+    encoded = EncodedImage(buffered.getvalue(), mime_type, codec, (time.perf_counter() - start) * 1000)
+    stats.record(encoded, image.size)
+    return encoded
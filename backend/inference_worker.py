@@ -0,0 +1,215 @@
+"""
+Inference Worker - Serves the local MedGemma pipeline off the event loop
+Groups pages and explanation prompts from concurrent requests into micro-batches
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Micro-batching limits: a batch is dispatched when it is full or when the
+# oldest queued item has waited this long
+LOCAL_MAX_BATCH_SIZE = int(os.getenv("LOCAL_MAX_BATCH_SIZE", "4"))
+LOCAL_MAX_BATCH_WAIT_MS = float(os.getenv("LOCAL_MAX_BATCH_WAIT_MS", "50"))
+
+
+class InferenceWorker:
+    """
+    Owns a MedGemmaClient and runs it on a dedicated thread.
+    Exposes the same async interface as the API clients.
+    """
+
+    def __init__(self, client, max_batch_size: int = LOCAL_MAX_BATCH_SIZE,
+                 max_wait_ms: float = LOCAL_MAX_BATCH_WAIT_MS):
+        """
+        Args:
+            client: MedGemmaClient that owns the transformers pipeline
+            max_batch_size: Maximum items per generation call
+            max_wait_ms: Maximum time to hold a batch open for more items
+        """
+        self.client = client
+        self.model_id = client.model_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # A single thread: the pipeline is not safe to call concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="medgemma")
+        self.queue = None
+        self._task = None
+        # Each kind of work item runs through its own batched client method
+        self.batch_functions = {
+            "extract": client.extract_lab_values_batch,
+            "extract_text": client.extract_lab_values_from_text_batch,
+            "explain": client.explain_lab_values_batch,
+        }
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.ready = False
+
+    async def start(self):
+        """Start the batching loop."""
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        """Stop the batching loop and fail anything still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self.queue is not None and not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference worker stopped"))
+        self.executor.shutdown(wait=False)
+
+    async def warm_up(self, generate: bool = True) -> dict:
+        """Load the model (and run a warm-up generation unless generate=False) on the worker thread."""
+        loop = asyncio.get_running_loop()
+        timings = await loop.run_in_executor(self.executor, self.client.warm_up, generate)
+        self.ready = True
+        return timings
+
+    async def _submit(self, kind: str, payload):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, payload, future))
+        return await future
+
+    def prompt_name(self, name: str) -> str:
+        return self.client.prompt_name(name)
+
+    async def extract_lab_values(self, image) -> list[dict]:
+        """Extract lab values from a page image (batched with other requests)."""
+        return await self._submit("extract", image)
+
+    async def extract_lab_values_from_text(self, report_text: str) -> list[dict]:
+        """Extract lab values from OCR text of a page (batched with other requests)."""
+        return await self._submit("extract_text", report_text)
+
+    async def iter_lab_values(self, image):
+        """
+        Same interface as the API clients. Local generation is batched, so rows
+        arrive together once the batch stops (early, when every array has closed).
+        """
+        for row in await self.extract_lab_values(image):
+            yield row
+
+    async def iter_lab_values_from_text(self, report_text: str):
+        """Same interface as the API clients; rows arrive once the batch stops."""
+        for row in await self.extract_lab_values_from_text(report_text):
+            yield row
+
+    async def explain_lab_value(self, test_name: str, value: float, unit: str,
+                                reference_range: str, status: str) -> str:
+        """Generate an explanation for a lab value (batched with other requests)."""
+        return await self._submit("explain", {
+            "test_name": test_name,
+            "value": value,
+            "unit": unit,
+            "reference_range": reference_range,
+            "status": status
+        })
+
+    async def stream_explanation(self, test_name: str, value: float, unit: str,
+                                 reference_range: str, status: str):
+        """
+        Stream an explanation token by token.
+        Generation runs alone (not batched) on the worker thread, in turn with batches.
+        """
+        loop = asyncio.get_running_loop()
+        streamer, generate = await loop.run_in_executor(
+            self.executor, self.client.prepare_explanation_stream,
+            test_name, value, unit, reference_range, status
+        )
+        generation = loop.run_in_executor(self.executor, generate)
+
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, streamer, done)
+            if chunk is done:
+                break
+            if chunk:
+                yield chunk
+        # Surface generation errors
+        await generation
+
+    async def _collect_batch(self) -> list[tuple]:
+        """Wait for one item, then gather more until the batch is full or the wait expires."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            # Pages and explanations use different prompts and token budgets
+            for kind in self.batch_functions:
+                items = [item for item in batch if item[0] == kind and not item[2].cancelled()]
+                if items:
+                    await self._run_batch(kind, items)
+
+    async def _run_batch(self, kind: str, items: list[tuple]):
+        loop = asyncio.get_running_loop()
+        payloads = [payload for _, payload, _ in items]
+        fn = self.batch_functions[kind]
+
+        self.batches += 1
+        self.items += len(items)
+        self.largest_batch = max(self.largest_batch, len(items))
+
+        try:
+            results = await loop.run_in_executor(self.executor, fn, payloads)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Batching statistics for tuning LOCAL_MAX_BATCH_SIZE / LOCAL_MAX_BATCH_WAIT_MS."""
+        return {
+            "ready": self.ready,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "precision": getattr(self.client, "precision", None),
+            "startup": dict(getattr(self.client, "startup_timings", {})),
+            "generation": dict(getattr(self.client, "generation_stats", {})),
+        }
+
+
+# Singleton instance
+_worker = None
+
+def get_worker() -> InferenceWorker:
+    """Get or create the inference worker around the local MedGemma client."""
+    global _worker
+    if _worker is None:
+        from medgemma_client import get_client
+        _worker = InferenceWorker(get_client())
+    return _worker
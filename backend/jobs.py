@@ -0,0 +1,259 @@
+"""
+Batch Jobs - Durable bulk report ingestion
+Queues uploaded files in SQLite and processes them with a pool of background workers
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import zipfile
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", str(Path(__file__).parent / ".cache" / "jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOBS_MAX_FILES = int(os.getenv("JOBS_MAX_FILES", "500"))
+JOBS_MAX_FILE_BYTES = int(os.getenv("JOBS_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+
+REPORT_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def expand_upload(filename: str, data: bytes) -> list[tuple[str, bytes]]:
+    """
+    Turn one uploaded file into report files: zip archives are unpacked,
+    PDF/image files are passed through. Raises ValueError for other file
+    types and for reports over JOBS_MAX_FILE_BYTES.
+    """
+    if not filename.lower().endswith(".zip"):
+        if not filename.lower().endswith(REPORT_EXTENSIONS):
+            raise ValueError(f"{filename} is not a PDF, image or zip file")
+        if len(data) > JOBS_MAX_FILE_BYTES:
+            raise ValueError(f"{filename} exceeds {JOBS_MAX_FILE_BYTES} bytes")
+        return [(filename, data)]
+
+    files = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(REPORT_EXTENSIONS):
+                continue
+            if info.file_size > JOBS_MAX_FILE_BYTES:
+                raise ValueError(f"{name} exceeds {JOBS_MAX_FILE_BYTES} bytes")
+            files.append((Path(name).name, archive.read(info)))
+            if len(files) > JOBS_MAX_FILES:
+                raise ValueError(f"Archive has more than {JOBS_MAX_FILES} reports")
+    return files
+
+
+class JobStore:
+    """SQLite-backed queue of job files and their results."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_files (
+                id TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL REFERENCES jobs(id),
+                filename TEXT NOT NULL,
+                data BLOB,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS job_files_status ON job_files (status, created_at);
+            CREATE INDEX IF NOT EXISTS job_files_job ON job_files (job_id);
+        """)
+        self.db.commit()
+
+    def create_job(self, files: list[tuple[str, bytes]]) -> dict:
+        """Queue files under a new job."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        rows = [(uuid.uuid4().hex, job_id, filename, data, "pending", now) for filename, data in files]
+        with self.lock:
+            self.db.execute("INSERT INTO jobs VALUES (?, ?)", (job_id, now))
+            self.db.executemany(
+                "INSERT INTO job_files (id, job_id, filename, data, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.db.commit()
+        return {
+            "job_id": job_id,
+            "file_count": len(rows),
+            "files": [{"file_id": row[0], "filename": row[2]} for row in rows]
+        }
+
+    def requeue_running(self) -> int:
+        """Put files interrupted by a restart back in the queue."""
+        with self.lock:
+            count = self.db.execute(
+                "UPDATE job_files SET status = 'pending', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+            self.db.commit()
+        return count
+
+    def claim_next(self) -> Optional[tuple[str, str, bytes]]:
+        """Mark the oldest pending file as running and return (file_id, filename, data)."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, filename, data FROM job_files WHERE status = 'pending' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE job_files SET status = 'running', started_at = ? WHERE id = ?",
+                (time.time(), row[0])
+            )
+            self.db.commit()
+        return row
+
+    def complete(self, file_id: str, result: dict):
+        """Store a file's result and drop its uploaded bytes."""
+        with self.lock:
+            self.db.execute(
+                "UPDATE job_files SET status = 'done', result = ?, data = NULL, finished_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), file_id)
+            )
+            self.db.commit()
+
+    def fail(self, file_id: str, error: str):
+        """Record a file's failure."""
+        with self.lock:
+            self.db.execute(
+                "UPDATE job_files SET status = 'failed', error = ?, data = NULL, finished_at = ? WHERE id = ?",
+                (error, time.time(), file_id)
+            )
+            self.db.commit()
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Job status with per-file status (no results)."""
+        with self.lock:
+            job = self.db.execute("SELECT created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = self.db.execute(
+                "SELECT id, filename, status, error FROM job_files WHERE job_id = ? ORDER BY created_at, rowid",
+                (job_id,)
+            ).fetchall()
+
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        for _, _, status, _ in files:
+            counts[status] += 1
+        finished = counts["done"] + counts["failed"] == len(files)
+        return {
+            "job_id": job_id,
+            "created_at": job[0],
+            "status": "finished" if finished else "running" if counts["pending"] < len(files) else "queued",
+            "counts": counts,
+            "files": [
+                {"file_id": file_id, "filename": filename, "status": status, "error": error}
+                for file_id, filename, status, error in files
+            ]
+        }
+
+    def get_file(self, job_id: str, file_id: str) -> Optional[dict]:
+        """One file's status and, when done, its analysis result."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT filename, status, result, error FROM job_files WHERE job_id = ? AND id = ?",
+                (job_id, file_id)
+            ).fetchone()
+        if row is None:
+            return None
+        filename, status, result, error = row
+        return {
+            "file_id": file_id,
+            "filename": filename,
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error
+        }
+
+    def queue_depth(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM job_files WHERE status = 'pending'").fetchone()[0]
+
+
+class JobRunner:
+    """Pool of asyncio workers draining the JobStore through the analysis pipeline."""
+
+    def __init__(self, store: JobStore, process: Callable[[bytes, str], Awaitable[dict]],
+                 workers: int = JOB_WORKERS):
+        """
+        Args:
+            store: Durable job queue
+            process: async (file_bytes, filename) -> result dict
+            workers: Number of files processed concurrently
+        """
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.processed = 0
+        self.failed = 0
+
+    async def start(self):
+        requeued = await asyncio.to_thread(self.store.requeue_running)
+        if requeued:
+            print(f"Requeued {requeued} interrupted job file(s)")
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def aclose(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def notify(self):
+        """Wake idle workers after new files are queued."""
+        self.wakeup.set()
+
+    async def _work(self):
+        while True:
+            # Clear before looking: a notify() landing during the claim then
+            # still wakes the wait below instead of being lost
+            self.wakeup.clear()
+            claimed = await asyncio.to_thread(self.store.claim_next)
+            if claimed is None:
+                try:
+                    # Poll occasionally in case another process queued work
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            file_id, filename, data = claimed
+            try:
+                result = await self.process(data, filename)
+            except Exception as e:
+                self.failed += 1
+                await asyncio.to_thread(self.store.fail, file_id, str(e))
+            else:
+                self.processed += 1
+                await asyncio.to_thread(self.store.complete, file_id, result)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.store.queue_depth(),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
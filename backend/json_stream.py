@@ -0,0 +1,152 @@
+"""
+JSON Stream - Incremental parser for the extracted lab values array
+Fed text as the model generates it; yields each row as soon as its object closes
+and reports when the top-level array is complete, so generation can stop there
+"""
+
+import os
+import json
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Extraction token budget: a base allowance plus a per-line allowance for the
+# text lines found on the page, capped at the old fixed limit
+EXTRACT_MIN_NEW_TOKENS = int(os.getenv("EXTRACT_MIN_NEW_TOKENS", "256"))
+EXTRACT_MAX_NEW_TOKENS = int(os.getenv("EXTRACT_MAX_NEW_TOKENS", "2048"))
+EXTRACT_TOKENS_PER_LINE = int(os.getenv("EXTRACT_TOKENS_PER_LINE", "40"))
+
+# JSON schema of one extraction response: the model-extracted fields of LabValue
+# (status is computed locally from the value and range)
+LAB_VALUES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "test_name": {"type": "string"},
+            "value": {"type": "string"},
+            "unit": {"type": "string"},
+            "reference_range": {"type": "string"},
+        },
+        "required": ["test_name", "value", "unit", "reference_range"],
+        "additionalProperties": False,
+    },
+}
+
+
+class LabRows(list):
+    """Extracted rows plus whether the response was a complete, valid array (see LabArrayParser.ok)."""
+
+    def __init__(self, rows=(), complete: bool = False):
+        super().__init__(rows)
+        self.complete = complete
+
+
+class LabArrayParser:
+    """
+    Character-level scanner for the first JSON array of objects in a response.
+    Skips any preamble or code fence before the array and ignores everything after it.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.done = False
+        self.invalid_rows = 0
+        self._started = False
+        self._expect_element = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object = []
+
+    def feed(self, text: str) -> list[dict]:
+        """
+        Consume the next chunk of generated text.
+
+        Returns:
+            Rows completed by this chunk (may be empty)
+        """
+        completed = []
+        for ch in text:
+            if self.done:
+                break
+
+            if not self._started:
+                if ch == "[":
+                    self._started = True
+                    self._expect_element = True
+                    self._depth = 1
+                continue
+
+            if self._depth >= 2:
+                self._object.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if self._expect_element and not ch.isspace():
+                self._expect_element = False
+                if ch not in "{]":
+                    # "[" was prose (e.g. "[see below]"), not the results array
+                    self._started = False
+                    self._depth = 0
+                    continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 2:
+                    self._object = [ch]
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    row = self._parse_object("".join(self._object))
+                    if row is not None:
+                        self.rows.append(row)
+                        completed.append(row)
+                    self._object = []
+                elif self._depth == 0:
+                    self.done = True
+        return completed
+
+    @property
+    def ok(self) -> bool:
+        """The array closed and every row in it was valid JSON."""
+        return self.done and not self.invalid_rows
+
+    def _parse_object(self, text: str) -> Optional[dict]:
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError:
+            self.invalid_rows += 1
+            return None
+        return row if isinstance(row, dict) else None
+
+
+def parse_lab_values(response: str) -> list[dict]:
+    """
+    Parse the JSON array of lab values out of a complete model response.
+    A truncated array still yields the rows that were finished.
+    """
+    parser = LabArrayParser()
+    parser.feed(response)
+    return parser.rows
+
+
+def token_budget(line_count: int) -> int:
+    """max_new_tokens for a page with this many lines of text."""
+    budget = EXTRACT_MIN_NEW_TOKENS + EXTRACT_TOKENS_PER_LINE * line_count
+    return max(EXTRACT_MIN_NEW_TOKENS, min(budget, EXTRACT_MAX_NEW_TOKENS))
+
+
+def text_token_budget(report_text: str) -> int:
+    """max_new_tokens for extraction from OCR text."""
+    return token_budget(sum(1 for line in report_text.splitlines() if line.strip()))
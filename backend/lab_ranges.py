@@ -0,0 +1,216 @@
+"""
+Lab Ranges - Deterministic value, reference-range and status parsing
+Turns printed values ("<0.5", "1,250", "12.3 H") and ranges ("13.0 - 17.0",
+"<200", "M: 13-17 / F: 12-15", "Desirable: <200; Borderline: 200-239") into
+numbers, so status never comes from the model
+"""
+
+import re
+from functools import lru_cache
+from typing import Optional, Union
+
+# A number as printed on reports: 1,250 / 1,50,000 / 12.3 / .5 / -2 / +1.5
+NUMBER = r"[-+−]?(?:\d[\d,]*(?:\.\d+)?|\.\d+)"
+
+VALUE_PATTERN = re.compile(
+    rf"^\s*(<=|>=|≤|≥|<|>)?\s*({NUMBER})\s*\(?\s*(H|L|HIGH|LOW|\*)?\s*\)?\s*$",
+    re.IGNORECASE
+)
+INTERVAL_PATTERN = re.compile(rf"({NUMBER})\s*(?:-|–|to)\s*({NUMBER})", re.IGNORECASE)
+UPPER_PATTERN = re.compile(rf"(<=|≤|<|up\s*to|upto|less\s+than|below)\s*({NUMBER})", re.IGNORECASE)
+LOWER_PATTERN = re.compile(rf"(>=|≥|>|more\s+than|greater\s+than|above)\s*({NUMBER})", re.IGNORECASE)
+SEX_PATTERN = re.compile(r"\b(male|female|men|women|m|f)\b\s*[:\-]?", re.IGNORECASE)
+
+SEX_LABELS = {"male": "M", "men": "M", "m": "M", "female": "F", "women": "F", "f": "F"}
+
+# Tiered ranges (lipid panels, HbA1c, vitamin D): "Desirable: <200; Borderline: 200-239; High: >=240"
+TIER_PATTERN = re.compile(
+    r"\b(near\s+optimal|above\s+optimal|optimal|desirable|normal|borderline(?:\s+high)?|very\s+high|high|low"
+    r"|non[-\s]?diabetic|pre[-\s]?diabet(?:es|ic)|diabet(?:es|ic)|good\s+control|poor\s+control"
+    r"|sufficien(?:t|cy)|insufficien(?:t|cy)|deficien(?:t|cy)|toxic(?:ity)?)\b",
+    re.IGNORECASE
+)
+# Tier labels whose interval is the normal range
+NORMAL_TIERS = {"optimal", "desirable", "normal", "nondiabetic", "goodcontrol", "sufficient", "sufficiency"}
+
+
+def _number(text: str) -> Optional[float]:
+    """Parse a printed number; commas are thousands separators unless they look decimal."""
+    text = text.replace("−", "-")
+    if "," in text and "." not in text and re.fullmatch(r"[-+]?\d+,\d{1,2}", text):
+        # European decimal comma: 12,3
+        text = text.replace(",", ".")
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        return None
+
+
+class ParsedValue:
+    """A result value: number (if any), comparison qualifier and printed H/L flag."""
+
+    def __init__(self, number: Optional[float], qualifier: Optional[str] = None,
+                 flag: Optional[str] = None, text: str = ""):
+        self.number = number
+        self.qualifier = qualifier
+        self.flag = flag
+        self.text = text
+
+
+class Interval:
+    """One normal interval; bounds are None when open-ended."""
+
+    def __init__(self, low: Optional[float], high: Optional[float], sex: Optional[str] = None):
+        self.low = low
+        self.high = high
+        self.sex = sex
+
+
+class RangeSpec:
+    """Compiled reference range: one interval, or one per sex."""
+
+    def __init__(self, intervals: list[Interval]):
+        self.intervals = intervals
+
+    def for_sex(self, sex: Optional[str]) -> list[Interval]:
+        if sex:
+            matching = [i for i in self.intervals if i.sex in (None, sex.upper()[:1])]
+            if matching:
+                return matching
+        return self.intervals
+
+    def bounds(self, sex: Optional[str] = None) -> tuple[Optional[float], Optional[float]]:
+        """Single (low, high) covering the applicable intervals."""
+        intervals = self.for_sex(sex)
+        lows = [i.low for i in intervals]
+        highs = [i.high for i in intervals]
+        low = None if None in lows else min(lows)
+        high = None if None in highs else max(highs)
+        return low, high
+
+
+def parse_value(raw: Union[str, float, int, None]) -> ParsedValue:
+    """
+    Parse a printed result value.
+
+    Examples: 14.2, "1,250", "<0.5", "12.3 H", "12.3 (L)", "Positive"
+    """
+    if isinstance(raw, bool) or raw is None:
+        return ParsedValue(None, text="" if raw is None else str(raw))
+    if isinstance(raw, (int, float)):
+        return ParsedValue(float(raw), text=str(raw))
+
+    text = str(raw).strip()
+    match = VALUE_PATTERN.match(text)
+    if not match:
+        return ParsedValue(None, text=text)
+
+    qualifier, number, flag = match.groups()
+    qualifier = {"≤": "<=", "≥": ">="}.get(qualifier, qualifier)
+    if flag:
+        flag = flag.upper()[:1] if flag != "*" else "*"
+    return ParsedValue(_number(number), qualifier, flag, text)
+
+
+def _parse_interval(text: str, sex: Optional[str]) -> Optional[Interval]:
+    match = INTERVAL_PATTERN.search(text)
+    if match:
+        low, high = _number(match.group(1)), _number(match.group(2))
+        if low is not None and high is not None:
+            return Interval(min(low, high), max(low, high), sex)
+    match = UPPER_PATTERN.search(text)
+    if match:
+        return Interval(None, _number(match.group(2)), sex)
+    match = LOWER_PATTERN.search(text)
+    if match:
+        return Interval(_number(match.group(2)), None, sex)
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_range(reference_range: str) -> Optional[RangeSpec]:
+    """
+    Compile a printed reference range (cached: the same few hundred strings repeat).
+
+    Examples: "13.0 - 17.0", "13 to 17", "-2 to +2", "<200", "up to 40", ">= 40",
+    "M: 13-17 / F: 12-15", "Male 13-17, Female 12-15",
+    "Desirable: <200; Borderline: 200-239; High: >=240" (the normal tier is used)
+    Returns None when the range is missing or not understood.
+    """
+    if not reference_range or reference_range.strip().upper() in ("N/A", "NA", "-", "NIL"):
+        return None
+
+    # Tiered ranges: only the normal tier's interval is the reference range;
+    # without a recognizable normal tier the status can't be decided
+    tiers = list(TIER_PATTERN.finditer(reference_range))
+    if tiers:
+        for i, tier in enumerate(tiers):
+            label = re.sub(r"[-\s]", "", tier.group(1).lower())
+            if label in NORMAL_TIERS:
+                end = tiers[i + 1].start() if i + 1 < len(tiers) else len(reference_range)
+                interval = _parse_interval(reference_range[tier.end():end], None)
+                return RangeSpec([interval]) if interval is not None else None
+        return None
+
+    # Sex-specific ranges: split at each sex label
+    labels = list(SEX_PATTERN.finditer(reference_range))
+    if labels:
+        intervals = []
+        for i, label in enumerate(labels):
+            end = labels[i + 1].start() if i + 1 < len(labels) else len(reference_range)
+            interval = _parse_interval(reference_range[label.end():end], SEX_LABELS[label.group(1).lower()])
+            if interval is not None:
+                intervals.append(interval)
+        if intervals:
+            return RangeSpec(intervals)
+
+    interval = _parse_interval(reference_range, None)
+    return RangeSpec([interval]) if interval is not None else None
+
+
+def range_bounds(reference_range: str) -> Optional[tuple[Optional[float], Optional[float]]]:
+    """(low, high) of a printed range, either may be None; None if not understood."""
+    spec = parse_range(reference_range)
+    return spec.bounds() if spec is not None else None
+
+
+def _status(value: ParsedValue, spec: Optional[RangeSpec], sex: Optional[str]) -> str:
+    if value.number is None or spec is None:
+        # Fall back to the flag printed next to the value
+        if value.flag == "H":
+            return "high"
+        if value.flag == "L":
+            return "low"
+        return "unknown"
+
+    low, high = spec.bounds(sex)
+    if low is not None and value.number < low:
+        return "low"
+    if high is not None and value.number > high:
+        return "high"
+    # "<0.5" or ">2000" only tells us the side of the bound
+    if value.qualifier in (">", ">=") and high is not None and value.number >= high:
+        return "high"
+    if value.qualifier in ("<", "<=") and low is not None and value.number <= low:
+        return "low"
+    return "normal"
+
+
+def compute_statuses(rows: list[dict], sex: Optional[str] = None) -> list[tuple[ParsedValue, str]]:
+    """
+    Parse values and compute status for every row of a report in one pass.
+    Each distinct range string is compiled once (and cached across reports).
+
+    Args:
+        rows: Dicts with "value" and "reference_range"
+        sex: "M" or "F" to pick sex-specific ranges, if known
+
+    Returns:
+        (parsed value, status) per row, in input order
+    """
+    specs = {text: parse_range(text) for text in {str(row.get("reference_range") or "") for row in rows}}
+    results = []
+    for row in rows:
+        value = parse_value(row.get("value"))
+        results.append((value, _status(value, specs[str(row.get("reference_range") or "")], sex)))
+    return results
@@ -4,29 +4,141 @@ FastAPI server for processing lab reports with MedGemma
 """
 
 import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional
+
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from report_parser import load_report, preprocess_image
+from report_parser import (
+    iter_report_pages, preprocess_image, preprocess_document, preprocess_stats,
+    extract_text_regions, PREPROCESS_MODE, PREPROCESS_MAX_SIZE
+)
+from extraction_cache import get_cache
+from explanation_store import get_explanation_store, normalize_test_name, normalize_unit
+from lab_ranges import compute_statuses
+from image_encoding import stats as encoding_stats
+import text_layer
+from jobs import JobStore, JobRunner, expand_upload, JOBS_MAX_FILES
+from resilience import ProviderUnavailableError
+from singleflight import SingleFlight
+import request_trace
+import metrics
 
 load_dotenv()
 
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
 # Use API client (no local model needed) or local model based on env
 USE_LOCAL_MODEL = os.getenv("USE_LOCAL_MODEL", "false").lower() == "true"
 
-if USE_LOCAL_MODEL:
-    from medgemma_client import get_client
+# Or route across several backends by latency (BACKEND_ROUTER=true)
+BACKEND_ROUTER = os.getenv("BACKEND_ROUTER", "false").lower() == "true"
+
+if BACKEND_ROUTER:
+    from backend_router import get_router as get_client
+elif USE_LOCAL_MODEL:
+    # Local pipeline runs on a dedicated worker thread with micro-batching
+    from inference_worker import get_worker as get_client
 else:
     from medgemma_api import get_client
 
+# Page fan-out limits: pages of one report processed at once, and pages
+# in flight across all requests (protects the inference backend)
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+MAX_INFLIGHT_PAGES = int(os.getenv("MAX_INFLIGHT_PAGES", "16"))
+
+_inflight_pages = asyncio.Semaphore(MAX_INFLIGHT_PAGES)
+
+# Extraction input: "image" (vision model) or "ocr" (OCR text to a text-only prompt,
+# falling back to the image when OCR confidence is poor)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "image").lower()
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+OCR_MIN_WORDS = int(os.getenv("OCR_MIN_WORDS", "20"))
+
+ocr_stats = {"pages_ocr": 0, "pages_fallback": 0}
+
+# Identical reports / explain requests that arrive together share one computation
+_analyses = SingleFlight("analyze")
+_explanations = SingleFlight("explain")
+
+# Background workers for /jobs (created in lifespan)
+job_runner = None
+
+# Local model: it is always loaded in the background at startup and /ready stays
+# 503 until it is; MODEL_WARMUP also runs a warm-up generation before ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+# Startup phase timings (seconds) and readiness, reported by /ready
+startup = {"ready": False, "error": None, "phases": {"imports": round(IMPORT_SECONDS, 2)}}
+
+
+def _mark_ready():
+    startup["ready"] = True
+    startup["phases"]["time_to_ready"] = round(time.perf_counter() - _import_started, 2)
+    print(f"Startup: ready in {startup['phases']['time_to_ready']}s {startup['phases']}")
+
+
+def _local_worker(client):
+    """The local model's inference worker, if this app serves from one (directly or via the router)."""
+    if BACKEND_ROUTER:
+        return client.backends.get("local")
+    return client if USE_LOCAL_MODEL else None
+
+
+async def _warm_up(worker):
+    start = time.perf_counter()
+    try:
+        startup["phases"].update(await worker.warm_up(generate=MODEL_WARMUP))
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"Startup: warm-up failed: {e}")
+        return
+    startup["phases"]["warm_up"] = round(time.perf_counter() - start, 2)
+    _mark_ready()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared backend resources (HTTP pools / inference worker) for the app's lifetime."""
+    global job_runner
+    start = time.perf_counter()
+    client = get_client()
+    await client.start()
+    job_runner = JobRunner(JobStore(), lambda data, filename: _analyze_bytes(data, filename, as_dict=True))
+    await job_runner.start()
+    startup["phases"]["lifespan"] = round(time.perf_counter() - start, 2)
+
+    # Not ready until the local model (if any) is loaded
+    warm_up = None
+    worker = _local_worker(client)
+    if worker is not None:
+        warm_up = asyncio.create_task(_warm_up(worker))
+    else:
+        _mark_ready()
+    yield
+    if warm_up is not None:
+        warm_up.cancel()
+    await job_runner.aclose()
+    await client.aclose()
+
+
 app = FastAPI(
     title="HealthVest AI",
     description="AI-powered lab report analyzer using MedGemma",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # CORS for frontend
@@ -38,14 +150,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts, latency and in-flight requests per endpoint for /metrics
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    endpoints={"/analyze", "/analyze/stream", "/explain", "/explain/stream", "/jobs"}
+)
+
+# Record the traffic shape for load replay (TRACE_PATH; see benchmarks/loadgen.py)
+if request_trace.TRACE_PATH:
+    app.add_middleware(request_trace.TraceMiddleware)
+
 
 # Models
 class LabValue(BaseModel):
     test_name: str
-    value: float
+    value: Optional[float]  # None for non-numeric results (e.g. "Positive")
+    value_text: str  # value as printed, e.g. "<0.5", "12.3 H"
     unit: str
     reference_range: str
-    status: str  # normal, high, low
+    status: str  # normal, high, low, unknown
     explanation: Optional[str] = None
 
 
@@ -64,6 +187,256 @@ class ExplanationRequest(BaseModel):
     status: str
 
 
+async def _iter_pages(file_bytes: bytes, filename: str, preprocess: str = PREPROCESS_MODE,
+                      page_numbers: Optional[list[int]] = None, backend: str = ""):
+    """Render report pages on a worker thread, yielding each as soon as it is ready."""
+    # Document mode renders PDFs directly at the model's input size
+    render_size = PREPROCESS_MAX_SIZE if preprocess == "document" else None
+    pages = iter_report_pages(file_bytes, filename, render_size=render_size, pages=page_numbers)
+    done = object()
+    while True:
+        start = time.perf_counter()
+        image = await asyncio.to_thread(next, pages, done)
+        if image is done:
+            break
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="render", backend=backend)
+        yield image
+
+
+async def _stream_pages(client, file_bytes: bytes, filename: str, preprocess: str = PREPROCESS_MODE,
+                        extraction: str = EXTRACTION_MODE):
+    """
+    Render pages and extract each one while later pages are still rendering.
+    Yields (page_index, extracted) as pages finish, in completion order.
+
+    Born-digital PDF pages are parsed from the text layer without a model
+    call; only scanned or low-confidence pages are rendered. A page is only
+    rendered once a per-request slot is free, so at most PAGE_CONCURRENCY
+    rendered pages are held at a time.
+    """
+    page_limit = asyncio.Semaphore(PAGE_CONCURRENCY)
+    events = asyncio.Queue()
+    tasks = []
+
+    def on_page_done(page_index: int, task: asyncio.Task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            events.put_nowait(("error", page_index, task.exception()))
+        else:
+            events.put_nowait(("page", page_index, task.result()))
+
+    async def render():
+        try:
+            # Text-layer fast path: None marks pages that need the vision model
+            text_pages = []
+            if text_layer.TEXT_LAYER and filename.lower().endswith(".pdf"):
+                text_pages = await asyncio.to_thread(text_layer.parse_pages, file_bytes)
+            for page_index, rows in enumerate(text_pages):
+                if rows is not None:
+                    metrics.pages_total.inc(backend="text_layer")
+                    metrics.lab_values_total.inc(len(rows), backend="text_layer")
+                    events.put_nowait(("page", page_index, rows))
+            page_numbers = [i + 1 for i, rows in enumerate(text_pages) if rows is None] if text_pages else None
+            parsed_count = len(text_pages) - len(page_numbers) if text_pages else 0
+
+            await page_limit.acquire()
+            if page_numbers != []:
+                rendered = 0
+                async for image in _iter_pages(file_bytes, filename, preprocess, page_numbers, _backend_name(client)):
+                    page_index = page_numbers[rendered] - 1 if page_numbers else rendered
+                    rendered += 1
+                    task = asyncio.create_task(_extract_page(client, image, page_limit, preprocess, extraction))
+                    task.add_done_callback(lambda t, i=page_index: on_page_done(i, t))
+                    tasks.append(task)
+                    await page_limit.acquire()
+            page_limit.release()
+            events.put_nowait(("rendered", parsed_count + len(tasks), None))
+        except Exception as e:
+            events.put_nowait(("error", None, e))
+
+    renderer = asyncio.create_task(render())
+    try:
+        page_count, finished = None, 0
+        while page_count is None or finished < page_count:
+            kind, index, payload = await events.get()
+            if kind == "error":
+                raise payload
+            if kind == "rendered":
+                page_count = index
+                continue
+            finished += 1
+            yield index, payload
+    finally:
+        renderer.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+def _backend_name(client) -> str:
+    """Metrics label for the client doing the work (the local model behind the worker)."""
+    return type(getattr(client, "client", client)).__name__
+
+
+def _to_lab_values(extracted: list[dict]) -> list[LabValue]:
+    """
+    Convert raw extraction rows into LabValue models.
+    Values are parsed and status is computed locally from the reference range.
+    """
+    statuses = compute_statuses(extracted)
+    return [
+        LabValue(
+            test_name=item.get("test_name", "Unknown"),
+            value=value.number,
+            value_text=value.text,
+            unit=item.get("unit", ""),
+            reference_range=item.get("reference_range", "N/A"),
+            status=status
+        )
+        for item, (value, status) in zip(extracted, statuses)
+    ]
+
+
+def _preprocess_mode(preprocess: Optional[str]) -> str:
+    """Resolve the per-request preprocessing switch."""
+    if preprocess is None:
+        return PREPROCESS_MODE
+    if preprocess not in ("legacy", "document"):
+        raise HTTPException(status_code=400, detail="preprocess must be 'legacy' or 'document'")
+    return preprocess
+
+
+def _extraction_mode(extraction: Optional[str]) -> str:
+    """Resolve the per-request extraction switch."""
+    if extraction is None:
+        return EXTRACTION_MODE
+    if extraction not in ("image", "ocr"):
+        raise HTTPException(status_code=400, detail="extraction must be 'image' or 'ocr'")
+    return extraction
+
+
+def _validate_upload(file: UploadFile):
+    """Reject unsupported upload types."""
+    allowed_types = [
+        "application/pdf",
+        "image/png",
+        "image/jpeg",
+        "image/jpg",
+        "image/webp"
+    ]
+
+    if file.content_type not in allowed_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type: {file.content_type}. Allowed: PDF, PNG, JPG"
+        )
+
+
+async def _extract_page(client, image, page_limit: asyncio.Semaphore,
+                        preprocess: str = PREPROCESS_MODE, extraction: str = EXTRACTION_MODE) -> list[dict]:
+    """Preprocess and extract one page; releases its per-request slot when done."""
+    backend = _backend_name(client)
+    try:
+        metrics.pages_waiting.inc()
+        try:
+            await _inflight_pages.acquire()
+        finally:
+            metrics.pages_waiting.dec()
+        try:
+            with metrics.stage_seconds.time(stage="preprocess", backend=backend):
+                if preprocess == "document":
+                    processed_image, _ = await asyncio.to_thread(preprocess_document, image)
+                else:
+                    processed_image = await asyncio.to_thread(preprocess_image, image)
+            del image
+
+            extracted = None
+            if extraction == "ocr":
+                async def from_ocr():
+                    regions = await asyncio.to_thread(extract_text_regions, processed_image)
+                    if (
+                        "error" in regions
+                        or regions["confidence"] < OCR_MIN_CONFIDENCE
+                        or regions["word_count"] < OCR_MIN_WORDS
+                    ):
+                        return None
+                    return await client.extract_lab_values_from_text(regions["layout_text"])
+
+                extracted = await _cached(client, processed_image, "extract_text", from_ocr)
+                if extracted is not None:
+                    ocr_stats["pages_ocr"] += 1
+                else:
+                    ocr_stats["pages_fallback"] += 1
+
+            if extracted is None:
+                extracted = await _cached(
+                    client, processed_image, "extract",
+                    lambda: client.extract_lab_values(processed_image)
+                )
+        finally:
+            _inflight_pages.release()
+
+        metrics.pages_total.inc(backend=backend)
+        metrics.lab_values_total.inc(len(extracted), backend=backend)
+        return extracted
+    finally:
+        page_limit.release()
+
+
+async def _cached(client, processed_image, prompt_name: str, compute) -> Optional[list[dict]]:
+    """Return a cached page extraction for this prompt, or compute and cache it."""
+    # Same page (or a re-scan of it) seen before with this prompt/model
+    cache = get_cache()
+    if cache is not None:
+        key = await asyncio.to_thread(
+            cache.key_for, processed_image, client.model_id, _prompt_names(client, prompt_name)
+        )
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
+
+    extracted = await compute()
+
+    # Only complete parses: a truncated or malformed response would be served again
+    if cache is not None and extracted and getattr(extracted, "complete", False):
+        await asyncio.to_thread(cache.put, key, extracted)
+    return extracted
+
+
+def _prompt_names(client, prompt_name: str) -> tuple:
+    """Prompt files the client (or any backend behind the router) extracts with."""
+    names = set()
+    for backend in getattr(client, "backends", {"default": client}).values():
+        resolve = getattr(backend, "prompt_name", None)
+        names.add(resolve(prompt_name) if resolve else prompt_name)
+    return tuple(sorted(names))
+
+
+def _queue_depths() -> dict:
+    """Items waiting in the local inference worker and the background job queue."""
+    depths = {}
+    client = get_client()
+    for backend in getattr(client, "backends", {"default": client}).values():
+        queue = getattr(backend, "queue", None)
+        if queue is not None:
+            depths[("worker",)] = queue.qsize()
+    if job_runner is not None:
+        depths[("jobs",)] = job_runner.store.queue_depth()
+    return depths
+
+
+def _backend_in_flight() -> dict:
+    """Requests in flight to each inference API."""
+    client = get_client()
+    backends = getattr(client, "backends", {"default": client}).values()
+    return {(b.pool.name,): b.pool.in_flight for b in backends if getattr(b, "pool", None) is not None}
+
+
+metrics.Gauge("healthvest_queue_depth", "Items waiting in a queue (worker, jobs)", ("queue",), read=_queue_depths)
+metrics.Gauge("healthvest_backend_in_flight", "Requests in flight to an inference API", ("backend",),
+              read=_backend_in_flight)
+
+
 # Routes
 @app.get("/")
 def root():
@@ -76,71 +449,159 @@ def root():
 
 @app.get("/health")
 def health_check():
-    """Health check endpoint."""
+    """Liveness: the process is up (the model may still be loading; see /ready)."""
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+def ready_check():
+    """Readiness: the backend can serve at full speed (local model loaded and warmed)."""
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail={
+            "status": "failed" if startup["error"] else "starting",
+            "error": startup["error"],
+            "startup": startup["phases"]
+        })
+    return {"status": "ready", "startup": startup["phases"]}
+
+
+@app.get("/stats")
+def stats():
+    """Runtime statistics (connection pool / batching) for capacity planning."""
+    result = {"startup": startup}
+    client = get_client()
+    if BACKEND_ROUTER:
+        result["router"] = client.stats()
+        result["encoding"] = encoding_stats.summary()
+    elif USE_LOCAL_MODEL:
+        result["worker"] = client.stats()
+    else:
+        result["pool"] = client.pool.stats()
+        result["encoding"] = encoding_stats.summary()
+    result["preprocess"] = preprocess_stats()
+    result["text_layer"] = text_layer.stats
+    result["ocr"] = ocr_stats
+    cache = get_cache()
+    if cache is not None:
+        result["cache"] = cache.stats()
+    store = get_explanation_store()
+    if store is not None:
+        result["explanations"] = store.stats()
+    if job_runner is not None:
+        result["jobs"] = job_runner.stats()
+    result["coalescing"] = {"analyze": _analyses.stats(), "explain": _explanations.stats()}
+    return result
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics: per-stage latency by backend, pages, values, tokens, queues."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/analyze", response_model=AnalysisResult)
-async def analyze_report(file: UploadFile = File(...)):
+async def analyze_report(file: UploadFile = File(...), preprocess: Optional[str] = None,
+                         extraction: Optional[str] = None):
     """
     Upload and analyze a lab report.
 
     Accepts PDF or image files (PNG, JPG, JPEG).
     Returns extracted lab values with status indicators.
+    `preprocess` ("legacy" or "document") overrides PREPROCESS_MODE and
+    `extraction` ("image" or "ocr") overrides EXTRACTION_MODE for this request.
     """
-    # Validate file type
-    allowed_types = [
-        "application/pdf",
-        "image/png",
-        "image/jpeg",
-        "image/jpg",
-        "image/webp"
-    ]
-
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file type: {file.content_type}. Allowed: PDF, PNG, JPG"
-        )
+    _validate_upload(file)
+    preprocess = _preprocess_mode(preprocess)
+    extraction = _extraction_mode(extraction)
 
     try:
         # Read file
         file_bytes = await file.read()
+        return await _analyze_bytes(file_bytes, file.filename, preprocess=preprocess, extraction=extraction)
+
+    except ProviderUnavailableError as e:
+        # Throttled or down upstream: tell the client when to retry instead of a 500
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Convert to images
-        images = load_report(file_bytes, file.filename)
 
+async def _analyze_bytes(file_bytes: bytes, filename: str, as_dict: bool = False,
+                         preprocess: str = PREPROCESS_MODE, extraction: str = EXTRACTION_MODE):
+    """
+    Full analysis of one report file (shared by /analyze and background jobs).
+    Concurrent uploads of the same file with the same options share one run.
+    """
+    async def extract_pages() -> dict:
         # Get MedGemma client
         client = get_client()
 
-        # Process each page
-        all_lab_values = []
-        for image in images:
-            # Preprocess
-            processed_image = preprocess_image(image)
-
-            # Extract lab values (await if using API client)
-            extracted = await client.extract_lab_values(processed_image) if not USE_LOCAL_MODEL else client.extract_lab_values(processed_image)
-
-            for item in extracted:
-                lab_value = LabValue(
-                    test_name=item.get("test_name", "Unknown"),
-                    value=float(item.get("value", 0)),
-                    unit=item.get("unit", ""),
-                    reference_range=item.get("reference_range", "N/A"),
-                    status=item.get("status", "normal")
-                )
-                all_lab_values.append(lab_value)
+        # Render and extract pages as a pipeline, then merge back in page order
+        page_results = {}
+        async for page_index, extracted in _stream_pages(client, file_bytes, filename, preprocess, extraction):
+            page_results[page_index] = extracted
+        return page_results
 
-        return AnalysisResult(
-            filename=file.filename,
-            analyzed_at=datetime.utcnow().isoformat(),
-            lab_values=all_lab_values,
-            page_count=len(images)
-        )
+    key = (hashlib.sha256(file_bytes).hexdigest(), preprocess, extraction)
+    page_results = await _analyses.do(key, extract_pages)
+    request_trace.note(pages=len(page_results), format=os.path.splitext(filename)[1].lower().lstrip("."))
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    all_lab_values = []
+    for page_index in sorted(page_results):
+        all_lab_values.extend(_to_lab_values(page_results[page_index]))
+
+    result = AnalysisResult(
+        filename=filename,
+        analyzed_at=datetime.utcnow().isoformat(),
+        lab_values=all_lab_values,
+        page_count=len(page_results)
+    )
+    return result.model_dump() if as_dict else result
+
+
+@app.post("/analyze/stream")
+async def analyze_report_stream(file: UploadFile = File(...), preprocess: Optional[str] = None,
+                                extraction: Optional[str] = None):
+    """
+    Upload and analyze a lab report, streaming results as NDJSON.
+
+    Emits one {"event": "page", ...} line per page as soon as that page is
+    extracted (pages may arrive out of order), then a {"event": "summary", ...}
+    line. Failures after streaming starts are sent as {"event": "error", ...}.
+    """
+    _validate_upload(file)
+    preprocess = _preprocess_mode(preprocess)
+    extraction = _extraction_mode(extraction)
+
+    file_bytes = await file.read()
+    client = get_client()
+
+    async def events():
+        page_count, value_count = 0, 0
+        try:
+            async for page_index, extracted in _stream_pages(client, file_bytes, file.filename, preprocess, extraction):
+                lab_values = _to_lab_values(extracted)
+                page_count += 1
+                value_count += len(lab_values)
+                yield json.dumps({
+                    "event": "page",
+                    "page": page_index + 1,
+                    "lab_values": [lab_value.model_dump() for lab_value in lab_values]
+                }) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+            return
+
+        request_trace.note(pages=page_count, format=os.path.splitext(file.filename)[1].lower().lstrip("."))
+        yield json.dumps({
+            "event": "summary",
+            "filename": file.filename,
+            "analyzed_at": datetime.utcnow().isoformat(),
+            "page_count": page_count,
+            "value_count": value_count
+        }) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 
 @app.post("/explain")
@@ -149,33 +610,133 @@ async def explain_value(request: ExplanationRequest):
     Get a plain English explanation for a lab value.
     """
     try:
-        client = get_client()
-        if USE_LOCAL_MODEL:
-            explanation = client.explain_lab_value(
-                test_name=request.test_name,
-                value=request.value,
-                unit=request.unit,
-                reference_range=request.reference_range,
-                status=request.status
-            )
-        else:
-            explanation = await client.explain_lab_value(
-                test_name=request.test_name,
-                value=request.value,
-                unit=request.unit,
-                reference_range=request.reference_range,
-                status=request.status
-            )
+        params = dict(
+            test_name=request.test_name,
+            value=request.value,
+            unit=request.unit,
+            reference_range=request.reference_range,
+            status=request.status
+        )
+
+        async def explain() -> str:
+            # Common tests are precomputed; only true misses reach the model
+            store = get_explanation_store()
+            explanation = store.get(**params) if store is not None else None
+            if explanation is None:
+                client = get_client()
+                explanation = await client.explain_lab_value(**params)
+                if store is not None:
+                    await asyncio.to_thread(store.put, text=explanation, **params)
+            return explanation
+
+        key = (
+            normalize_test_name(request.test_name), request.value, normalize_unit(request.unit),
+            " ".join(request.reference_range.split()), request.status.lower()
+        )
+        explanation = await _explanations.do(key, explain)
 
         return {
             "test_name": request.test_name,
             "explanation": explanation
         }
 
+    except ProviderUnavailableError as e:
+        # Throttled or down upstream: tell the client when to retry instead of a 500
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/explain/stream")
+async def explain_value_stream(request: ExplanationRequest):
+    """
+    Stream a plain English explanation for a lab value as server-sent events.
+
+    Sends `data: {"token": ...}` events while the model generates, then an
+    `event: done` with the full explanation (or `event: error`).
+    """
+    params = dict(
+        test_name=request.test_name,
+        value=request.value,
+        unit=request.unit,
+        reference_range=request.reference_range,
+        status=request.status
+    )
+
+    def sse(data: dict, event: Optional[str] = None) -> str:
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {json.dumps(data)}\n\n"
+
+    async def events():
+        store = get_explanation_store()
+        explanation = store.get(**params) if store is not None else None
+        try:
+            if explanation is not None:
+                yield sse({"token": explanation})
+            else:
+                chunks = []
+                async for chunk in get_client().stream_explanation(**params):
+                    chunks.append(chunk)
+                    yield sse({"token": chunk})
+                explanation = "".join(chunks).strip()
+                if store is not None:
+                    await asyncio.to_thread(store.put, text=explanation, **params)
+        except Exception as e:
+            yield sse({"detail": str(e)}, event="error")
+            return
+
+        yield sse({"test_name": request.test_name, "explanation": explanation}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/jobs")
+async def create_job(files: list[UploadFile] = File(...)):
+    """
+    Queue many reports for background analysis.
+
+    Accepts PDF/image files and zip archives of them. Returns a job id and
+    one file id per report; poll GET /jobs/{job_id} for progress.
+    """
+    reports = []
+    try:
+        for file in files:
+            data = await file.read()
+            reports.extend(await asyncio.to_thread(expand_upload, file.filename, data))
+    except ValueError as e:
+        # Unsupported file type or over the size limit
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read upload: {e}")
+
+    if not reports:
+        raise HTTPException(status_code=400, detail="No PDF or image reports found in upload")
+    if len(reports) > JOBS_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many reports (max {JOBS_MAX_FILES})")
+
+    job = await asyncio.to_thread(job_runner.store.create_job, reports)
+    job_runner.notify()
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a batch job and each of its files."""
+    job = await asyncio.to_thread(job_runner.store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/files/{file_id}")
+async def get_job_file(job_id: str, file_id: str):
+    """Status and analysis result of one file in a batch job."""
+    job_file = await asyncio.to_thread(job_runner.store.get_file, job_id, file_id)
+    if job_file is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return job_file
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -5,15 +5,35 @@ Simpler setup, no local GPU required
 
 import os
 import json
-import base64
+import time
+import asyncio
 import httpx
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 from PIL import Image
-from io import BytesIO
 from dotenv import load_dotenv
 
+from image_encoding import encode_image
+from resilience import ProviderGuard, ProviderUnavailableError, retry_after_seconds
+from json_stream import LabArrayParser, LabRows, token_budget, text_token_budget
+import metrics
+from report_parser import count_text_lines
+
 load_dotenv()
 
+# Connection pool settings (shared by all requests to a backend)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# Provider base URLs (override to point at a proxy or a local stand-in server)
+HF_API_BASE = os.getenv("HF_API_BASE", "https://router.huggingface.co/hf-inference").rstrip("/")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
 # Load prompts
 PROMPTS_DIR = Path(__file__).parent / "prompts"
 
@@ -23,6 +43,191 @@ def load_prompt(name: str) -> str:
         return f.read()
 
 
+class HTTPPool:
+    """
+    Long-lived pooled httpx.AsyncClient for one backend.
+    Keeps connections alive between pages/explanations and counts how
+    often connections are opened, reused, or waited for.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.client = None
+        self.requests = 0
+        self.connections_opened = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # Rate limiting, retries and circuit breaking for this provider
+        self.guard = ProviderGuard(name)
+
+    async def open(self):
+        """Create the underlying client (idempotent)."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(120.0, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+            )
+
+    async def aclose(self):
+        """Close all pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _trace(self, event_name: str, info: dict):
+        # httpcore reports each new TCP connection; everything else was reused
+        if event_name == "connection.connect_tcp.started":
+            self.connections_opened += 1
+
+    async def post(self, url: str, timeout: float, **kwargs) -> httpx.Response:
+        """
+        POST through the shared pool, rate limited and retried on 429/5xx and
+        network errors. The last response is returned even if it is an error;
+        a network error that isn't retried raises ProviderUnavailableError.
+        """
+        await self.open()
+        attempt = 0
+        while True:
+            probe = await self.guard.before(attempt)
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                response = await self.client.post(
+                    url,
+                    timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+                    extensions={"trace": self._trace},
+                    **kwargs
+                )
+            except httpx.TransportError as e:
+                delay = self.guard.retry_delay(attempt, error=e)
+                if delay is None:
+                    raise self.guard.unavailable(e) from e
+            else:
+                delay = self.guard.retry_delay(attempt, response=response)
+                if delay is None:
+                    return response
+            finally:
+                self.in_flight -= 1
+                self.guard.release(probe)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @asynccontextmanager
+    async def stream(self, url: str, timeout: float, **kwargs):
+        """
+        POST through the shared pool and stream the response body. Retried like
+        post() until a response is handed to the caller, never after.
+        """
+        await self.open()
+        attempt = 0
+        while True:
+            probe = await self.guard.before(attempt)
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            yielded = False
+            delay = None
+            try:
+                async with self.client.stream(
+                    "POST",
+                    url,
+                    timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT),
+                    extensions={"trace": self._trace},
+                    **kwargs
+                ) as response:
+                    delay = self.guard.retry_delay(attempt, response=response)
+                    if delay is None:
+                        yielded = True
+                        yield response
+                        return
+            except httpx.TransportError as e:
+                if yielded:
+                    # Connection lost mid-body: too late to retry, but still a provider failure
+                    self.guard.breaker.record_failure()
+                    raise self.guard.unavailable(e) from e
+                delay = self.guard.retry_delay(attempt, error=e)
+                if delay is None:
+                    raise self.guard.unavailable(e) from e
+            finally:
+                self.in_flight -= 1
+                self.guard.release(probe)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        """Pool statistics for sizing HTTP_MAX_CONNECTIONS."""
+        connections, queued = [], []
+        if self.client is not None:
+            # httpcore pool behind the default transport
+            pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            # Requests not yet assigned a connection are waiting on the pool
+            queued = [r for r in getattr(pool, "_requests", []) if getattr(r, "connection", None) is None]
+        return {
+            "backend": self.name,
+            "http2": HTTP2_ENABLED,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "connections_open": len(connections),
+            "connections_idle": sum(1 for c in connections if c.is_idle()),
+            "connections_opened": self.connections_opened,
+            "requests": self.requests,
+            "requests_reused_connection": max(self.requests - self.connections_opened, 0),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": len(queued),
+            **self.guard.stats(),
+        }
+
+
+def raise_for_status(response: httpx.Response):
+    """Raise for a non-200 response; throttling and outages become ProviderUnavailableError."""
+    if response.status_code == 200:
+        return
+    message = f"API error: {response.status_code} - {response.text}"
+    if response.status_code in (429, 502, 503, 504):
+        raise ProviderUnavailableError(message, retry_after=retry_after_seconds(response.headers) or 1.0)
+    raise Exception(message)
+
+
+async def sse_events(response: httpx.Response):
+    """Yield the JSON payload of each `data:` line of a server-sent event stream."""
+    if response.status_code != 200:
+        await response.aread()
+        raise_for_status(response)
+
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if not data or data == "[DONE]":
+            continue
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+
+def _encode_page(image: Image.Image) -> tuple:
+    """Encoded page and its base64 payload (CPU-bound: run in a thread, off the event loop)."""
+    encoded = encode_image(image)
+    return encoded, encoded.b64()
+
+
+def _record_extraction(backend: str, seconds: float, parse_seconds: float, tokens: int, parser: LabArrayParser):
+    """Per-page metrics for one streamed extraction (parsing overlaps the stream, so it is split out)."""
+    metrics.stage_seconds.observe(seconds - parse_seconds, stage="inference", backend=backend)
+    metrics.stage_seconds.observe(parse_seconds, stage="parse", backend=backend)
+    metrics.generated_tokens_total.inc(tokens, backend=backend)
+    if not parser.ok:
+        metrics.parse_failures_total.inc(backend=backend)
+
+
 class MedGemmaAPIClient:
     """
     Client for MedGemma using Hugging Face Inference API.
@@ -36,18 +241,21 @@ class MedGemmaAPIClient:
 
         # MedGemma model endpoint (using router URL)
         self.model_id = "google/medgemma-1.5-4b-it"
-        self.api_url = f"https://router.huggingface.co/hf-inference/models/{self.model_id}"
+        self.api_url = f"{HF_API_BASE}/models/{self.model_id}"
 
         self.headers = {
             "Authorization": f"Bearer {self.hf_token}",
             "Content-Type": "application/json"
         }
+        self.pool = HTTPPool("MedGemmaAPIClient")
+
+    async def start(self):
+        """Open the shared connection pool."""
+        await self.pool.open()
 
-    def _image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string."""
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+    async def aclose(self):
+        """Close the shared connection pool."""
+        await self.pool.aclose()
 
     async def extract_lab_values(self, image: Image.Image) -> list[dict]:
         """
@@ -59,10 +267,19 @@ class MedGemmaAPIClient:
         Returns:
             List of extracted lab values
         """
+        parser = LabArrayParser()
+        rows = [row async for row in self.iter_lab_values(image, parser)]
+        return LabRows(rows, complete=parser.ok)
+
+    async def iter_lab_values(self, image: Image.Image, parser: Optional[LabArrayParser] = None):
+        """Stream extraction from a page image, yielding each lab value as soon as it is parsed."""
         extraction_prompt = load_prompt("extract")
 
-        # Convert image to base64
-        image_b64 = self._image_to_base64(image)
+        # Encode image (passthrough or fast codec)
+        start = time.perf_counter()
+        encoded, image_b64 = await asyncio.to_thread(_encode_page, image)
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="encode", backend=self.pool.name)
+        max_tokens = token_budget(await asyncio.to_thread(count_text_lines, image))
 
         payload = {
             "inputs": {
@@ -70,36 +287,69 @@ class MedGemmaAPIClient:
                 "text": extraction_prompt
             },
             "parameters": {
-                "max_new_tokens": 2048,
+                "max_new_tokens": max_tokens,
                 "do_sample": False
-            }
+            },
+            "stream": True
         }
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload
-            )
+        async for row in self._stream_rows(payload, parser):
+            yield row
 
-            if response.status_code != 200:
-                raise Exception(f"API error: {response.status_code} - {response.text}")
+    async def extract_lab_values_from_text(self, report_text: str) -> list[dict]:
+        """
+        Extract lab values from OCR text of a report page (text-only prompt).
 
-            result = response.json()
+        Args:
+            report_text: Layout-preserving OCR text
 
-        # Parse JSON from response
-        response_text = result.get("generated_text", "")
+        Returns:
+            List of extracted lab values
+        """
+        parser = LabArrayParser()
+        rows = [row async for row in self.iter_lab_values_from_text(report_text, parser)]
+        return LabRows(rows, complete=parser.ok)
 
-        try:
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                return json.loads(json_str)
-        except json.JSONDecodeError:
-            pass
+    async def iter_lab_values_from_text(self, report_text: str, parser: Optional[LabArrayParser] = None):
+        """Stream extraction from OCR text, yielding each lab value as soon as it is parsed."""
+        extraction_prompt = load_prompt("extract_text").format(report_text=report_text)
+
+        payload = {
+            "inputs": extraction_prompt,
+            "parameters": {
+                "max_new_tokens": text_token_budget(report_text),
+                "do_sample": False,
+                "return_full_text": False
+            },
+            "stream": True
+        }
 
-        return []
+        async for row in self._stream_rows(payload, parser):
+            yield row
+
+    async def _stream_rows(self, payload: dict, parser: Optional[LabArrayParser] = None):
+        """
+        Feed streamed tokens to the incremental parser and stop reading once the
+        array closes; closing the stream early stops generation on the server.
+        Pass a parser to check afterwards whether the array was complete.
+        """
+        if parser is None:
+            parser = LabArrayParser()
+        start, parse_seconds, tokens = time.perf_counter(), 0.0, 0
+        async with self.pool.stream(self.api_url, timeout=120.0, headers=self.headers, json=payload) as response:
+            async for event in sse_events(response):
+                token = event.get("token", {})
+                tokens += 1
+                if token.get("special"):
+                    continue
+                parse_start = time.perf_counter()
+                rows = parser.feed(token.get("text", ""))
+                parse_seconds += time.perf_counter() - parse_start
+                for row in rows:
+                    yield row
+                if parser.done:
+                    break
+        _record_extraction(self.pool.name, time.perf_counter() - start, parse_seconds, tokens, parser)
 
     async def explain_lab_value(self, test_name: str, value: float, unit: str,
                                  reference_range: str, status: str) -> str:
@@ -122,20 +372,47 @@ class MedGemmaAPIClient:
             }
         }
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload
-            )
+        response = await self.pool.post(
+            self.api_url,
+            timeout=60.0,
+            headers=self.headers,
+            json=payload
+        )
 
-            if response.status_code != 200:
-                raise Exception(f"API error: {response.status_code} - {response.text}")
+        raise_for_status(response)
 
-            result = response.json()
+        result = response.json()
 
         return result.get("generated_text", "").replace(explanation_prompt, "").strip()
 
+    async def stream_explanation(self, test_name: str, value: float, unit: str,
+                                 reference_range: str, status: str):
+        """Stream a plain English explanation, yielding text as tokens arrive."""
+
+        explanation_prompt = load_prompt("explain").format(
+            test_name=test_name,
+            value=value,
+            unit=unit,
+            reference_range=reference_range,
+            status=status
+        )
+
+        payload = {
+            "inputs": explanation_prompt,
+            "parameters": {
+                "max_new_tokens": 256,
+                "do_sample": True,
+                "temperature": 0.7
+            },
+            "stream": True
+        }
+
+        async with self.pool.stream(self.api_url, timeout=60.0, headers=self.headers, json=payload) as response:
+            async for event in sse_events(response):
+                token = event.get("token", {})
+                if token.get("text") and not token.get("special"):
+                    yield token["text"]
+
 
 # Alternative: Use Google AI Studio (Gemini) as fallback
 class GeminiClient:
@@ -149,19 +426,33 @@ class GeminiClient:
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY not set")
 
-        self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+        self.model_id = "gemini-1.5-flash"
+        self.model_url = f"{GEMINI_API_BASE}/models/{self.model_id}"
+        self.api_url = f"{self.model_url}:generateContent"
+        self.pool = HTTPPool("GeminiClient")
 
-    def _image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string."""
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+    async def start(self):
+        """Open the shared connection pool."""
+        await self.pool.open()
+
+    async def aclose(self):
+        """Close the shared connection pool."""
+        await self.pool.aclose()
 
     async def extract_lab_values(self, image: Image.Image) -> list[dict]:
         """Extract lab values using Gemini."""
+        parser = LabArrayParser()
+        rows = [row async for row in self.iter_lab_values(image, parser)]
+        return LabRows(rows, complete=parser.ok)
+
+    async def iter_lab_values(self, image: Image.Image, parser: Optional[LabArrayParser] = None):
+        """Stream extraction from a page image, yielding each lab value as soon as it is parsed."""
 
         extraction_prompt = load_prompt("extract")
-        image_b64 = self._image_to_base64(image)
+        start = time.perf_counter()
+        encoded, image_b64 = await asyncio.to_thread(_encode_page, image)
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="encode", backend=self.pool.name)
+        max_tokens = token_budget(await asyncio.to_thread(count_text_lines, image))
 
         payload = {
             "contents": [{
@@ -169,46 +460,127 @@ class GeminiClient:
                     {"text": extraction_prompt},
                     {
                         "inline_data": {
-                            "mime_type": "image/png",
+                            "mime_type": encoded.mime_type,
                             "data": image_b64
                         }
                     }
                 ]
             }],
             "generationConfig": {
-                "maxOutputTokens": 2048,
+                "maxOutputTokens": max_tokens,
                 "temperature": 0
             }
         }
 
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.api_url}?key={self.api_key}",
-                json=payload
-            )
+        async for row in self._stream_rows(payload, parser):
+            yield row
 
-            if response.status_code != 200:
-                raise Exception(f"API error: {response.status_code} - {response.text}")
+    async def extract_lab_values_from_text(self, report_text: str) -> list[dict]:
+        """Extract lab values from OCR text of a report page using Gemini."""
+        parser = LabArrayParser()
+        rows = [row async for row in self.iter_lab_values_from_text(report_text, parser)]
+        return LabRows(rows, complete=parser.ok)
 
-            result = response.json()
+    async def iter_lab_values_from_text(self, report_text: str, parser: Optional[LabArrayParser] = None):
+        """Stream extraction from OCR text, yielding each lab value as soon as it is parsed."""
 
-        # Extract text from response
-        response_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+        extraction_prompt = load_prompt("extract_text").format(report_text=report_text)
 
-        try:
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response_text[start_idx:end_idx]
-                return json.loads(json_str)
-        except json.JSONDecodeError:
-            pass
+        payload = {
+            "contents": [{
+                "parts": [{"text": extraction_prompt}]
+            }],
+            "generationConfig": {
+                "maxOutputTokens": text_token_budget(report_text),
+                "temperature": 0
+            }
+        }
 
-        return []
+        async for row in self._stream_rows(payload, parser):
+            yield row
 
+    async def _stream_rows(self, payload: dict, parser: Optional[LabArrayParser] = None):
+        """
+        Feed streamed text to the incremental parser and stop reading once the
+        array closes; closing the stream early stops generation on the server.
+        Pass a parser to check afterwards whether the array was complete.
+        """
+        if parser is None:
+            parser = LabArrayParser()
+        url = f"{self.model_url}:streamGenerateContent?alt=sse&key={self.api_key}"
+        start, parse_seconds, tokens = time.perf_counter(), 0.0, 0
+        async with self.pool.stream(url, timeout=120.0, json=payload) as response:
+            async for event in sse_events(response):
+                tokens = event.get("usageMetadata", {}).get("candidatesTokenCount", tokens)
+                parts = event.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+                for part in parts:
+                    parse_start = time.perf_counter()
+                    rows = parser.feed(part.get("text", ""))
+                    parse_seconds += time.perf_counter() - parse_start
+                    for row in rows:
+                        yield row
+                if parser.done:
+                    break
+        _record_extraction(self.pool.name, time.perf_counter() - start, parse_seconds, tokens, parser)
+
+    def _explanation_payload(self, test_name: str, value: float, unit: str,
+                             reference_range: str, status: str) -> dict:
+        explanation_prompt = load_prompt("explain").format(
+            test_name=test_name,
+            value=value,
+            unit=unit,
+            reference_range=reference_range,
+            status=status
+        )
 
-def get_client():
-    """Get the best available client."""
+        return {
+            "contents": [{
+                "parts": [{"text": explanation_prompt}]
+            }],
+            "generationConfig": {
+                "maxOutputTokens": 256,
+                "temperature": 0.7
+            }
+        }
+
+    async def explain_lab_value(self, test_name: str, value: float, unit: str,
+                                 reference_range: str, status: str) -> str:
+        """Generate plain English explanation for a lab value using Gemini."""
+
+        payload = self._explanation_payload(test_name, value, unit, reference_range, status)
+
+        response = await self.pool.post(
+            f"{self.api_url}?key={self.api_key}",
+            timeout=60.0,
+            json=payload
+        )
+
+        raise_for_status(response)
+
+        result = response.json()
+
+        return result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
+
+    async def stream_explanation(self, test_name: str, value: float, unit: str,
+                                 reference_range: str, status: str):
+        """Stream a plain English explanation, yielding text as Gemini produces it."""
+
+        payload = self._explanation_payload(test_name, value, unit, reference_range, status)
+        url = f"{self.model_url}:streamGenerateContent?alt=sse&key={self.api_key}"
+
+        async with self.pool.stream(url, timeout=60.0, json=payload) as response:
+            async for event in sse_events(response):
+                parts = event.get("candidates", [{}])[0].get("content", {}).get("parts", [])
+                for part in parts:
+                    if part.get("text"):
+                        yield part["text"]
+
+
+# Singleton instance (one connection pool per process)
+_client = None
+
+def _create_client():
+    """Create the best available client."""
     # Try MedGemma first
     if os.getenv("HF_TOKEN"):
         try:
@@ -223,5 +595,13 @@ def get_client():
     raise ValueError("No API keys found. Set HF_TOKEN or GOOGLE_API_KEY")
 
 
+def get_client():
+    """Get the best available client (shared, so its connection pool is reused)."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
+
+
 if __name__ == "__main__":
     print("API Client ready. Set HF_TOKEN or GOOGLE_API_KEY environment variable.")
@@ -4,11 +4,55 @@ Uses MedGemma 1.5 4B from Hugging Face
 """
 
 import os
-import json
+import re
+import copy
+import time
+import hashlib
+import importlib.util
 from pathlib import Path
+from threading import Thread
+from typing import Callable, Iterator, Optional
 from PIL import Image
-import torch
-from transformers import pipeline
+from dotenv import load_dotenv
+
+from json_stream import (
+    LabArrayParser, LabRows, token_budget, text_token_budget, LAB_VALUES_SCHEMA, EXTRACT_MAX_NEW_TOKENS
+)
+from report_parser import count_text_lines
+import metrics
+
+# Heavy runtime modules, imported by load_model rather than at import time
+# (torch + transformers take seconds to import; the API-only server never needs them)
+torch = None
+transformers = None
+
+# Optional: grammar-constrained decoding against LAB_VALUES_SCHEMA
+FORMAT_ENFORCER_AVAILABLE = importlib.util.find_spec("lmformatenforcer") is not None
+# Optional: 4-bit weight-only quantization
+QUANTO_AVAILABLE = importlib.util.find_spec("optimum") is not None and \
+    importlib.util.find_spec("optimum.quanto") is not None
+
+load_dotenv()
+
+LOCAL_CONSTRAINED_DECODING = os.getenv("LOCAL_CONSTRAINED_DECODING", "false").lower() == "true"
+# Extra attempts for a page whose output did not parse (truncated or malformed JSON)
+LOCAL_EXTRACT_RETRIES = int(os.getenv("LOCAL_EXTRACT_RETRIES", "1"))
+
+# Weights/compute precision: auto (fp16 on GPU, fp32 on CPU), fp32, fp16, bf16,
+# int8 (dynamic quantization of Linear layers, CPU) or int4 (weight-only, needs optimum-quanto)
+LOCAL_PRECISION = os.getenv("LOCAL_PRECISION", "auto").lower()
+# Runtime: eager, or compile (torch.compile graphs for the vision encoder and decoder)
+LOCAL_RUNTIME = os.getenv("LOCAL_RUNTIME", "eager").lower()
+# CPU threads for intra-op / inter-op parallelism (0 = torch default)
+LOCAL_NUM_THREADS = int(os.getenv("LOCAL_NUM_THREADS", "0"))
+LOCAL_INTEROP_THREADS = int(os.getenv("LOCAL_INTEROP_THREADS", "0"))
+
+PRECISIONS = ("auto", "fp32", "fp16", "bf16", "int8", "int4")
+
+# Reuse the KV cache of each prompt's static prefix (single-item generations only)
+LOCAL_PREFIX_CACHE = os.getenv("LOCAL_PREFIX_CACHE", "true").lower() == "true"
+
+PLACEHOLDER = re.compile(r"\{[a-z_]+\}")
 
 # Load prompts
 PROMPTS_DIR = Path(__file__).parent / "prompts"
@@ -18,6 +62,43 @@ def load_prompt(name: str) -> str:
     with open(PROMPTS_DIR / f"{name}.txt", "r") as f:
         return f.read()
 
+
+def _import_runtime() -> float:
+    """Import torch and transformers on first use; returns the seconds it took."""
+    global torch, transformers
+    if torch is not None:
+        return 0.0
+    start = time.perf_counter()
+    import torch
+    import transformers
+    return time.perf_counter() - start
+
+
+class JSONArrayStop:
+    """
+    Stopping criterion (transformers StoppingCriteria protocol) that ends generation
+    once every sequence in the batch has closed its JSON array, instead of running
+    on to max_new_tokens with trailing commentary.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.parsers = []
+        self.length = 0
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if input_ids.shape[1] <= self.length or len(self.parsers) != input_ids.shape[0]:
+            # A new generate() call (the pipeline may split the batch)
+            self.parsers = [LabArrayParser() for _ in range(input_ids.shape[0])]
+        self.length = input_ids.shape[1]
+
+        # Only the newest token is unseen; structural characters decode on their own
+        for parser, token in zip(self.parsers, input_ids[:, -1].tolist()):
+            if not parser.done:
+                parser.feed(self.tokenizer.decode([token], skip_special_tokens=True))
+        return all(parser.done for parser in self.parsers)
+
+
 class MedGemmaClient:
     """Client for interacting with MedGemma model."""
 
@@ -38,63 +119,385 @@ class MedGemmaClient:
         else:
             self.model_id = "google/medgemma-1.5-4b-it"
         self.pipe = None
-        self.device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+        # Resolved by load_model, once torch is imported
+        self.device = None
+        self.precision = LOCAL_PRECISION if LOCAL_PRECISION in PRECISIONS else "auto"
+        self.load_seconds = None
+        # Startup phase -> seconds (import, load, warm-up steps)
+        self.startup_timings = {}
+
+        self.constrained = LOCAL_CONSTRAINED_DECODING and FORMAT_ENFORCER_AVAILABLE
+        if LOCAL_CONSTRAINED_DECODING and not FORMAT_ENFORCER_AVAILABLE:
+            print("LOCAL_CONSTRAINED_DECODING needs lm-format-enforcer; using free-form decoding")
+        self._enforcer_data = None
+        self.prefix_cache = LOCAL_PREFIX_CACHE
+        # prompt name -> (prompt file hash, prefix token ids, KV cache)
+        self._prefixes = {}
+        self.generation_stats = {
+            "generations": 0,
+            "parse_failures": 0,
+            "retries": 0,
+            "generated_tokens": 0,
+            "wasted_tokens": 0,
+            "prefix_builds": 0,
+            "prefix_hits": 0,
+            "prefix_tokens_reused": 0,
+        }
 
     def load_model(self):
-        """Load model using pipeline."""
+        """Load model using pipeline, in the configured precision and runtime."""
         if self.pipe is None:
-            print(f"Loading MedGemma model on {self.device}...")
+            import_seconds = _import_runtime()
+            if import_seconds:
+                self.startup_timings["import_runtime"] = round(import_seconds, 2)
 
-            self.pipe = pipeline(
+            self.device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+            if self.precision == "auto":
+                self.precision = "fp16" if self.device != "cpu" else "fp32"
+
+            print(f"Loading MedGemma model on {self.device} ({self.precision}, {LOCAL_RUNTIME})...")
+            start = time.perf_counter()
+
+            if LOCAL_NUM_THREADS:
+                torch.set_num_threads(LOCAL_NUM_THREADS)
+            if LOCAL_INTEROP_THREADS:
+                try:
+                    torch.set_num_interop_threads(LOCAL_INTEROP_THREADS)
+                except RuntimeError:
+                    # Can only be set before the first parallel operation
+                    print("LOCAL_INTEROP_THREADS ignored: torch already started its thread pool")
+
+            self.pipe = transformers.pipeline(
                 "image-text-to-text",
                 model=self.model_id,
                 device=self.device,
-                torch_dtype=torch.float16 if self.device != "cpu" else torch.float32,
+                torch_dtype=self._load_dtype(),
                 trust_remote_code=True,
             )
+            self._quantize()
+            if LOCAL_RUNTIME == "compile":
+                self._compile()
 
-            print("Model loaded successfully!")
+            self.load_seconds = time.perf_counter() - start
+            self.startup_timings["load_model"] = round(self.load_seconds, 2)
+            print(f"Model loaded successfully in {self.load_seconds:.1f}s!")
 
-    def extract_lab_values(self, image: Image.Image) -> list[dict]:
+    def warm_up(self, generate: bool = True) -> dict:
         """
-        Extract lab values from a lab report image.
+        Load the model and run one short extraction and explanation, so the first
+        real request doesn't pay for lazy initialisation (kernels, compiled graphs,
+        prompt prefix caches).
 
         Args:
-            image: PIL Image of the lab report
+            generate: Run the warm-up generations (False only loads the model)
 
         Returns:
-            List of extracted lab values with test_name, value, unit, reference_range, status
+            Startup phase timings in seconds
         """
         self.load_model()
+        if not generate:
+            return dict(self.startup_timings)
+
+        start = time.perf_counter()
+        blank_page = Image.new("RGB", (896, 896), "white")
+        self._generate_json([self._extraction_messages(blank_page)], 16, self.prompt_name("extract"))
+        self.startup_timings["warmup_extract"] = round(time.perf_counter() - start, 2)
+
+        start = time.perf_counter()
+        messages = self._explanation_messages("Hemoglobin", 14.2, "g/dL", "13.0 - 17.0", "normal")
+        if self._generate_with_prefix(messages, "explain", 16, {}) is None:
+            self.pipe(messages, max_new_tokens=16)
+        self.startup_timings["warmup_explain"] = round(time.perf_counter() - start, 2)
 
-        extraction_prompt = load_prompt("extract")
+        return dict(self.startup_timings)
 
-        # Use pipeline with image and text
-        messages = [
+    def _load_dtype(self):
+        """Dtype the weights are loaded in; int8/int4 quantize from full precision."""
+        return {
+            "fp16": torch.float16,
+            "bf16": torch.bfloat16,
+        }.get(self.precision, torch.float32)
+
+    def _quantize(self):
+        model = self.pipe.model
+        if self.precision == "int8":
+            if self.device != "cpu":
+                print("int8 dynamic quantization is CPU-only; keeping fp32 weights")
+                self.precision = "fp32"
+                return
+            # Linear weights stored as int8, activations quantized on the fly
+            self.pipe.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.precision == "int4":
+            if not QUANTO_AVAILABLE:
+                print("int4 needs optimum-quanto; keeping fp32 weights")
+                self.precision = "fp32"
+                return
+            from optimum.quanto import quantize, freeze, qint4
+            # Weight-only: 4-bit weights dequantized per matmul, activations stay fp32
+            quantize(model, weights=qint4)
+            freeze(model)
+
+    def _compile(self):
+        """Compile the vision encoder and the decoder separately (shapes vary, so dynamic)."""
+        model = self.pipe.model
+        for name in ("vision_tower", "multi_modal_projector", "language_model"):
+            module = getattr(model, name, None)
+            if module is not None:
+                setattr(model, name, torch.compile(module, dynamic=True))
+
+    def prompt_name(self, name: str) -> str:
+        """Prompt file actually used for `name` (the constrained prompts omit the output format the schema fixes)."""
+        return f"{name}_constrained" if self.constrained else name
+
+    def _extraction_messages(self, image: Image.Image) -> list[dict]:
+        """Build the chat messages for one extraction request."""
+        extraction_prompt = load_prompt(self.prompt_name("extract"))
+        return [
+            {
+                "role": "user",
+                # Instructions before the image, so they form a reusable prefix
+                "content": [
+                    {"type": "text", "text": extraction_prompt},
+                    {"type": "image", "image": image}
+                ]
+            }
+        ]
+
+    def _text_extraction_messages(self, report_text: str) -> list[dict]:
+        """Build the chat messages for extraction from OCR text (text-only)."""
+        extraction_prompt = load_prompt(self.prompt_name("extract_text")).format(report_text=report_text)
+        return [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "image": image},
                     {"type": "text", "text": extraction_prompt}
                 ]
             }
         ]
 
-        output = self.pipe(messages, max_new_tokens=2048)
-        response = output[0]["generated_text"][-1]["content"]
+    def _explanation_messages(self, test_name: str, value: float, unit: str,
+                              reference_range: str, status: str) -> list[dict]:
+        """Build the chat messages for one explanation request (text-only)."""
+        explanation_prompt = load_prompt("explain").format(
+            test_name=test_name,
+            value=value,
+            unit=unit,
+            reference_range=reference_range,
+            status=status
+        )
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": explanation_prompt}
+                ]
+            }
+        ]
+
+    def extract_lab_values(self, image: Image.Image) -> list[dict]:
+        """
+        Extract lab values from a lab report image.
+
+        Args:
+            image: PIL Image of the lab report
+
+        Returns:
+            List of extracted lab values with test_name, value, unit, reference_range, status
+        """
+        return self.extract_lab_values_batch([image])[0]
+
+    def extract_lab_values_batch(self, images: list[Image.Image]) -> list[list[dict]]:
+        """
+        Extract lab values from several page images in one batched generation.
+
+        Args:
+            images: PIL Images of lab report pages
+
+        Returns:
+            One list of extracted lab values per image, in input order
+        """
+        self.load_model()
+
+        conversations = [self._extraction_messages(image) for image in images]
+        budget = max(token_budget(count_text_lines(image)) for image in images)
+        return self._generate_lab_values(conversations, budget, self.prompt_name("extract"))
+
+    def extract_lab_values_from_text_batch(self, report_texts: list[str]) -> list[list[dict]]:
+        """
+        Extract lab values from OCR text of several pages in one batched generation.
+        Much cheaper than image input on CPU: no vision encoder, fewer prompt tokens.
+
+        Args:
+            report_texts: Layout-preserving OCR text, one per page
+
+        Returns:
+            One list of extracted lab values per page, in input order
+        """
+        self.load_model()
+
+        conversations = [self._text_extraction_messages(text) for text in report_texts]
+        budget = max(text_token_budget(text) for text in report_texts)
+        return self._generate_lab_values(conversations, budget, self.prompt_name("extract_text"))
+
+    def _generate_lab_values(self, conversations: list[list[dict]], max_new_tokens: int,
+                             prompt_name: str) -> list[list[dict]]:
+        """
+        Batched extraction. Responses that don't parse are regenerated (with a
+        larger budget, in case they were cut off) up to LOCAL_EXTRACT_RETRIES times;
+        their tokens are counted as wasted.
+        """
+        tokenizer = self._tokenizer()
+        results = [[] for _ in conversations]
+        pending = list(range(len(conversations)))
+
+        for attempt in range(LOCAL_EXTRACT_RETRIES + 1):
+            start = time.perf_counter()
+            responses = self._generate_json([conversations[i] for i in pending], max_new_tokens, prompt_name)
+            # Batched: each page waited for the whole batch
+            elapsed = time.perf_counter() - start
+            retry = []
+            for i, response in zip(pending, responses):
+                metrics.stage_seconds.observe(elapsed, stage="inference", backend="MedGemmaClient")
+                tokens = len(tokenizer(response, add_special_tokens=False).input_ids)
+                self.generation_stats["generations"] += 1
+                self.generation_stats["generated_tokens"] += tokens
+                metrics.generated_tokens_total.inc(tokens, backend="MedGemmaClient")
+
+                with metrics.stage_seconds.time(stage="parse", backend="MedGemmaClient"):
+                    parser = LabArrayParser()
+                    parser.feed(response)
+                results[i] = LabRows(parser.rows, complete=parser.ok)
+                if parser.ok:
+                    continue
+                self.generation_stats["parse_failures"] += 1
+                metrics.parse_failures_total.inc(backend="MedGemmaClient")
+                if attempt < LOCAL_EXTRACT_RETRIES:
+                    self.generation_stats["retries"] += 1
+                    self.generation_stats["wasted_tokens"] += tokens
+                    retry.append(i)
+
+            if not retry:
+                break
+            pending = retry
+            max_new_tokens = min(max_new_tokens * 2, EXTRACT_MAX_NEW_TOKENS)
 
-        # Parse JSON from response
+        return results
+
+    def _generate_json(self, conversations: list[list[dict]], max_new_tokens: int, prompt_name: str) -> list[str]:
+        """One batched generation that stops as soon as every response has closed its array."""
+        generate_kwargs = {"stopping_criteria": transformers.StoppingCriteriaList([JSONArrayStop(self._tokenizer())])}
+        if self.constrained:
+            from lmformatenforcer import JsonSchemaParser
+            from lmformatenforcer.integrations.transformers import (
+                build_token_enforcer_tokenizer_data, build_transformers_prefix_allowed_tokens_fn
+            )
+            if self._enforcer_data is None:
+                # Scans the vocabulary once; reused by every constrained generation
+                self._enforcer_data = build_token_enforcer_tokenizer_data(self._tokenizer())
+            generate_kwargs["prefix_allowed_tokens_fn"] = build_transformers_prefix_allowed_tokens_fn(
+                self._enforcer_data, JsonSchemaParser(LAB_VALUES_SCHEMA)
+            )
+
+        if len(conversations) == 1:
+            response = self._generate_with_prefix(conversations[0], prompt_name, max_new_tokens, generate_kwargs)
+            if response is not None:
+                return [response]
+
+        outputs = self.pipe(
+            conversations,
+            max_new_tokens=max_new_tokens,
+            batch_size=len(conversations),
+            generate_kwargs=generate_kwargs
+        )
+
+        return [output[0]["generated_text"][-1]["content"] for output in outputs]
+
+    def _prefix_state(self, prompt_name: str, prefix_ids):
+        """
+        KV cache of a prompt's static prefix, computed once per loaded model.
+        Keyed by the prompt file's hash, so editing a prompt rebuilds it.
+        """
+        template = load_prompt(prompt_name)
+        digest = hashlib.sha256(template.encode()).hexdigest()
+        entry = self._prefixes.get(prompt_name)
+        if entry is not None and entry[0] == digest and torch.equal(entry[1], prefix_ids):
+            self.generation_stats["prefix_hits"] += 1
+            return entry[2]
+
+        with torch.inference_mode():
+            output = self.pipe.model(input_ids=prefix_ids, use_cache=True)
+        self._prefixes[prompt_name] = (digest, prefix_ids, output.past_key_values)
+        self.generation_stats["prefix_builds"] += 1
+        return output.past_key_values
+
+    def _generate_with_prefix(self, messages: list[dict], prompt_name: str, max_new_tokens: int,
+                              generate_kwargs: dict) -> Optional[str]:
+        """
+        Generate one response, prefilling only the part after the prompt's static
+        prefix (everything before its first placeholder, or the whole instruction
+        text for image prompts). Returns None when the prefix can't be reused.
+        """
+        if not self.prefix_cache:
+            return None
         try:
-            # Find JSON array in response
-            start_idx = response.find('[')
-            end_idx = response.rfind(']') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response[start_idx:end_idx]
-                return json.loads(json_str)
-        except json.JSONDecodeError:
-            pass
+            processor = getattr(self.pipe, "processor", None) or self._tokenizer()
+            model = self.pipe.model
+
+            rendered = processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            template = load_prompt(prompt_name)
+            placeholder = PLACEHOLDER.search(template)
+            static = template[:placeholder.start()] if placeholder else template
+            end = rendered.find(static)
+            if not static or end == -1:
+                return None
+
+            inputs = processor.apply_chat_template(
+                messages, add_generation_prompt=True, tokenize=True, return_dict=True, return_tensors="pt"
+            ).to(model.device, dtype=self._load_dtype())
+            input_ids = inputs["input_ids"]
+            prefix_ids = self._tokenizer()(
+                rendered[:end + len(static)], add_special_tokens=False, return_tensors="pt"
+            ).input_ids.to(model.device)
+            n = prefix_ids.shape[1]
+            # Token boundaries must match the full prompt's tokenization
+            if n >= input_ids.shape[1] or not torch.equal(input_ids[0, :n], prefix_ids[0]):
+                return None
+
+            cache = copy.deepcopy(self._prefix_state(prompt_name, prefix_ids))
+            self.generation_stats["prefix_tokens_reused"] += n
 
-        return []
+            # Prefill the request-specific part (image tokens, values) except the
+            # last token, which generate() needs to start from
+            last = input_ids.shape[1] - 1
+            extra = {k: v for k, v in inputs.items() if k not in ("input_ids", "attention_mask")}
+            if "token_type_ids" in extra:
+                extra["token_type_ids"] = extra["token_type_ids"][:, n:last]
+            with torch.inference_mode():
+                if last > n:
+                    model(
+                        input_ids=input_ids[:, n:last],
+                        attention_mask=inputs["attention_mask"][:, :last],
+                        past_key_values=cache,
+                        cache_position=torch.arange(n, last, device=model.device),
+                        use_cache=True,
+                        **extra
+                    )
+                output = model.generate(
+                    input_ids=input_ids,
+                    attention_mask=inputs["attention_mask"],
+                    past_key_values=cache,
+                    max_new_tokens=max_new_tokens,
+                    **generate_kwargs
+                )
+            return self._tokenizer().decode(output[0, input_ids.shape[1]:], skip_special_tokens=True)
+        except Exception as e:
+            # Model/processor without prefix support: use the pipeline from now on
+            print(f"Prefix cache disabled: {e}")
+            self.prefix_cache = False
+            return None
+
+    def _tokenizer(self):
+        return getattr(self.pipe, "tokenizer", None) or self.pipe.processor.tokenizer
 
     def explain_lab_value(self, test_name: str, value: float, unit: str,
                           reference_range: str, status: str) -> str:
@@ -111,30 +514,74 @@ class MedGemmaClient:
         Returns:
             Plain English explanation
         """
+        return self.explain_lab_values_batch([{
+            "test_name": test_name,
+            "value": value,
+            "unit": unit,
+            "reference_range": reference_range,
+            "status": status
+        }])[0]
+
+    def explain_lab_values_batch(self, requests: list[dict]) -> list[str]:
+        """
+        Generate explanations for several lab values in one batched generation.
+
+        Args:
+            requests: Dicts with test_name, value, unit, reference_range, status
+
+        Returns:
+            One explanation per request, in input order
+        """
         self.load_model()
 
-        explanation_prompt = load_prompt("explain").format(
-            test_name=test_name,
-            value=value,
-            unit=unit,
-            reference_range=reference_range,
-            status=status
-        )
+        conversations = [self._explanation_messages(**request) for request in requests]
+        if len(conversations) == 1:
+            response = self._generate_with_prefix(conversations[0], "explain", 256, {})
+            if response is not None:
+                return [response]
 
-        # Text-only query
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": explanation_prompt}
-                ]
-            }
-        ]
+        outputs = self.pipe(conversations, max_new_tokens=256, batch_size=len(conversations))
 
-        output = self.pipe(messages, max_new_tokens=256)
-        response = output[0]["generated_text"][-1]["content"]
+        return [output[0]["generated_text"][-1]["content"] for output in outputs]
 
-        return response
+    def prepare_explanation_stream(self, test_name: str, value: float, unit: str,
+                                   reference_range: str, status: str) -> tuple[Iterator[str], Callable]:
+        """
+        Set up a streamed explanation without starting it.
+
+        Returns:
+            (streamer, generate): iterate the streamer for text chunks while
+            generate() runs the blocking generation on some other thread
+        """
+        self.load_model()
+
+        messages = self._explanation_messages(test_name, value, unit, reference_range, status)
+        streamer = transformers.TextIteratorStreamer(self._tokenizer(), skip_prompt=True, skip_special_tokens=True)
+
+        def generate():
+            try:
+                if self._generate_with_prefix(messages, "explain", 256, {"streamer": streamer}) is None:
+                    self.pipe(messages, max_new_tokens=256, generate_kwargs={"streamer": streamer})
+            except Exception:
+                # Unblock the consumer before propagating
+                streamer.end()
+                raise
+
+        return streamer, generate
+
+    def stream_explanation(self, test_name: str, value: float, unit: str,
+                           reference_range: str, status: str) -> Iterator[str]:
+        """
+        Generate an explanation, yielding text as tokens are produced.
+
+        Yields:
+            Text chunks of the explanation
+        """
+        streamer, generate = self.prepare_explanation_stream(test_name, value, unit, reference_range, status)
+        thread = Thread(target=generate, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
 
 
 # Singleton instance
@@ -151,4 +598,5 @@ def get_client() -> MedGemmaClient:
 if __name__ == "__main__":
     # Test the client
     client = get_client()
-    print(f"MedGemma client initialized. Device: {client.device}")
+    print(f"Loading {client.model_id}...")
+    print(f"Startup timings: {client.warm_up()}, device: {client.device}")
@@ -0,0 +1,219 @@
+"""
+Metrics - Prometheus counters, gauges and histograms for the pipeline
+Minimal in-process registry rendered in the Prometheus text format on /metrics;
+recording is a dict update under a lock, so it is cheap enough for every page
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# Seconds; spans a fast encode (ms) to a slow multi-page inference call (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. pages processed."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Current value, e.g. queue depth. Either set/inc/dec it, or pass `read`: a
+    function called at scrape time that returns a value, or {label values tuple: value}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), read: Optional[Callable] = None):
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.read = read
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> list[str]:
+        if self.read is not None:
+            try:
+                values = self.read()
+            except Exception:
+                # A scrape must never fail because one source is unavailable
+                return []
+            items = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of durations (seconds) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> list[str]:
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+registry = []
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Pipeline metrics. `backend` is the client class doing the work
+# (MedGemmaAPIClient, GeminiClient, MedGemmaClient; BackendRouter for app-side stages when routing)
+stage_seconds = Histogram(
+    "healthvest_stage_seconds",
+    "Time per pipeline stage per page (render, preprocess, encode, inference, parse)",
+    ("stage", "backend"),
+)
+pages_total = Counter("healthvest_pages_total", "Report pages extracted", ("backend",))
+lab_values_total = Counter("healthvest_lab_values_total", "Lab values extracted", ("backend",))
+parse_failures_total = Counter(
+    "healthvest_parse_failures_total", "Extraction responses that were not a complete, valid JSON array", ("backend",)
+)
+generated_tokens_total = Counter(
+    "healthvest_generated_tokens_total", "Tokens generated for extraction", ("backend",)
+)
+pages_waiting = Gauge("healthvest_pages_waiting", "Pages waiting for a MAX_INFLIGHT_PAGES slot")
+requests_total = Counter("healthvest_requests_total", "HTTP requests served", ("endpoint", "status"))
+request_seconds = Histogram("healthvest_request_seconds", "HTTP request latency", ("endpoint",))
+in_flight_requests = Gauge("healthvest_in_flight_requests", "HTTP requests being handled", ("endpoint",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests, their latency and how many are in flight."""
+
+    def __init__(self, app, endpoints: set):
+        self.app = app
+        # Only known paths are labels (ids in /jobs/{id} would explode cardinality)
+        self.endpoints = endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = scope["path"]
+        status = 500
+        start = time.perf_counter()
+
+        async def counted_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight_requests.inc(endpoint=endpoint)
+        try:
+            await self.app(scope, receive, counted_send)
+        finally:
+            in_flight_requests.dec(endpoint=endpoint)
+            request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, status=status)
@@ -4,18 +4,48 @@ Converts lab reports to images for MedGemma processing
 """
 
 import io
+import os
+import time
+import tempfile
 from pathlib import Path
 from PIL import Image
-from typing import Union
+from typing import Iterator, Optional, Union
+
+from image_encoding import mark_source
 
 # Optional: For PDF support
 try:
-    from pdf2image import convert_from_bytes
+    from pdf2image import convert_from_path, pdfinfo_from_path
     PDF_SUPPORT = True
 except ImportError:
     PDF_SUPPORT = False
     print("Warning: pdf2image not installed. PDF support disabled.")
 
+# PDF pages rendered per poppler call, and poppler threads used for a window
+PDF_RENDER_WINDOW = int(os.getenv("PDF_RENDER_WINDOW", "1"))
+PDF_RENDER_THREADS = int(os.getenv("PDF_RENDER_THREADS", "1"))
+
+# Preprocessing path: "legacy" (200 DPI render + resize) or "document"
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "legacy").lower()
+PREPROCESS_MAX_SIZE = int(os.getenv("PREPROCESS_MAX_SIZE", "1568"))
+PREPROCESS_TRIM = os.getenv("PREPROCESS_TRIM", "true").lower() == "true"
+PREPROCESS_DESKEW = os.getenv("PREPROCESS_DESKEW", "true").lower() == "true"
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "true").lower() == "true"
+PREPROCESS_BINARIZE = os.getenv("PREPROCESS_BINARIZE", "false").lower() == "true"
+PREPROCESS_CROP_TABLE = os.getenv("PREPROCESS_CROP_TABLE", "false").lower() == "true"
+
+# Pixels darker than this count as ink when trimming/deskewing
+INK_THRESHOLD = 200
+# Largest skew corrected, and refinement step (degrees)
+MAX_SKEW_DEGREES = 5
+SKEW_STEP_DEGREES = 0.25
+# A text line is a run of pixel rows with at least this mean ink (0-255), this many rows tall
+LINE_MIN_INK = 2
+LINE_MIN_HEIGHT = 3
+
+# Accumulated per-step timings: step -> [calls, total_ms]
+_preprocess_timings = {}
+
 
 def load_report(file_bytes: bytes, filename: str) -> list[Image.Image]:
     """
@@ -28,26 +58,83 @@ def load_report(file_bytes: bytes, filename: str) -> list[Image.Image]:
     Returns:
         List of PIL Images (one per page for PDFs)
     """
+    return list(iter_report_pages(file_bytes, filename))
+
+
+def iter_report_pages(file_bytes: bytes, filename: str,
+                      window: int = PDF_RENDER_WINDOW,
+                      thread_count: int = PDF_RENDER_THREADS,
+                      render_size: Optional[int] = None,
+                      pages: Optional[list[int]] = None) -> Iterator[Image.Image]:
+    """
+    Yield report pages as PIL Images, rendering PDFs a few pages at a time.
+    Only `window` rendered pages exist at once, so memory stays flat for long PDFs.
+
+    Args:
+        file_bytes: Raw file bytes
+        filename: Original filename (used to detect format)
+        window: PDF pages rendered per poppler call
+        thread_count: poppler threads for each call (up to one per page in the window)
+        render_size: Render PDF pages with this longest side instead of at 200 DPI
+        pages: 1-based PDF page numbers to render (default: all), in ascending order
+
+    Yields:
+        PIL Images, one per page, in page order
+    """
     filename_lower = filename.lower()
 
     # Handle PDFs
     if filename_lower.endswith('.pdf'):
         if not PDF_SUPPORT:
             raise ValueError("PDF support not available. Please install pdf2image and poppler.")
-        images = convert_from_bytes(file_bytes, dpi=200)
-        return images
+        # Write once; every window is rendered from the same temp file
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "report.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(file_bytes)
+
+            if pages is None:
+                pages = list(range(1, pdfinfo_from_path(pdf_path)["Pages"] + 1))
+
+            for first_page, last_page in _page_windows(pages, window):
+                # Render straight to the target size rather than 200 DPI + downscale
+                resolution = {"size": render_size} if render_size else {"dpi": 200}
+                yield from convert_from_path(
+                    pdf_path,
+                    **resolution,
+                    first_page=first_page,
+                    last_page=last_page,
+                    thread_count=min(thread_count, last_page - first_page + 1)
+                )
+        return
 
     # Handle images
     if filename_lower.endswith(('.png', '.jpg', '.jpeg', '.webp', '.bmp')):
         image = Image.open(io.BytesIO(file_bytes))
+        image_format = image.format
         # Convert to RGB if necessary
         if image.mode != 'RGB':
             image = image.convert('RGB')
-        return [image]
+        # Unmodified pages can be sent to the API without re-encoding
+        mark_source(image, file_bytes, image_format)
+        yield image
+        return
 
     raise ValueError(f"Unsupported file format: {filename}")
 
 
+def _page_windows(pages: list[int], window: int) -> Iterator[tuple[int, int]]:
+    """Split ascending page numbers into consecutive runs of at most `window` pages."""
+    start = None
+    for i, page in enumerate(pages):
+        if start is None:
+            start = page
+        next_page = pages[i + 1] if i + 1 < len(pages) else None
+        if next_page != page + 1 or page - start + 1 >= window:
+            yield start, page
+            start = None
+
+
 def preprocess_image(image: Image.Image, max_size: int = 1568) -> Image.Image:
     """
     Preprocess image for MedGemma.
@@ -69,14 +156,241 @@ def preprocess_image(image: Image.Image, max_size: int = 1568) -> Image.Image:
     return image
 
 
+def _timed(timings: dict, step: str, start: float):
+    elapsed = (time.perf_counter() - start) * 1000
+    timings[step] = round(elapsed, 2)
+    totals = _preprocess_timings.setdefault(step, [0, 0.0])
+    totals[0] += 1
+    totals[1] += elapsed
+
+
+def _ink_mask(gray: Image.Image) -> Image.Image:
+    """White where there is ink, black where there is paper."""
+    return gray.point(lambda p: 255 if p < INK_THRESHOLD else 0)
+
+
+def _row_profile(mask: Image.Image) -> list[int]:
+    """Mean ink per pixel row (0-255)."""
+    return list(mask.resize((1, mask.size[1]), Image.Resampling.BOX).getdata())
+
+
+def count_text_lines(image: Image.Image) -> int:
+    """Rough number of text lines on a page: runs of inked pixel rows (rules are too thin to count)."""
+    profile = _row_profile(_ink_mask(image.convert("L")))
+    lines, run = 0, 0
+    for ink in profile + [0]:
+        if ink > LINE_MIN_INK:
+            run += 1
+            continue
+        if run >= LINE_MIN_HEIGHT:
+            lines += 1
+        run = 0
+    return lines
+
+
+def trim_margins(page: Image.Image, padding: int = 16) -> Image.Image:
+    """Crop blank paper around the content."""
+    bbox = _ink_mask(page.convert("L")).getbbox()
+    if bbox is None:
+        return page
+    left, top, right, bottom = bbox
+    return page.crop((
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, page.size[0]),
+        min(bottom + padding, page.size[1])
+    ))
+
+
+def detect_skew(page: Image.Image) -> float:
+    """
+    Estimate page rotation in degrees from the row ink profile: text lines
+    give the sharpest row-to-row contrast when they are horizontal.
+    """
+    mask = _ink_mask(page.convert("L"))
+    if mask.size[0] > 600:
+        mask = mask.resize((600, max(int(mask.size[1] * 600 / mask.size[0]), 1)), Image.Resampling.BOX)
+
+    def score(angle: float) -> int:
+        rotated = mask.rotate(angle, resample=Image.Resampling.NEAREST, fillcolor=0)
+        profile = _row_profile(rotated)
+        return sum((b - a) ** 2 for a, b in zip(profile, profile[1:]))
+
+    # Coarse search in whole degrees, then refine around the best angle
+    coarse = range(-int(MAX_SKEW_DEGREES), int(MAX_SKEW_DEGREES) + 1)
+    best_angle = max(coarse, key=score)
+    fine = [best_angle + i * SKEW_STEP_DEGREES for i in range(-int(1 / SKEW_STEP_DEGREES) + 1, int(1 / SKEW_STEP_DEGREES))]
+    return float(max(fine, key=score))
+
+
+def binarize(gray: Image.Image) -> Image.Image:
+    """Black text on white paper using Otsu's threshold."""
+    histogram = gray.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    weight_bg, sum_bg = 0, 0.0
+    best_threshold, best_variance = INK_THRESHOLD, 0.0
+    for t, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = t, variance
+    return gray.point(lambda p: 255 if p > best_threshold else 0)
+
+
+def crop_to_table(page: Image.Image, padding: int = 24) -> Image.Image:
+    """
+    Crop to the tallest block of evenly spaced text lines, which on lab
+    reports is the results table (headers/footers are sparser).
+    """
+    profile = _row_profile(_ink_mask(page.convert("L")))
+
+    # Text lines: runs of rows containing ink
+    lines, start = [], None
+    for y, ink in enumerate(profile + [0]):
+        if ink > 0 and start is None:
+            start = y
+        elif ink == 0 and start is not None:
+            lines.append((start, y))
+            start = None
+    if len(lines) < 4:
+        return page
+
+    gaps = sorted(b[0] - a[1] for a, b in zip(lines, lines[1:]))
+    max_gap = max(gaps[len(gaps) // 2] * 2.5, 4)
+
+    # Longest run of lines separated by ordinary line spacing
+    best, run_start = (0, 0), 0
+    for i in range(1, len(lines) + 1):
+        if i == len(lines) or lines[i][0] - lines[i - 1][1] > max_gap:
+            if lines[i - 1][1] - lines[run_start][0] > best[1] - best[0]:
+                best = (lines[run_start][0], lines[i - 1][1])
+            run_start = i
+
+    # Don't crop to a sliver
+    if best[1] - best[0] < page.size[1] * 0.25:
+        return page
+    return page.crop((0, max(best[0] - padding, 0), page.size[0], min(best[1] + padding, page.size[1])))
+
+
+def preprocess_document(image: Image.Image, max_size: int = PREPROCESS_MAX_SIZE,
+                        trim: bool = PREPROCESS_TRIM, deskew: bool = PREPROCESS_DESKEW,
+                        grayscale: bool = PREPROCESS_GRAYSCALE, binarize_text: bool = PREPROCESS_BINARIZE,
+                        crop_table: bool = PREPROCESS_CROP_TABLE) -> tuple[Image.Image, dict]:
+    """
+    Document-aware preprocessing: fewer, denser pixels for the vision model.
+
+    Args:
+        image: PIL Image of a report page
+        max_size: Maximum dimension after cropping
+        trim: Crop blank margins
+        deskew: Straighten rotated scans
+        grayscale: Send grayscale instead of RGB
+        binarize_text: Reduce to black and white (for clean text scans)
+        crop_table: Crop to the detected results table
+
+    Returns:
+        (preprocessed image, per-step timings in ms)
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    page = image.convert("L") if grayscale or binarize_text else image.convert("RGB")
+    _timed(timings, "convert", start)
+
+    if deskew:
+        start = time.perf_counter()
+        angle = detect_skew(page)
+        if angle:
+            fill = 255 if page.mode == "L" else (255, 255, 255)
+            page = page.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=fill)
+        _timed(timings, "deskew", start)
+
+    if trim:
+        start = time.perf_counter()
+        page = trim_margins(page)
+        _timed(timings, "trim", start)
+
+    if crop_table:
+        start = time.perf_counter()
+        page = crop_to_table(page)
+        _timed(timings, "crop_table", start)
+
+    start = time.perf_counter()
+    page = preprocess_image(page, max_size=max_size)
+    _timed(timings, "resize", start)
+
+    if binarize_text:
+        start = time.perf_counter()
+        page = binarize(page)
+        _timed(timings, "binarize", start)
+
+    return page, timings
+
+
+def preprocess_stats() -> dict:
+    """Average time per document preprocessing step."""
+    return {
+        step: {"calls": calls, "avg_ms": round(total / calls, 2)}
+        for step, (calls, total) in _preprocess_timings.items()
+    }
+
+
 def extract_text_regions(image: Image.Image) -> dict:
     """
     Optional: Use OCR to extract text regions for validation.
     Requires pytesseract and tesseract-ocr installed.
+
+    Returns:
+        raw_text: plain OCR text
+        layout_text: lines in reading order with column gaps kept as runs of spaces
+        confidence: mean word confidence (0-100)
+        word_count: number of recognized words
+        or {"error": ...} when OCR is unavailable
     """
     try:
         import pytesseract
-        text = pytesseract.image_to_string(image)
-        return {"raw_text": text}
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
     except Exception as e:
         return {"error": str(e)}
+
+    # Group words into lines: (block, paragraph, line) -> [(left, top, width, text, conf)]
+    lines = {}
+    confidences = []
+    for i, text in enumerate(data["text"]):
+        text = text.strip()
+        conf = float(data["conf"][i])
+        if not text or conf < 0:
+            continue
+        confidences.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append((data["left"][i], data["top"][i], data["width"][i], text))
+
+    layout_lines, raw_lines = [], []
+    for words in sorted(lines.values(), key=lambda ws: (min(w[1] for w in ws), min(w[0] for w in ws))):
+        words.sort()
+        char_width = max(sum(w[2] for w in words) / max(sum(len(w[3]) for w in words), 1), 1)
+        line, end = "", None
+        for left, _, width, text in words:
+            if end is not None:
+                # Wide gaps become several spaces so table columns stay apart
+                line += " " * min(max(round((left - end) / char_width), 1), 12)
+            line += text
+            end = left + width
+        layout_lines.append(line)
+        raw_lines.append(" ".join(w[3] for w in words))
+
+    return {
+        "raw_text": "\n".join(raw_lines),
+        "layout_text": "\n".join(layout_lines),
+        "confidence": round(sum(confidences) / len(confidences), 1) if confidences else 0.0,
+        "word_count": len(confidences)
+    }
@@ -0,0 +1,79 @@
+"""
+Request Trace - Records the shape of production traffic for load replay
+One JSON line per request: arrival offset, endpoint, body size, page count,
+status and latency. No filenames, report contents or lab values are recorded.
+"""
+
+import os
+import json
+import time
+from contextvars import ContextVar
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# JSONL file to append the trace to (empty disables recording);
+# replay it with benchmarks/loadgen.py --trace
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+
+# Only the work-carrying endpoints; polling and health checks would drown the mix
+TRACE_ENDPOINTS = {"/analyze", "/analyze/stream", "/explain", "/jobs"}
+
+# Entry of the request being handled, so handlers can add what only they know
+_current: ContextVar[Optional[dict]] = ContextVar("request_trace", default=None)
+
+
+def note(**fields):
+    """Add fields (e.g. pages=3) to the current request's trace entry, if it is being traced."""
+    entry = _current.get()
+    if entry is not None:
+        entry.update(fields)
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware appending one entry per traced request to TRACE_PATH.
+    Latency is measured to the last body chunk, so streamed responses count in full.
+    """
+
+    def __init__(self, app, path: str = TRACE_PATH):
+        self.app = app
+        self.path = path
+        self.started = time.time()
+        self.recorded = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in TRACE_ENDPOINTS or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        start = time.perf_counter()
+        entry = {
+            "t": round(time.time() - self.started, 3),
+            "endpoint": scope["path"],
+            "bytes": int(headers.get(b"content-length", 0)),
+        }
+        token = _current.set(entry)
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                entry["status"] = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                entry["ms"] = round((time.perf_counter() - start) * 1000, 1)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current.reset(token)
+            entry.setdefault("status", 500)
+            entry.setdefault("ms", round((time.perf_counter() - start) * 1000, 1))
+            self._write(entry)
+
+    def _write(self, entry: dict):
+        # Small append per request; lines from concurrent requests never interleave
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.recorded += 1
@@ -0,0 +1,311 @@
+"""
+Resilience - Client-side protection for the inference APIs
+Adaptive token-bucket rate limiting, retries with jittered backoff under a
+global retry budget, and a circuit breaker per provider
+"""
+
+import os
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Starting request rate per provider (requests/second) and burst size; the rate
+# adapts to 429s and rate-limit headers between PROVIDER_MIN_RATE and PROVIDER_MAX_RATE
+PROVIDER_RATE = float(os.getenv("PROVIDER_RATE", "10"))
+PROVIDER_BURST = int(os.getenv("PROVIDER_BURST", "10"))
+PROVIDER_MIN_RATE = float(os.getenv("PROVIDER_MIN_RATE", "0.5"))
+PROVIDER_MAX_RATE = float(os.getenv("PROVIDER_MAX_RATE", "50"))
+# Retries per call, backoff base/cap (seconds, full jitter), and the share of
+# requests that may be retries across all providers
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "20"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = float(os.getenv("RETRY_BUDGET_MIN", "10"))
+# Consecutive failures (5xx / network) that open the breaker, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# 429 means slow down (rate limiter); 5xx means the provider is struggling (breaker)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class ProviderUnavailableError(Exception):
+    """The provider is throttling or down; the caller should retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float = BREAKER_RESET_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """Retry-After as seconds (delta or HTTP date); None if absent or unparseable."""
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate follows the provider: halved on 429 (and paused for
+    Retry-After), set from rate-limit headers when present, and raised slowly on success.
+    """
+
+    def __init__(self, rate: float = PROVIDER_RATE, burst: int = PROVIDER_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait for a token (FIFO across callers)."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+
+    def on_response(self, status_code: int, headers: httpx.Headers):
+        """Adapt the rate to one response."""
+        now = time.monotonic()
+        if status_code == 429:
+            self.throttled += 1
+            self.rate = max(PROVIDER_MIN_RATE, self.rate / 2)
+            retry_after = retry_after_seconds(headers)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            return
+
+        remaining = headers.get("x-ratelimit-remaining") or headers.get("ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset") or headers.get("ratelimit-reset")
+        try:
+            remaining, reset = float(remaining), float(reset)
+        except (TypeError, ValueError):
+            remaining = reset = None
+        if remaining is not None and reset:
+            if reset > 1e9:
+                # Epoch timestamp rather than seconds until reset
+                reset = max(reset - time.time(), 1.0)
+            # Spread what is left of the window evenly over the time until it resets
+            self.rate = min(PROVIDER_MAX_RATE, max(PROVIDER_MIN_RATE, remaining / reset))
+        elif status_code < 400:
+            # Additive increase: probe back up after throttling
+            self.rate = min(PROVIDER_MAX_RATE, self.rate + 0.1)
+
+    def stats(self) -> dict:
+        return {
+            "rate": round(self.rate, 2),
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 1),
+        }
+
+
+class RetryBudget:
+    """
+    Caps retries at a share of requests (plus a small floor), so a provider
+    outage can't turn into a retry storm. Shared by all providers.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, minimum: float = RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.tokens = minimum
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        """Credit one new (non-retry) request."""
+        self.tokens = min(self.tokens + self.ratio, self.minimum + 100 * self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take one retry if the budget allows."""
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> dict:
+        return {"tokens": round(self.tokens, 1), "retries": self.retries, "exhausted": self.exhausted}
+
+
+retry_budget = RetryBudget()
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURES consecutive failures and fails fast until the
+    reset timeout; then lets one probe through (half-open) to test recovery.
+    A probe that ends without an outcome (cancelled, unexpected error) must be
+    released; one that is never released is given up on after the reset timeout.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    def check(self) -> bool:
+        """
+        Raise ProviderUnavailableError if calls should fail fast right now.
+        Returns True if this call is the half-open probe (see release_probe).
+        """
+        if self.state == "closed":
+            return False
+        now = time.monotonic()
+        remaining = self.opened_at + self.reset_seconds - now
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open" and self.probing and now - self.probe_started > self.reset_seconds:
+            # The probe never reported back; let another one through
+            self.probing = False
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            self.probe_started = now
+            return True
+        self.rejected += 1
+        raise ProviderUnavailableError(
+            f"{self.name} unavailable (circuit open)", retry_after=max(remaining, 1.0)
+        )
+
+    def release_probe(self):
+        """Free the probe slot if the probe ended without recording an outcome."""
+        if self.state == "half_open":
+            self.probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures,
+                "opened": self.opened, "rejected": self.rejected}
+
+
+class ProviderGuard:
+    """
+    Rate limiter + circuit breaker for one provider, and the retry decision
+    for each attempt. Used by HTTPPool around every request it sends.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.limiter = AdaptiveRateLimiter()
+        self.breaker = CircuitBreaker(name)
+
+    async def before(self, attempt: int) -> bool:
+        """
+        Gate one attempt: fail fast if the breaker is open, then wait for a token.
+        Returns True if the attempt is the breaker's half-open probe; the caller
+        must call release() once the attempt is over, however it ends.
+        """
+        probe = self.breaker.check()
+        if attempt == 0:
+            retry_budget.deposit()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.release(probe)
+            raise
+        return probe
+
+    def release(self, probe: bool):
+        """End of an attempt: free the probe slot if it never recorded an outcome."""
+        if probe:
+            self.breaker.release_probe()
+
+    def retry_delay(self, attempt: int, response: Optional[httpx.Response] = None,
+                    error: Optional[Exception] = None) -> Optional[float]:
+        """
+        Record the outcome of an attempt. Returns how long to wait before
+        retrying, or None to give up (success, non-retryable, or out of budget).
+        """
+        retry_after = None
+        if response is not None:
+            self.limiter.on_response(response.status_code, response.headers)
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                # 2xx/4xx (including 429): the provider is up
+                self.breaker.record_success()
+            if response.status_code not in RETRYABLE_STATUS:
+                return None
+            retry_after = retry_after_seconds(response.headers)
+            if retry_after is not None and retry_after > RETRY_BACKOFF_MAX:
+                # Longer than a request should wait: let the caller surface it
+                return None
+        else:
+            self.breaker.record_failure()
+
+        if attempt >= PROVIDER_MAX_RETRIES or self.breaker.state == "open":
+            return None
+        if not retry_budget.withdraw():
+            return None
+        # Full jitter, but never sooner than the provider asked for
+        backoff = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+        return max(backoff, retry_after or 0.0)
+
+    def unavailable(self, error: Exception) -> ProviderUnavailableError:
+        """
+        What to raise for a network error that won't be retried (already counted
+        as a breaker failure): an outage like a 502/503, not an internal error.
+        """
+        retry_after = self.breaker.reset_seconds if self.breaker.state == "open" else 1.0
+        return ProviderUnavailableError(
+            f"{self.name} unreachable: {type(error).__name__}: {error}", retry_after=retry_after
+        )
+
+    def stats(self) -> dict:
+        return {
+            "limiter": self.limiter.stats(),
+            "breaker": self.breaker.stats(),
+            "retry_budget": retry_budget.stats(),
+        }
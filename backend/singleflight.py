@@ -0,0 +1,41 @@
+"""
+Single Flight - Coalesces identical concurrent computations
+The first caller for a key runs the work; duplicates that arrive while it is
+in flight wait for the same result instead of starting their own
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Per-key in-flight deduplication (results are not kept once the work finishes)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        # key -> task running the work
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable]):
+        """
+        Run work() for this key, or join the run already in flight.
+        A caller that is cancelled stops waiting without cancelling the shared work.
+        """
+        task = self.calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(work())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -17,6 +17,7 @@ load_dotenv()
 # Import our clients
 from medgemma_api import get_client
 from report_parser import load_report, preprocess_image
+from lab_ranges import compute_statuses
 
 
 async def test_extraction(file_path: str):
@@ -72,9 +73,10 @@ async def test_extraction(file_path: str):
         print('='*60)
         print(f"Total tests found: {len(all_results)}")
 
-        normal = sum(1 for r in all_results if r.get('status') == 'normal')
-        high = sum(1 for r in all_results if r.get('status') == 'high')
-        low = sum(1 for r in all_results if r.get('status') == 'low')
+        statuses = [status for _, status in compute_statuses(all_results)]
+        normal = statuses.count('normal')
+        high = statuses.count('high')
+        low = statuses.count('low')
 
         print(f"  Normal: {normal}")
         print(f"  High: {high}")
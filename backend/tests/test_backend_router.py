@@ -0,0 +1,111 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+import resilience
+import medgemma_api
+from backend_router import BackendRouter
+from json_stream import LabRows
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from mock_server import create_app  # noqa: E402
+
+
+def mock_backend(monkeypatch, cls, error_rate: float = 0.0, rows: int = 5):
+    """Real API client whose pool talks to the benchmark mock server in process."""
+    monkeypatch.setattr(medgemma_api, "HF_API_BASE", "http://mock")
+    monkeypatch.setattr(medgemma_api, "GEMINI_API_BASE", "http://mock")
+    monkeypatch.setenv("HF_TOKEN", "test")
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    client = cls()
+    app = create_app(latency_ms=0, jitter_ms=0, token_ms=0, rows=rows, error_rate=error_rate)
+    client.pool.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    return client
+
+
+class FakeBackend:
+    """Answers after a fixed delay; records whether it was cancelled."""
+
+    def __init__(self, name: str, delay: float):
+        self.model_id = name
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def explain_lab_value(self, *args):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.model_id
+
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "PROVIDER_MAX_RETRIES", 0)
+
+
+def test_fails_over_to_next_backend(monkeypatch):
+    router = BackendRouter({
+        "medgemma": mock_backend(monkeypatch, medgemma_api.MedGemmaAPIClient, error_rate=1.0),
+        "gemini": mock_backend(monkeypatch, medgemma_api.GeminiClient, rows=5),
+    })
+
+    async def run():
+        try:
+            return await router.extract_lab_values_from_text("Hemoglobin 14.2 g/dL 13.0 - 17.0")
+        finally:
+            await router.aclose()
+
+    rows = asyncio.run(run())
+    assert isinstance(rows, LabRows) and rows.complete
+    assert len(rows) == 5
+    assert router.failovers == 1
+    assert router.backend_stats["medgemma"].errors == 1
+    # The failed backend now ranks after the one that worked
+    assert router.ranked("extract_text") == ["gemini", "medgemma"]
+
+
+def test_all_backends_failing_raises_last_error(monkeypatch):
+    router = BackendRouter({
+        "medgemma": mock_backend(monkeypatch, medgemma_api.MedGemmaAPIClient, error_rate=1.0),
+        "gemini": mock_backend(monkeypatch, medgemma_api.GeminiClient, error_rate=1.0),
+    })
+
+    async def run():
+        try:
+            await router.extract_lab_values_from_text("Hemoglobin 14.2")
+        finally:
+            await router.aclose()
+
+    with pytest.raises(resilience.ProviderUnavailableError):
+        asyncio.run(run())
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    slow, fast = FakeBackend("slow", delay=1.0), FakeBackend("fast", delay=0.01)
+    router = BackendRouter({"slow": slow, "fast": fast})
+    # Enough history for a latency percentile: "slow" is usually quick
+    for _ in range(10):
+        router.backend_stats["slow"].record("explain", 0.02, ok=True)
+        router.backend_stats["fast"].record("explain", 0.05, ok=True)
+
+    result = asyncio.run(router.explain_lab_value("Hemoglobin", 14.2, "g/dL", "13.0 - 17.0", "normal"))
+    assert result == "fast"
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+    assert slow.cancelled
+
+
+def test_no_hedge_without_latency_history():
+    slow, fast = FakeBackend("slow", delay=0.05), FakeBackend("fast", delay=0.01)
+    router = BackendRouter({"slow": slow, "fast": fast})
+
+    result = asyncio.run(router.explain_lab_value("Hemoglobin", 14.2, "g/dL", "13.0 - 17.0", "normal"))
+    assert result == "slow"
+    assert router.hedges == 0
+    assert fast.calls == 0
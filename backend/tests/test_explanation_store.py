@@ -0,0 +1,42 @@
+import pytest
+
+from explanation_store import ExplanationStore, store_key, templatize, VALUE_MARK
+
+
+@pytest.mark.parametrize("text, value, expected", [
+    ("Your value is 15.0 mg/dL.", 15.0, f"Your value is {VALUE_MARK} mg/dL."),
+    # Integer form of a whole float
+    ("Your value is 15 mg/dL.", 15.0, f"Your value is {VALUE_MARK} mg/dL."),
+    ("Your value is 14.5.", 14.5, f"Your value is {VALUE_MARK}."),
+    # Not inside longer numbers
+    ("Your value 14.5 is close to 14.50", 14.5, f"Your value {VALUE_MARK} is close to 14.50"),
+    ("At 5.0 you are in range 3.55 - 5.05", 5.0, f"At {VALUE_MARK} you are in range 3.55 - 5.05"),
+])
+def test_templatize(text, value, expected):
+    assert templatize(text, value) == expected
+
+
+@pytest.mark.parametrize("text, value", [
+    # Value not in the text: storing it would not be patient-neutral
+    ("Your result is slightly high.", 15.0),
+    # Also a range bound: ambiguous
+    ("Your value 5.0 is at the top of 3.5 - 5.0", 5.0),
+])
+def test_templatize_skips_ambiguous(text, value):
+    assert templatize(text, value) is None
+
+
+def test_store_key_includes_reference_range():
+    same = store_key("Hemoglobin", 11.0, "g/dL", "12.0 - 15.5", "low")
+    assert same == store_key("Hb", 11.0, "G/DL", "12-15.5", "low")
+    assert same != store_key("Hemoglobin", 11.0, "g/dL", "13.0 - 17.0", "low")
+
+
+def test_explanation_not_served_for_a_different_range(tmp_path):
+    store = ExplanationStore(str(tmp_path / "explanations.bin"))
+    text = "Your hemoglobin of 11.0 g/dL is below the normal range of 12.0–15.5 g/dL."
+    store.put("Hemoglobin", 11.0, "g/dL", "12.0 - 15.5", "low", text)
+
+    assert store.get("Hemoglobin", 10.9, "g/dL", "12.0 - 15.5", "low") == text.replace("11.0", "10.9")
+    # Another lab's range: the stored text quotes the wrong bounds
+    assert store.get("Hemoglobin", 11.0, "g/dL", "13.0 - 17.0", "low") is None
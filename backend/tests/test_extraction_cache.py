@@ -0,0 +1,54 @@
+from PIL import Image, ImageDraw
+
+from extraction_cache import ExtractionCache
+from json_stream import LabArrayParser, LabRows
+
+ROWS = [{"test_name": "Hemoglobin", "value": "14.2", "unit": "g/dL", "reference_range": "13.0 - 17.0"}]
+
+
+def page(text: str = "Hemoglobin 14.2 g/dL") -> Image.Image:
+    image = Image.new("L", (600, 800), "white")
+    ImageDraw.Draw(image).text((40, 40), text, fill="black")
+    return image
+
+
+def test_put_then_get_from_memory_and_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ExtractionCache(path)
+    key = cache.key_for(page(), "model")
+    assert cache.get(key) is None
+    cache.put(key, ROWS)
+    assert cache.get(key) == ROWS
+    assert cache.counters["hits_memory"] == 1
+
+    # New process: served from SQLite
+    reopened = ExtractionCache(path)
+    assert reopened.get(reopened.key_for(page(), "model")) == ROWS
+    assert reopened.counters["hits_disk"] == 1
+
+
+def test_key_depends_on_prompt_and_model(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    image = page()
+    key = cache.key_for(image, "model", ("extract",))
+    assert key.digest == cache.key_for(image, "model", ("extract",)).digest
+    # Constrained decoding extracts with a different prompt file
+    assert key.context != cache.key_for(image, "model", ("extract_constrained",)).context
+    assert key.context != cache.key_for(image, "model", ("extract", "extract_constrained")).context
+    assert key.context != cache.key_for(image, "other-model", ("extract",)).context
+    assert key.digest != cache.key_for(page("Hemoglobin 14.3 g/dL"), "model").digest
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"), ttl=0, disk_ttl=0)
+    key = cache.key_for(page(), "model")
+    cache.put(key, ROWS)
+    assert cache.get(key) is None
+
+
+def test_lab_rows_complete_only_for_closed_array():
+    parser = LabArrayParser()
+    parser.feed('[{"test_name": "Hemoglobin", "value": "14.2", "unit": "g/dL", "reference_range": "13.0 - 17.0"},')
+    assert not LabRows(parser.rows, complete=parser.ok).complete
+    parser.feed("]")
+    assert LabRows(parser.rows, complete=parser.ok).complete
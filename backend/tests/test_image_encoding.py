@@ -0,0 +1,50 @@
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import image_encoding
+from image_encoding import encode_image, mark_source
+
+
+def text_page(mode: str = "RGB") -> Image.Image:
+    image = Image.new(mode, (800, 1000), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(20):
+        draw.text((40, 40 + row * 45), f"Analyte {row}    {10 + row * 0.7:.1f}    mg/dL    5 - 15", fill="black")
+    return image
+
+
+def photo_page() -> Image.Image:
+    image = Image.new("RGB", (400, 400))
+    image.putdata([(x % 256, (x * 3) % 256, 128) for x in range(400 * 400)])
+    return image
+
+
+def test_text_scan_uses_16_level_palette(monkeypatch):
+    monkeypatch.setattr(image_encoding, "IMAGE_CODEC", "auto")
+    encoded = encode_image(text_page())
+    assert (encoded.codec, encoded.mime_type) == ("palette", "image/png")
+
+    decoded = Image.open(BytesIO(encoded.data))
+    assert decoded.mode == "P"
+    assert len(decoded.convert("L").getcolors()) <= 16
+
+
+def test_color_page_uses_jpeg(monkeypatch):
+    monkeypatch.setattr(image_encoding, "IMAGE_CODEC", "auto")
+    assert encode_image(photo_page()).codec == "jpeg"
+
+
+def test_unmodified_upload_is_passed_through():
+    buffer = BytesIO()
+    text_page().save(buffer, format="PNG")
+    image = Image.open(BytesIO(buffer.getvalue()))
+    image.load()
+    mark_source(image, buffer.getvalue(), "PNG")
+
+    encoded = encode_image(image)
+    assert encoded.codec == "passthrough"
+    assert encoded.data == buffer.getvalue()
+
+    # Resized since upload: re-encoded
+    assert encode_image(image.resize((400, 500))).codec != "passthrough"
@@ -0,0 +1,52 @@
+import time
+import asyncio
+
+import pytest
+
+from jobs import JobRunner, JobStore, expand_upload, JOBS_MAX_FILE_BYTES
+
+
+def test_expand_upload_rejects_unsupported_and_oversize_files():
+    assert expand_upload("report.pdf", b"%PDF") == [("report.pdf", b"%PDF")]
+    with pytest.raises(ValueError):
+        expand_upload("notes.txt", b"hello")
+    with pytest.raises(ValueError):
+        expand_upload("scan.png", b"\0" * (JOBS_MAX_FILE_BYTES + 1))
+
+
+def test_notify_during_claim_is_not_lost(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    claim_next = store.claim_next
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        first_claim = True
+
+        async def process(data, filename):
+            done.set()
+            return {"filename": filename}
+
+        runner = JobRunner(store, process, workers=1)
+
+        def racing_claim():
+            # A submit lands after the queue was found empty, before the worker waits
+            nonlocal first_claim
+            result = claim_next()
+            if first_claim:
+                first_claim = False
+                store.create_job([("report.pdf", b"%PDF")])
+                loop.call_soon_threadsafe(runner.notify)
+            return result
+
+        store.claim_next = racing_claim
+        await runner.start()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=3)
+        finally:
+            await runner.aclose()
+        return time.monotonic() - start
+
+    # Without the fix the job waits for the 5 s poll
+    assert asyncio.run(run()) < 1
@@ -0,0 +1,52 @@
+import pytest
+
+from json_stream import (
+    LabArrayParser, parse_lab_values, token_budget, EXTRACT_MIN_NEW_TOKENS, EXTRACT_MAX_NEW_TOKENS
+)
+
+RESPONSE = (
+    'Here are the results:\n```json\n[\n'
+    '  {"test_name": "Hemoglobin", "value": "14.2", "unit": "g/dL", "reference_range": "13.0 - 17.0"},\n'
+    '  {"test_name": "Note [a]", "value": "1,250", "unit": "{cells}", "reference_range": "\\"<\\" 2000"}\n'
+    ']\n```\nThe values above were copied from the report. [1]'
+)
+
+
+def test_rows_parsed_across_any_chunking():
+    for size in (1, 3, 7, len(RESPONSE)):
+        parser = LabArrayParser()
+        rows = []
+        for i in range(0, len(RESPONSE), size):
+            rows.extend(parser.feed(RESPONSE[i:i + size]))
+        assert [row["test_name"] for row in rows] == ["Hemoglobin", "Note [a]"]
+        assert rows[1]["reference_range"] == '"<" 2000'
+        assert parser.ok
+
+
+def test_stops_at_end_of_array():
+    parser = LabArrayParser()
+    parser.feed('[{"test_name": "A"}] [{"test_name": "B"}]')
+    assert parser.done
+    assert parser.rows == [{"test_name": "A"}]
+
+
+def test_bracketed_prose_before_the_array_is_skipped():
+    assert parse_lab_values('See [note] below. [{"test_name": "A"}]') == [{"test_name": "A"}]
+
+
+@pytest.mark.parametrize("response", [
+    # Truncated by the token budget
+    '[{"test_name": "A"}, {"test_name": "B", "val',
+    # Malformed row
+    '[{"test_name": "A"}, {"test_name": B}]',
+])
+def test_incomplete_or_invalid_array_is_not_ok(response):
+    parser = LabArrayParser()
+    parser.feed(response)
+    assert parser.rows == [{"test_name": "A"}]
+    assert not parser.ok
+
+
+def test_token_budget_bounds():
+    assert token_budget(0) == EXTRACT_MIN_NEW_TOKENS
+    assert token_budget(10_000) == EXTRACT_MAX_NEW_TOKENS
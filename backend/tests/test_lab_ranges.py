@@ -0,0 +1,80 @@
+import pytest
+
+from lab_ranges import parse_value, parse_range, compute_statuses
+
+
+@pytest.mark.parametrize("raw, number, qualifier, flag", [
+    (14.2, 14.2, None, None),
+    ("14.2", 14.2, None, None),
+    ("1,250", 1250.0, None, None),
+    ("1,50,000", 150000.0, None, None),
+    ("12,3", 12.3, None, None),
+    (".5", 0.5, None, None),
+    ("-1.5", -1.5, None, None),
+    ("+2", 2.0, None, None),
+    ("−3", -3.0, None, None),
+    ("<0.5", 0.5, "<", None),
+    ("≥ 90", 90.0, ">=", None),
+    ("12.3 H", 12.3, None, "H"),
+    ("12.3 (L)", 12.3, None, "L"),
+    ("Positive", None, None, None),
+    (None, None, None, None),
+])
+def test_parse_value(raw, number, qualifier, flag):
+    value = parse_value(raw)
+    assert value.number == number
+    assert value.qualifier == qualifier
+    assert value.flag == flag
+
+
+@pytest.mark.parametrize("text, intervals", [
+    ("13.0 - 17.0", [(13.0, 17.0, None)]),
+    ("13 to 17", [(13.0, 17.0, None)]),
+    ("150 – 410", [(150.0, 410.0, None)]),
+    ("-2 to +2", [(-2.0, 2.0, None)]),
+    ("-5 - -1", [(-5.0, -1.0, None)]),
+    ("<200", [(None, 200.0, None)]),
+    ("up to 40", [(None, 40.0, None)]),
+    (">= 40", [(40.0, None, None)]),
+    ("M: 13-17 / F: 12-15", [(13.0, 17.0, "M"), (12.0, 15.0, "F")]),
+    ("Male 13-17, Female 12-15", [(13.0, 17.0, "M"), (12.0, 15.0, "F")]),
+    ("Desirable: <200 mg/dL; Borderline: 200-239; High: >=240", [(None, 200.0, None)]),
+    ("Optimal: <100, Near optimal: 100-129, Borderline high: 130-159", [(None, 100.0, None)]),
+    ("Deficiency: <20, Insufficiency: 20-30, Sufficiency: 30-100", [(30.0, 100.0, None)]),
+    ("Non-diabetic: <5.7, Prediabetes: 5.7-6.4, Diabetes: >=6.5", [(None, 5.7, None)]),
+    ("Normal: 70-100", [(70.0, 100.0, None)]),
+])
+def test_parse_range(text, intervals):
+    spec = parse_range(text)
+    assert [(i.low, i.high, i.sex) for i in spec.intervals] == intervals
+
+
+@pytest.mark.parametrize("text", [
+    "", "N/A", "-", "Negative",
+    # Tiered without a normal tier: not decidable
+    "Borderline: 200-239; High: >=240",
+])
+def test_parse_range_not_understood(text):
+    assert parse_range(text) is None
+
+
+@pytest.mark.parametrize("value, reference_range, sex, status", [
+    ("14.2", "13.0 - 17.0", None, "normal"),
+    ("12.1", "13.0 - 17.0", None, "low"),
+    ("18", "13.0 - 17.0", None, "high"),
+    ("-1.5", "-2 to +2", None, "normal"),
+    ("-2.5", "-2 to +2", None, "low"),
+    ("150", "Desirable: <200 mg/dL; Borderline: 200-239", None, "normal"),
+    ("210", "Desirable: <200 mg/dL; Borderline: 200-239", None, "high"),
+    ("25", "Deficiency: <20, Insufficiency: 20-30, Sufficiency: 30-100", None, "low"),
+    ("210", "Borderline: 200-239; High: >=240", None, "unknown"),
+    ("<0.5", "0.5 - 2.0", None, "low"),
+    (">2000", "100 - 2000", None, "high"),
+    ("12.5", "M: 13-17 / F: 12-15", "F", "normal"),
+    ("12.5", "M: 13-17 / F: 12-15", "M", "low"),
+    ("Positive", "Negative", None, "unknown"),
+    ("12.3 H", "N/A", None, "high"),
+])
+def test_compute_statuses(value, reference_range, sex, status):
+    [(_, computed)] = compute_statuses([{"value": value, "reference_range": reference_range}], sex=sex)
+    assert computed == status
@@ -0,0 +1,130 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import resilience
+from medgemma_api import HTTPPool
+from resilience import AdaptiveRateLimiter, CircuitBreaker, ProviderUnavailableError, RetryBudget
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(resilience, "retry_budget", RetryBudget())
+
+
+def pool_with(handler) -> HTTPPool:
+    pool = HTTPPool("test")
+    pool.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pool
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failures=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(3):
+        assert breaker.check() is False
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(ProviderUnavailableError):
+        breaker.check()
+    assert breaker.rejected == 1
+
+
+def test_breaker_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failures=1, reset_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.check() is True
+    # Second caller while the probe is out
+    with pytest.raises(ProviderUnavailableError):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_released_probe_frees_the_slot():
+    breaker = CircuitBreaker("test", failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.check() is True
+    breaker.release_probe()
+    assert breaker.check() is True
+
+
+def test_retry_budget_caps_retries():
+    budget = RetryBudget(ratio=0.5, minimum=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.exhausted == 1
+
+
+def test_rate_limiter_adapts_to_throttling_and_headers():
+    limiter = AdaptiveRateLimiter(rate=10, burst=1)
+    limiter.on_response(429, httpx.Headers({"retry-after": "2"}))
+    assert limiter.rate == 5
+    assert limiter.paused_until > 0
+    limiter.on_response(200, httpx.Headers({"x-ratelimit-remaining": "30", "x-ratelimit-reset": "10"}))
+    assert limiter.rate == 3
+    limiter.on_response(200, httpx.Headers())
+    assert limiter.rate == pytest.approx(3.1)
+
+
+def test_post_retries_5xx_then_succeeds():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503 if len(calls) < 3 else 200, json={})
+
+    async def run():
+        pool = pool_with(handler)
+        response = await pool.post("http://provider/generate", timeout=5)
+        await pool.aclose()
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+    assert len(calls) == 3
+
+
+def test_post_network_error_is_provider_unavailable():
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def run():
+        pool = pool_with(handler)
+        try:
+            await pool.post("http://provider/generate", timeout=5)
+        finally:
+            await pool.aclose()
+        return pool
+
+    with pytest.raises(ProviderUnavailableError) as error:
+        asyncio.run(run())
+    assert isinstance(error.value.__cause__, httpx.ConnectError)
+    assert error.value.retry_after >= 1
+
+
+def test_stream_network_error_counts_toward_breaker(monkeypatch):
+    monkeypatch.setattr(resilience, "PROVIDER_MAX_RETRIES", 2)
+
+    def handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    pool = pool_with(handler)
+
+    async def run():
+        async with pool.stream("http://provider/generate", timeout=5):
+            pass
+
+    with pytest.raises(ProviderUnavailableError):
+        asyncio.run(run())
+    # First attempt plus two retries, each a breaker failure
+    assert pool.requests == 3
+    assert pool.guard.breaker.failures == 3
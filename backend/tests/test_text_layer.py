@@ -0,0 +1,95 @@
+import pytest
+
+from text_layer import parse_line, parse_page, TEXT_LAYER_MIN_CONFIDENCE
+
+HEADER = "Test Name              Result     Unit        Reference Range"
+
+
+def test_parse_line_row():
+    row, confidence = parse_line("Hemoglobin             14.2       g/dL        13.0 - 17.0")
+    assert row == {"test_name": "Hemoglobin", "value": "14.2", "unit": "g/dL", "reference_range": "13.0 - 17.0"}
+    assert confidence == 1.0
+
+
+def test_parse_line_flag_column():
+    row, _ = parse_line("Platelet Count         120   L    10^3/uL     150 - 410")
+    assert row["value"] == "120 L"
+
+
+def test_parse_line_rejects_non_result_lines():
+    # Demographics: no reference range, text between name and number
+    assert parse_line("Patient Name   Yash M. Patel   Age   21 Years") is None
+    assert parse_line("Age            21         Years") is None
+    # Method column between the name and the value
+    assert parse_line("MCV            Calculated  88   fL    80 - 100") is None
+
+
+def test_parse_page_only_reads_after_header():
+    page = "\n".join([
+        "Patient Name   Yash M. Patel   Age   21 Years",
+        "Glucose        95      mg/dL      70 - 100",
+        HEADER,
+        "Hemoglobin             14.2       g/dL        13.0 - 17.0",
+        "Total Leukocyte Count  7.8        10^3/uL     4.0 - 11.0",
+        "Vitamin D              18         ng/mL       < 30",
+    ])
+    rows, confidence = parse_page(page)
+    assert [row["test_name"] for row in rows] == ["Hemoglobin", "Total Leukocyte Count", "Vitamin D"]
+    assert confidence >= TEXT_LAYER_MIN_CONFIDENCE
+
+
+def test_parse_page_without_header_is_not_trusted():
+    page = "\n".join([
+        "Hemoglobin             14.2       g/dL        13.0 - 17.0",
+        "Total Leukocyte Count  7.8        10^3/uL     4.0 - 11.0",
+        "Vitamin D              18         ng/mL       < 30",
+    ])
+    assert parse_page(page) == ([], 0.0)
+
+
+def test_parse_page_unparsed_rows_lower_confidence():
+    page = "\n".join([
+        HEADER,
+        "Hemoglobin             14.2       g/dL        13.0 - 17.0",
+        "Total Leukocyte Count  7.8        10^3/uL     4.0 - 11.0",
+        "Vitamin D              18         ng/mL       < 30",
+        # Single-space gaps: not split into cells, so missed
+        "RBC Count 4.2 mill/cumm 4.5 - 5.5",
+        "MCV 88 fL 80 - 100",
+    ])
+    rows, confidence = parse_page(page)
+    assert len(rows) == 3
+    assert confidence < TEXT_LAYER_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize("line, expected", [
+    # Value | Range | Unit (sample_reports/preview_drlogy.png layout)
+    ("Total RBC count   5.2   4.5 - 5.5   mill/cumm",
+     {"test_name": "Total RBC count", "value": "5.2", "unit": "mill/cumm", "reference_range": "4.5 - 5.5"}),
+    # Value | Flag | Range | Unit
+    ("Hemoglobin (Hb)   12.5   Low   13.0 - 17.0   g/dL",
+     {"test_name": "Hemoglobin (Hb)", "value": "12.5 Low", "unit": "g/dL", "reference_range": "13.0 - 17.0"}),
+    ("Platelet Count   150000   Borderline   150000 - 410000   cumm",
+     {"test_name": "Platelet Count", "value": "150000", "unit": "cumm", "reference_range": "150000 - 410000"}),
+])
+def test_parse_line_unit_after_range(line, expected):
+    row, confidence = parse_line(line)
+    assert row == expected
+    assert confidence == 1.0
+
+
+def test_parse_line_rejects_second_unit():
+    assert parse_line("Hemoglobin   12.5   g/dL   13.0 - 17.0   g/dL") is None
+
+
+def test_parse_page_range_before_unit():
+    page = "\n".join([
+        "Investigation          Result            Reference Value    Unit",
+        "Hemoglobin (Hb)        12.5     Low      13.0 - 17.0        g/dL",
+        "Total RBC count        5.2               4.5 - 5.5          mill/cumm",
+        "Packed Cell Volume     57.5     High     40 - 50            %",
+        "Mean Corpuscular Volume  87.75           83 - 101           fL",
+    ])
+    rows, confidence = parse_page(page)
+    assert len(rows) == 4
+    assert confidence >= TEXT_LAYER_MIN_CONFIDENCE
@@ -0,0 +1,175 @@
+"""
+Text Layer - Reads lab values straight from born-digital PDFs
+Uses poppler's layout-preserving text output, so no vision model call is needed
+"""
+
+import os
+import re
+import tempfile
+import subprocess
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TEXT_LAYER = os.getenv("TEXT_LAYER", "true").lower() == "true"
+TEXT_LAYER_MIN_ROWS = int(os.getenv("TEXT_LAYER_MIN_ROWS", "3"))
+TEXT_LAYER_MIN_CONFIDENCE = float(os.getenv("TEXT_LAYER_MIN_CONFIDENCE", "0.75"))
+
+# Columns in -layout output are separated by runs of spaces
+CELL_SPLIT = re.compile(r"\s{2,}|\t")
+VALUE_PATTERN = re.compile(r"^([<>]=?)?\s*(\d[\d,]*(?:\.\d+)?)\s*([HL]|High|Low|\*)?$", re.IGNORECASE)
+RANGE_PATTERN = re.compile(
+    r"^(?:\d[\d,]*(?:\.\d+)?\s*[-–]\s*\d[\d,]*(?:\.\d+)?|(?:<|>|<=|>=|≤|≥|up\s*to)\s*\d[\d,]*(?:\.\d+)?)$",
+    re.IGNORECASE
+)
+UNIT_PATTERN = re.compile(r"^(?:%|[a-zA-Zµμ][a-zA-Zµμ0-9/^.*]*(?:/[a-zA-Z0-9.^µμ]+)*|10\^\d+/[a-zA-Zµμ]+)$")
+NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9 ,()./%+\-]{1,60}$")
+# A line that reads like a result row (has a range in it), parsed or not
+ROW_HINT = re.compile(r"\d\s*[-–]\s*\d|(?:<|>|≤|≥)\s*\d")
+FLAG_PATTERN = re.compile(r"^(?:H|L|High|Low|Borderline|\*)$", re.IGNORECASE)
+HEADER_WORDS = {
+    "test", "test name", "investigation", "parameter", "result", "results",
+    "value", "unit", "units", "reference", "reference range", "reference value", "biological reference interval",
+    "normal range", "method", "specimen", "sample"
+}
+
+stats = {"pages_parsed": 0, "pages_fallback": 0}
+
+
+def extract_text_pages(file_bytes: bytes) -> list[str]:
+    """
+    Layout-preserving text of every PDF page (empty list if pdftotext is unavailable).
+    Scanned pages come back empty or nearly empty.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "report.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(file_bytes)
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", pdf_path, "-"],
+                capture_output=True,
+                timeout=30
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return []
+
+    if result.returncode != 0:
+        return []
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext ends the last page with a form feed too
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+
+def _split_value_unit(cell: str) -> tuple[str, Optional[str]]:
+    """'14.2 g/dL' -> ('14.2', 'g/dL')."""
+    parts = cell.split(None, 1)
+    if len(parts) == 2 and VALUE_PATTERN.match(parts[0]) and UNIT_PATTERN.match(parts[1]):
+        return parts[0], parts[1]
+    return cell, None
+
+
+def is_header(line: str) -> bool:
+    """Column header of a results table: at least two header words as cells."""
+    cells = [c.strip().lower().strip(":") for c in CELL_SPLIT.split(line.strip()) if c.strip()]
+    return sum(cell in HEADER_WORDS for cell in cells) >= 2
+
+
+def parse_line(line: str) -> Optional[tuple[dict, float]]:
+    """
+    Parse one results-table line into a lab value row and its confidence (0-1).
+    The value must be the cell right after the name, and a reference range is
+    required: that is what tells a result row from "Age   21 Years". A flag column
+    may sit before the range, and the unit on either side of it
+    (Value | Unit | Range or Value | Flag | Range | Unit).
+    """
+    cells = [c.strip() for c in CELL_SPLIT.split(line.strip()) if c.strip()]
+    if len(cells) < 3:
+        return None
+
+    name = cells[0]
+    if not NAME_PATTERN.match(name) or name.lower().strip(":") in HEADER_WORDS:
+        return None
+
+    value_text, unit = _split_value_unit(cells[1])
+    if not VALUE_PATTERN.match(value_text):
+        return None
+
+    reference_range, column_flag = None, None
+    for cell in cells[2:]:
+        if column_flag is None and reference_range is None and FLAG_PATTERN.match(cell):
+            # H/L flag printed in its own column next to the value
+            column_flag = cell
+        elif reference_range is None and RANGE_PATTERN.match(cell):
+            reference_range = cell
+        elif unit is None and UNIT_PATTERN.match(cell):
+            unit = cell
+        else:
+            # Text the table layout doesn't account for (method, comment, merged cells)
+            return None
+
+    if reference_range is None:
+        return None
+    if column_flag and column_flag.lower() != "borderline":
+        # Borderline has no value flag form; the status comes from the range anyway
+        value_text = f"{value_text} {column_flag}"
+
+    # Status is computed from the reference range downstream (lab_ranges)
+    confidence = 0.7 + 0.3 * (unit is not None)
+    row = {
+        "test_name": name.rstrip(":"),
+        "value": value_text,
+        "unit": unit or "",
+        "reference_range": reference_range
+    }
+    return row, confidence
+
+
+def parse_page(text: str) -> tuple[list[dict], float]:
+    """
+    Parse the rows of the results table(s) on a page: lines after a column header.
+
+    Returns:
+        (rows, confidence) where confidence is the mean row confidence scaled
+        by recall (lines that look like results but didn't parse lower it),
+        or 0 when no header or too few rows were found to trust the page
+    """
+    rows, confidences, missed = [], [], 0
+    in_table = False
+    for line in text.splitlines():
+        if is_header(line):
+            in_table = True
+            continue
+        if not in_table:
+            continue
+        parsed = parse_line(line)
+        if parsed is not None:
+            rows.append(parsed[0])
+            confidences.append(parsed[1])
+        elif ROW_HINT.search(line) and re.match(r"\s*[A-Za-z]", line):
+            missed += 1
+
+    if len(rows) < TEXT_LAYER_MIN_ROWS:
+        return rows, 0.0
+    recall = len(rows) / (len(rows) + missed)
+    return rows, sum(confidences) / len(confidences) * recall
+
+
+def parse_pages(file_bytes: bytes) -> list[Optional[list[dict]]]:
+    """
+    Rows for every page that the text layer can answer confidently;
+    None for pages that need the vision model. Empty list if the PDF has no text layer.
+    """
+    results = []
+    for text in extract_text_pages(file_bytes):
+        rows, confidence = parse_page(text)
+        if rows and confidence >= TEXT_LAYER_MIN_CONFIDENCE:
+            stats["pages_parsed"] += 1
+            results.append(rows)
+        else:
+            stats["pages_fallback"] += 1
+            results.append(None)
+    return results